@@ -28,9 +28,15 @@ let db;
 
 app.use(express.json());
 
-// Define a route to get all dealerships with optional state and ID filters
+// Page sizes accepted by the paginated form of /dealerships/get
+const DEFAULT_PAGE_SIZE = 25;
+const MAX_PAGE_SIZE = 200;
+
+// Define a route to get all dealerships with optional state and ID filters.
+// Passing `limit` and/or `bookmark` returns one page as { docs, bookmark },
+// the bookmark of a page fetches the next one.
 app.get('/dealerships/get', (req, res) => {
-	const { state, id } = req.query;
+	const { state, id, limit, bookmark } = req.query;
 
 	// Create a selector object based on query parameters
 	const selector = {};
@@ -42,15 +48,23 @@ app.get('/dealerships/get', (req, res) => {
 		selector.id = parseInt(id); // Filter by "id" with a value of 1
 	}
 
+	const paged = limit !== undefined || bookmark !== undefined;
+	const pageSize = Math.min(parseInt(limit, 10) || DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE);
+
 	const queryOptions = {
 		selector,
-		limit: 10, // Limit the number of documents returned to 10
+		limit: paged ? pageSize : 10, // Unpaged requests return at most 10 documents
 	};
+	if (bookmark) {
+		queryOptions.bookmark = bookmark;
+	}
 
 	db.find(queryOptions, (err, body) => {
 		if (err) {
 			console.error('Error fetching dealerships:', err);
 			res.status(500).json({ error: 'An error occurred while fetching dealerships.' });
+		} else if (paged) {
+			res.json({ docs: body.docs, bookmark: body.bookmark });
 		} else {
 			const dealerships = body.docs;
 			res.json(dealerships);
@@ -1,8 +1,17 @@
 from cloudant.client import Cloudant
+from cloudant.error import CloudantDatabaseException
 from cloudant.query import Query
-from flask import Flask, jsonify, request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import Flask, Response, abort, jsonify, request, stream_with_context
 import atexit
+import click
+import hashlib
+import json
 import os
+import queue
+import requests
+import threading
 
 # Add your Cloudant service credentials here
 cloudant_username = os.environ.get("IBM_USERNAME", None)
@@ -19,6 +28,143 @@ db = client["reviews"]
 
 app = Flask(__name__)
 
+# Page sizes accepted by the paginated form of /api/get_reviews
+max_page_size = 200
+stream_page_size = 100
+
+# Changes returned per request by /api/reviews/changes
+max_changes = 10000
+
+# Documents written per _bulk_docs request by /api/post_reviews
+bulk_chunk_size = int(os.environ.get("BULK_CHUNK_SIZE", 500))
+
+# Per-dealer aggregates of the reviews, a map/reduce view maintained by
+# Cloudant on every write (see djangoapp/indexes.py in the Django app)
+stats_design_doc = "_design/djangoapp-stats"
+stats_view = "dealer-stats"
+
+# Fields every review must have
+required_fields = [
+    "id",
+    "name",
+    "dealership",
+    "review",
+    "purchase",
+    "purchase_date",
+    "car_make",
+    "car_model",
+    "car_year",
+]
+
+# Sentiment service used to score reviews once, when they are written
+sentiment_url = os.environ.get(
+    "SENTIMENT_URL",
+    "https://sn-watson-sentiment-bert.labs.skills.network/v1/watson.runtime.nlp.v1/NlpService/SentimentPredict",
+)
+sentiment_model_id = os.environ.get(
+    "SENTIMENT_MODEL_ID", "sentiment_aggregated-bert-workflow_lang_multi_stock"
+)
+sentiment_timeout = float(os.environ.get("SENTIMENT_TIMEOUT", 10))
+sentiment_session = requests.Session()
+
+
+def analyze_sentiment(text):
+    """Score a review text with the sentiment service.
+
+    Returns:
+        Tuple: The (label, score) of the text, (None, None) on failure
+    """
+    try:
+        response = sentiment_session.post(
+            sentiment_url,
+            json={"raw_document": {"text": text}},
+            headers={"grpc-metadata-mm-model-id": sentiment_model_id},
+            timeout=sentiment_timeout,
+        )
+        response.raise_for_status()
+        document_sentiment = response.json()["documentSentiment"]
+        return document_sentiment["label"], document_sentiment["score"]
+    except (requests.exceptions.RequestException, KeyError, ValueError) as err:
+        print(f"Sentiment analysis failed: {err}")
+        return None, None
+
+
+def score_review(doc_id):
+    """Analyze a stored review and persist its sentiment on the document."""
+    doc = db[doc_id]
+    label, score = analyze_sentiment(doc.get("review", ""))
+    if label is None:
+        return
+    for _ in range(3):
+        doc["sentiment"] = label
+        doc["score"] = score
+        try:
+            doc.save()
+            return
+        except requests.exceptions.HTTPError as err:
+            # Someone else updated the document, retry on the latest revision
+            if err.response is None or err.response.status_code != 409:
+                raise
+            doc.fetch()
+
+
+# Reviews waiting to be scored, by document id
+sentiment_queue = queue.Queue()
+
+
+def sentiment_worker():
+    while True:
+        doc_id = sentiment_queue.get()
+        if doc_id is None:
+            break
+        try:
+            score_review(doc_id)
+        except Exception:
+            app.logger.exception("Unable to score review %s", doc_id)
+        finally:
+            sentiment_queue.task_done()
+
+
+sentiment_thread = threading.Thread(target=sentiment_worker, daemon=True)
+sentiment_thread.start()
+
+
+@atexit.register
+def stop_sentiment_worker():
+    sentiment_queue.put(None)
+    sentiment_thread.join(timeout=5)
+
+
+def review_set_version(dealership_id):
+    """Return the version of the reviews of a dealer.
+
+    It is a hash of the dealer row of the stats view, which changes
+    whenever a review of the dealer is added, scored or deleted.
+
+    Returns:
+        str: The version, None when the stats view is not available
+    """
+    try:
+        result = db.get_view_result(
+            stats_design_doc,
+            stats_view,
+            raw_result=True,
+            group=True,
+            keys=[dealership_id],
+        )
+    except (requests.exceptions.HTTPError, CloudantDatabaseException) as err:
+        print(f"Review set version unavailable: {err}")
+        return None
+    rows = result.get("rows", [])
+    value = rows[0]["value"] if rows else None
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+def with_etag(response, etag):
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
 
 @app.route("/api/get_reviews", methods=["GET"])
 def get_reviews():
@@ -34,9 +180,56 @@ def get_reviews():
     except ValueError:
         return jsonify({"error": "'id' parameter must be an integer"}), 400
 
+    # Responses carry an ETag derived from the review set version and the
+    # query string. A client sending it back gets a 304 and the reviews are
+    # not queried at all.
+    version = review_set_version(dealership_id)
+    etag = None
+    if version is not None:
+        etag = hashlib.sha1(
+            f"{version}\0{request.query_string.decode()}".encode()
+        ).hexdigest()
+        if request.if_none_match.contains(etag):
+            return with_etag(Response(status=304), etag)
+
     # Define the query based on the 'dealership' ID
     selector = {"dealership": dealership_id}
 
+    # format=jsonl streams every review as one JSON document per line,
+    # straight from the query result, which is fetched page by page
+    if request.args.get("format") == "jsonl":
+        result = db.get_query_result(selector, page_size=stream_page_size)
+
+        def generate():
+            for doc in result:
+                yield json.dumps(doc) + "\n"
+
+        response = Response(
+            stream_with_context(generate()), mimetype="application/x-ndjson"
+        )
+        return with_etag(response, etag)
+
+    # limit and/or bookmark return one page as {"docs": [...], "bookmark": ...},
+    # the bookmark of a page fetches the next one
+    limit = request.args.get("limit")
+    bookmark = request.args.get("bookmark")
+    if limit is not None or bookmark is not None:
+        try:
+            limit = int(limit) if limit is not None else max_page_size
+        except ValueError:
+            return jsonify({"error": "'limit' parameter must be an integer"}), 400
+        if not 0 < limit <= max_page_size:
+            return (
+                jsonify({"error": f"'limit' must be between 1 and {max_page_size}"}),
+                400,
+            )
+        options = {"limit": limit}
+        if bookmark:
+            options["bookmark"] = bookmark
+        page = db.get_query_result(selector, raw_result=True, **options)
+        response = jsonify({"docs": page["docs"], "bookmark": page.get("bookmark")})
+        return with_etag(response, etag)
+
     # Execute the query using the query method
     result = db.get_query_result(selector)
 
@@ -48,7 +241,86 @@ def get_reviews():
         data_list.append(doc)
 
     # Return the data as JSON
-    return jsonify(data_list)
+    return with_etag(jsonify(data_list), etag)
+
+
+def dealer_stats_row(dealership, stats):
+    """Turn the reduced view value of a dealer into its stats.
+
+    The view emits [1, purchased, positive, neutral, negative, time] per
+    review and reduces them with _stats, one summary per position.
+    """
+    count, purchased, positive, neutral, negative, latest = stats
+    latest_review_time = None
+    if latest["max"] > 0:
+        latest_review_time = datetime.utcfromtimestamp(latest["max"]).isoformat()
+    return {
+        "dealership": dealership,
+        "review_count": int(count["sum"]),
+        "purchase_count": int(purchased["sum"]),
+        "sentiment": {
+            "positive": int(positive["sum"]),
+            "neutral": int(neutral["sum"]),
+            "negative": int(negative["sum"]),
+        },
+        "latest_review_time": latest_review_time,
+    }
+
+
+@app.route("/api/get_dealer_stats", methods=["GET"])
+def get_dealer_stats():
+    """Return the review stats of the dealers in "ids", or of every dealer.
+
+    The stats are read from the reduced view, so the cost does not depend
+    on the number of reviews. Dealers without reviews are left out.
+    """
+    options = {"group": True}
+    ids = request.args.get("ids")
+    if ids:
+        try:
+            options["keys"] = [int(id) for id in ids.split(",")]
+        except ValueError:
+            return jsonify({"error": "'ids' must be integers separated by commas"}), 400
+    result = db.get_view_result(
+        stats_design_doc, stats_view, raw_result=True, **options
+    )
+    rows = result["rows"]
+    return jsonify([dealer_stats_row(row["key"], row["value"]) for row in rows])
+
+
+@app.route("/api/reviews/changes", methods=["GET"])
+def get_review_changes():
+    """Return the reviews written since a sequence, from the changes feed.
+
+    "since" is the last_seq of the previous answer, the feed starts over
+    from "0". Deleted reviews come with "deleted" set and no doc.
+    """
+    since = request.args.get("since", "0")
+    try:
+        limit = min(int(request.args.get("limit", 1000)), max_changes)
+    except ValueError:
+        return jsonify({"error": "'limit' parameter must be an integer"}), 400
+    # A page of at most 0 results would always be reported as pending
+    if limit < 1:
+        return jsonify({"error": "'limit' must be at least 1"}), 400
+    response = client.r_session.get(
+        db.database_url + "/_changes",
+        params={"since": since, "limit": limit, "include_docs": "true"},
+    )
+    response.raise_for_status()
+    feed = response.json()
+    results = [
+        {"id": row["id"], "deleted": row.get("deleted", False), "doc": row.get("doc")}
+        for row in feed["results"]
+        if not row["id"].startswith("_design/")
+    ]
+    return jsonify(
+        {
+            "results": results,
+            "last_seq": feed["last_seq"],
+            "pending": len(feed["results"]) >= limit,
+        }
+    )
 
 
 @app.route("/api/post_review", methods=["POST"])
@@ -56,30 +328,183 @@ def post_review():
     if not request.json:
         abort(400, description="Invalid JSON data")
 
-    # Extract review data from the request JSON
+    # Extract review data from the request JSON, the Django app wraps it
+    # as {"review": {...}}
     review_data = request.json
+    if isinstance(review_data.get("review"), dict):
+        review_data = review_data["review"]
 
     # Validate that the required fields are present in the review data
-    required_fields = [
-        "id",
-        "name",
-        "dealership",
-        "review",
-        "purchase",
-        "purchase_date",
-        "car_make",
-        "car_model",
-        "car_year",
-    ]
     for field in required_fields:
         if field not in review_data:
             abort(400, description=f"Missing required field: {field}")
 
-    # Save the review data as a new document in the Cloudant database
-    db.create_document(review_data)
+    # A review sent with an idempotency key is stored under a document id
+    # derived from it, so posting it again does not store a duplicate
+    set_review_id(review_data)
+
+    # Save the review data as a new document in the Cloudant database, its
+    # sentiment is added in the background once scored
+    try:
+        doc = db.create_document(review_data, throw_on_exists=True)
+    except CloudantDatabaseException as err:
+        if err.status_code != 409:
+            raise
+        return jsonify({"message": "Review already posted"}), 200
+    sentiment_queue.put(doc["_id"])
 
     return jsonify({"message": "Review posted successfully"}), 201
 
 
+def set_review_id(review_data):
+    """Derive the document id of a review from its idempotency key, if any."""
+    idempotency_key = review_data.get("idempotency_key")
+    if idempotency_key:
+        review_data["_id"] = f"review-{idempotency_key}"
+
+
+def validate_reviews(docs):
+    """Check a batch of reviews for the required fields, field by field.
+
+    Returns:
+        Dict: The error message of every invalid review, by index in docs
+    """
+    errors = {
+        index: "Review must be a JSON object"
+        for index, doc in enumerate(docs)
+        if not isinstance(doc, dict)
+    }
+    objects = [(index, doc) for index, doc in enumerate(docs) if index not in errors]
+    for field in required_fields:
+        for index, doc in objects:
+            if field not in doc and index not in errors:
+                errors[index] = f"Missing required field: {field}"
+    return errors
+
+
+def iter_posted_reviews():
+    """Yield the reviews of a bulk request body, as (review, parse error).
+
+    A JSON-lines body is read line by line as it arrives, a JSON array is
+    parsed whole.
+    """
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        for line in request.stream:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line), None
+            except ValueError as err:
+                yield None, f"Invalid JSON: {err}"
+        return
+    docs = request.get_json(silent=True)
+    if not isinstance(docs, list):
+        abort(400, description="Expected a JSON array or JSON lines of reviews")
+    for doc in docs:
+        yield doc, None
+
+
+def write_reviews(chunk, report):
+    """Validate a chunk of (index, review), write the valid ones at once."""
+    errors = validate_reviews([doc for _, doc in chunk])
+    valid = []
+    for position, (index, doc) in enumerate(chunk):
+        if position in errors:
+            report["errors"].append(
+                {"index": index, "error": "invalid", "reason": errors[position]}
+            )
+        else:
+            set_review_id(doc)
+            valid.append((index, doc))
+    if not valid:
+        return
+    outcomes = db.bulk_docs([doc for _, doc in valid])
+    for (index, doc), outcome in zip(valid, outcomes):
+        if "error" not in outcome:
+            report["created"] += 1
+        elif outcome["error"] == "conflict" and doc.get("idempotency_key"):
+            # Already stored under its idempotency key
+            report["exists"] += 1
+        else:
+            report["errors"].append(
+                {
+                    "index": index,
+                    "id": outcome.get("id"),
+                    "error": outcome["error"],
+                    "reason": outcome.get("reason"),
+                }
+            )
+
+
+@app.route("/api/post_reviews", methods=["POST"])
+def post_reviews():
+    """Store many reviews, sent as a JSON array or as JSON lines.
+
+    Reviews are validated and written in chunks of bulk_chunk_size with
+    one _bulk_docs request each. The answer counts the reviews created and
+    those already stored under their idempotency key, and lists every
+    review that was not written with its index in the request.
+
+    The reviews are not queued for scoring, a bulk load would outgrow the
+    sentiment worker. Score them with ``flask backfill-sentiment``.
+    """
+    report = {"created": 0, "exists": 0, "errors": []}
+    chunk = []
+    for index, (doc, parse_error) in enumerate(iter_posted_reviews()):
+        if parse_error is not None:
+            report["errors"].append(
+                {"index": index, "error": "invalid", "reason": parse_error}
+            )
+            continue
+        chunk.append((index, doc))
+        if len(chunk) >= bulk_chunk_size:
+            write_reviews(chunk, report)
+            chunk = []
+    if chunk:
+        write_reviews(chunk, report)
+    report["errors"].sort(key=lambda error: error["index"])
+    return jsonify(report), 200
+
+
+@app.cli.command("backfill-sentiment")
+@click.option("--batch-size", default=200, help="Documents written per bulk request.")
+@click.option("--workers", default=8, help="Concurrent sentiment requests.")
+def backfill_sentiment(batch_size, workers):
+    """Score every stored review that has no sentiment yet."""
+    selector = {"sentiment": {"$exists": False}}
+    last_id = ""
+    scored = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            # Page on _id rather than with a bookmark, the documents scored
+            # stop matching the selector while it is read
+            page = db.get_query_result(
+                dict(selector, _id={"$gt": last_id}),
+                raw_result=True,
+                sort=[{"_id": "asc"}],
+                limit=batch_size,
+            )
+            batch = page["docs"]
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+            texts = [doc.get("review", "") for doc in batch]
+            sentiments = list(executor.map(analyze_sentiment, texts))
+            updates = []
+            for doc, (label, score) in zip(batch, sentiments):
+                if label is not None:
+                    doc["sentiment"] = label
+                    doc["score"] = score
+                    updates.append(doc)
+            if not updates:
+                continue
+            for outcome in db.bulk_docs(updates):
+                if "error" in outcome:
+                    click.echo(f"{outcome['id']}: {outcome['error']}", err=True)
+                else:
+                    scored += 1
+    click.echo(f"Scored {scored} reviews")
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,91 @@
+"""
+Tests of the review service, run from the functions directory:
+
+    python -m unittest test_reviews
+"""
+import unittest
+from unittest import mock
+
+# The service connects to Cloudant when it is imported
+with mock.patch("cloudant.client.Cloudant.iam"):
+    import reviews
+
+
+class ReviewChangesTests(unittest.TestCase):
+    def setUp(self):
+        self.client = reviews.app.test_client()
+
+    def test_limit_below_1_is_rejected(self):
+        with mock.patch.object(reviews.client.r_session, "get") as get:
+            response = self.client.get("/api/reviews/changes?limit=0")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("limit", response.get_json()["error"])
+        get.assert_not_called()
+
+    def test_full_page_is_pending(self):
+        feed = {
+            "results": [
+                {"id": "r1", "doc": {"review": "Great"}},
+                {"id": "_design/djangoapp", "doc": {}},
+            ],
+            "last_seq": "2-abc",
+        }
+        with mock.patch.object(reviews.client.r_session, "get") as get:
+            get.return_value.json.return_value = feed
+            response = self.client.get("/api/reviews/changes?since=0&limit=2")
+        body = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result["id"] for result in body["results"]], ["r1"])
+        self.assertEqual(body["last_seq"], "2-abc")
+        self.assertTrue(body["pending"])
+
+
+REVIEW = {
+    "id": 1,
+    "name": "Berkly Shepley",
+    "dealership": 1,
+    "review": "Total grid-enabled service-desk",
+    "purchase": True,
+    "purchase_date": "07/11/2020",
+    "car_make": "Audi",
+    "car_model": "A6",
+    "car_year": 2010,
+}
+
+
+class SentimentTests(unittest.TestCase):
+    def test_bulk_reviews_are_not_queued_for_scoring(self):
+        client = reviews.app.test_client()
+        with mock.patch.object(
+            reviews.db, "bulk_docs", return_value=[{"id": "r1", "ok": True}]
+        ), mock.patch.object(reviews.sentiment_queue, "put") as put:
+            response = client.post("/api/post_reviews", json=[REVIEW])
+        self.assertEqual(response.get_json()["created"], 1)
+        put.assert_not_called()
+
+    def test_backfill_pages_on_document_ids(self):
+        pages = [
+            {"docs": [{"_id": "a", "review": "x"}, {"_id": "b", "review": "y"}]},
+            {"docs": [{"_id": "c", "review": "z"}]},
+            {"docs": []},
+        ]
+        with mock.patch.object(
+            reviews.db, "get_query_result", side_effect=pages
+        ) as query, mock.patch.object(
+            reviews, "analyze_sentiment", return_value=("positive", 0.9)
+        ), mock.patch.object(
+            reviews.db, "bulk_docs", side_effect=lambda docs: [{}] * len(docs)
+        ) as bulk_docs:
+            result = reviews.app.test_cli_runner().invoke(
+                args=["backfill-sentiment", "--batch-size", "2"]
+            )
+        self.assertIn("Scored 3 reviews", result.output)
+        self.assertEqual(
+            [call.args[0]["_id"] for call in query.call_args_list],
+            [{"$gt": ""}, {"$gt": "b"}, {"$gt": "c"}],
+        )
+        self.assertEqual(bulk_docs.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
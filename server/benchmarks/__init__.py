@@ -0,0 +1,20 @@
+"""Benchmarks and load tests for the Django tier, run from the server directory."""
+import atexit
+import shutil
+import tempfile
+
+
+def use_own_cache(env):
+    """
+    Point the cache settings of env at a fresh file cache, removed on exit,
+    so a benchmark neither reads nor clears the cache of a server running
+    on the same host, nor the cache of an earlier run.
+
+    Returns:
+        dict: env.
+    """
+    location = tempfile.mkdtemp(prefix="djangoapp-benchmark-cache-")
+    atexit.register(shutil.rmtree, location, ignore_errors=True)
+    env["CACHE_BACKEND"] = "django.core.cache.backends.filebased.FileBasedCache"
+    env["CACHE_LOCATION"] = location
+    return env
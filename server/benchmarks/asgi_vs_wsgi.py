@@ -0,0 +1,111 @@
+"""
+Compare the sync (WSGI) and async (ASGI) deployments under load.
+
+Both modes run under gunicorn with the same number of workers, against
+the local upstream services (djangoapp.localstore) with an injected
+latency. The dealer and page fragment caches are disabled so that every
+page waits on upstream calls, and each mode starts from a cache of its
+own. Run from the server directory:
+
+    python -m benchmarks.asgi_vs_wsgi --latency 0.1 --concurrency 100
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from . import use_own_cache
+from .loadgen import run_load
+from djangoapp.localstore import LocalServices
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "wsgi": ["djangobackend.wsgi"],
+    "asgi": ["--worker-class", "uvicorn.workers.UvicornWorker", "djangobackend.asgi"],
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def run_mode(mode, upstream, args):
+    port = _free_port()
+    env = dict(os.environ, **upstream.urls())
+    env.update(
+        SERVER_MODE=mode,
+        DEALER_CACHE_TTL="0",
+        DEALER_LIST_CACHE_TTL="0",
+        DEALER_CACHE_STALE_TTL="0",
+        DEALER_FRAGMENT_CACHE_TTL="0",
+    )
+    use_own_cache(env)
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "--bind",
+        f"127.0.0.1:{port}",
+        "--workers",
+        str(args.workers),
+        "--log-level",
+        "warning",
+    ] + MODES[mode]
+    server = subprocess.Popen(command, cwd=SERVER_DIR, env=env)
+    try:
+        _wait_for_port(port)
+        base = f"http://localhost:{port}/djangoapp"
+        urls = [f"{base}/dealer/{id}/" for id in range(1, args.dealers + 1)]
+        # Warm up the workers and the sentiment cache
+        run_load(urls, len(urls) * 2, args.workers)
+        return run_load(urls, args.requests, args.concurrency)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--dealers", type=int, default=50)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    results = {"parameters": vars(args), "modes": {}}
+    with LocalServices(latency=args.latency) as upstream:
+        for mode in MODES:
+            results["modes"][mode] = run_mode(mode, upstream, args)
+
+    print(f"{'mode':<6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for mode, summary in results["modes"].items():
+        print(
+            f"{mode:<6}{summary['throughput']:>10}{summary['p50_ms']:>10}"
+            f"{summary['p95_ms']:>10}{summary['p99_ms']:>10}{summary['errors']:>8}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Synthetic dealers and reviews, shaped like the sample data.
+
+Values are drawn from the vocabulary of ``cloudant/data`` (states, cities,
+car makes and models, review words) with a seeded generator, so the same
+arguments always produce the same data. Run from the server directory to
+write files in the format of the sample data:
+
+    python -m benchmarks.datagen --dealers 10000 --reviews 1000000 --out-dir data
+"""
+import argparse
+import json
+import os
+import random
+
+from djangoapp.localstore import load_json_data
+
+
+class Vocabulary:
+    """Values seen in the sample data."""
+
+    def __init__(self):
+        dealers = load_json_data("dealerships.json", "dealerships")
+        reviews = load_json_data("reviews-full.json", "reviews")
+        self.places = sorted({(d["city"], d["state"], d["st"]) for d in dealers})
+        self.names = sorted({d["short_name"] for d in dealers})
+        self.cars = sorted({(r["car_make"], r["car_model"]) for r in reviews})
+        self.reviewers = sorted({r["name"] for r in reviews})
+        self.words = sorted({w.lower() for r in reviews for w in r["review"].split()})
+
+
+def generate_dealers(count, seed=0, vocabulary=None):
+    """
+    Yield count dealers with ids 1 to count.
+    """
+    vocabulary = vocabulary or Vocabulary()
+    rng = random.Random(seed)
+    for id in range(1, count + 1):
+        city, state, st = rng.choice(vocabulary.places)
+        short_name = rng.choice(vocabulary.names)
+        yield {
+            "id": id,
+            "city": city,
+            "state": state,
+            "st": st,
+            "address": f"{rng.randint(1, 9999)} {rng.choice(vocabulary.words).title()} Street",
+            "zip": f"{rng.randint(10000, 99999)}",
+            "lat": round(rng.uniform(25.0, 49.0), 4),
+            "long": round(rng.uniform(-124.0, -67.0), 4),
+            "short_name": short_name,
+            "full_name": f"{short_name} Car Dealership",
+        }
+
+
+def generate_reviews(count, dealers, seed=0, vocabulary=None):
+    """
+    Yield count reviews spread over dealer ids 1 to dealers.
+
+    Dealer popularity is skewed: a tenth of the reviews go to the first
+    percent of the dealers, so some dealer pages are ten times heavier
+    than the others.
+    """
+    vocabulary = vocabulary or Vocabulary()
+    rng = random.Random(seed + 1)
+    popular = max(1, dealers // 100)
+    for id in range(1, count + 1):
+        if rng.random() < 0.1:
+            dealership = rng.randint(1, popular)
+        else:
+            dealership = rng.randint(1, dealers)
+        car_make, car_model = rng.choice(vocabulary.cars)
+        purchase = rng.random() < 0.7
+        yield {
+            "id": id,
+            "name": rng.choice(vocabulary.reviewers),
+            "dealership": dealership,
+            "review": " ".join(rng.choices(vocabulary.words, k=rng.randint(3, 40))).capitalize(),
+            "purchase": purchase,
+            "purchase_date": f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(2010, 2023)}",
+            "car_make": car_make,
+            "car_model": car_model,
+            "car_year": rng.randint(1990, 2023),
+        }
+
+
+def write_json(path, key, docs):
+    """
+    Write docs as {key: [...]} one document at a time, in constant memory.
+    """
+    with open(path, "w") as f:
+        f.write('{\n  "%s": [\n' % key)
+        for index, doc in enumerate(docs):
+            if index:
+                f.write(",\n")
+            f.write("    " + json.dumps(doc))
+        f.write("\n  ]\n}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dealers", type=int, default=1000)
+    parser.add_argument("--reviews", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out-dir", required=True)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    vocabulary = Vocabulary()
+    write_json(
+        os.path.join(args.out_dir, "dealerships.json"),
+        "dealerships",
+        generate_dealers(args.dealers, args.seed, vocabulary),
+    )
+    write_json(
+        os.path.join(args.out_dir, "reviews-full.json"),
+        "reviews",
+        generate_reviews(args.reviews, args.dealers, args.seed, vocabulary),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Benchmark the fragment cache of the dealer pages.
+
+Hot dealer pages are viewed repeatedly, with the fragment cache disabled
+(DEALER_FRAGMENT_CACHE_TTL=0) and enabled, through the Django test client
+against `djangoapp.localstore.LocalServices` answering after an injected
+latency, as in `benchmarks.pages`. The template rendering alone is timed
+too, from data fetched once, with the fragments missing and cached, which
+is the render time the fragment cache saves. Run from the server
+directory:
+
+    python -m benchmarks.fragments --dealers 1000 --reviews 100000 --hot 20
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+import django
+
+from . import use_own_cache
+from .loadgen import summarize
+from .pages import build_store, reset_caches
+
+MODES = (("uncached", 0), ("fragments", None))
+
+
+def time_requests(client, paths, repeat):
+    """
+    Returns:
+        dict: The summary of repeat views of every path, see
+        `benchmarks.loadgen.summarize`.
+    """
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            began = time.perf_counter()
+            response = client.get(path)
+            latencies.append(time.perf_counter() - began)
+            errors += response.status_code != 200
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def time_renders(template_name, contexts, repeat, cold):
+    """
+    Returns:
+        float: The median milliseconds to render the template from each
+        context, dropping the cached fragments before every render if cold.
+    """
+    from django.template.loader import render_to_string
+    from django.test import RequestFactory
+
+    from djangoapp.fragments import fragment_cache
+
+    request = RequestFactory().get("/")
+    timings = []
+    for _ in range(repeat):
+        for context in contexts:
+            if cold:
+                fragment_cache().clear()
+            started = time.perf_counter()
+            render_to_string(template_name, context, request=request)
+            timings.append(time.perf_counter() - started)
+    timings.sort()
+    return round(timings[len(timings) // 2] * 1000, 3)
+
+
+def render_contexts(dealer_ids, page_size):
+    """
+    Fetch the data of the hot pages once.
+
+    Returns:
+        dict: The contexts of the dealer details pages and of the listing
+        pages, by template name.
+    """
+    from django.conf import settings
+
+    from djangoapp import restapis, views
+    from djangoapp.fragments import Deferred, review_set_version, review_set_versions
+
+    details = []
+    for id in dealer_ids:
+        data = Deferred(None)
+        data.set(
+            (
+                restapis.get_dealer_by_id_from_cf(settings.DEALERSHIPS_API_URL, id=id),
+                restapis.get_dealer_reviews_from_cf(settings.REVIEWS_API_URL, id=id),
+            )
+        )
+        details.append(
+            views.dealer_details_context(id, review_set_version(id), data)
+        )
+    dealers = [
+        restapis.get_dealer_by_id_from_cf(settings.DEALERSHIPS_API_URL, id=id)
+        for id in dealer_ids[:page_size]
+    ]
+    ids = [dealer.id for dealer in dealers]
+    stats = restapis.get_dealer_stats_from_cf(settings.DEALER_STATS_API_URL, ids)
+    listing = views.dealer_listing_context(
+        None, None, dealers, None, stats, review_set_versions(ids)
+    )
+    return {
+        "djangoapp/dealer_details.html": details,
+        "djangoapp/index.html": [listing],
+    }
+
+
+def run(args):
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import Client, override_settings
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from django.urls import reverse
+
+    from djangoapp.localstore import LocalServices
+
+    store = build_store(args)
+    rng = random.Random(args.seed)
+    hot = rng.sample(sorted(store.dealers_by_id), min(args.hot, len(store.dealers)))
+    paths = {
+        "dealer_details": [reverse("djangoapp:dealer_details", args=[id]) for id in hot],
+        "dealerships": [reverse("djangoapp:index")],
+    }
+    results = {
+        "parameters": dict(vars(args), dealers=len(store.dealers), reviews=store.review_count),
+        "requests": [],
+        "renders": [],
+    }
+
+    setup_test_environment()
+    database = connection.creation.create_test_db(verbosity=0, serialize=False)
+    try:
+        client = Client()
+        client.force_login(User.objects.create_user("benchmark", password="benchmark"))
+        with LocalServices(store, latency=args.latency) as upstream:
+            with override_settings(**upstream.urls()):
+                for scenario, scenario_paths in paths.items():
+                    for mode, ttl in MODES:
+                        ttl = {} if ttl is None else {"DEALER_FRAGMENT_CACHE_TTL": ttl}
+                        with override_settings(**ttl):
+                            reset_caches()
+                            # Warm up the upstream caches and the fragments
+                            time_requests(client, scenario_paths, 1)
+                            summary = time_requests(client, scenario_paths, args.repeat)
+                        results["requests"].append(dict(summary, scenario=scenario, mode=mode))
+
+                reset_caches()
+                contexts = render_contexts(hot, args.page_size)
+                for template_name, template_contexts in contexts.items():
+                    cold = time_renders(template_name, template_contexts, args.repeat, True)
+                    warm = time_renders(template_name, template_contexts, args.repeat, False)
+                    results["renders"].append(
+                        {
+                            "template": template_name,
+                            "uncached_ms": cold,
+                            "fragments_ms": warm,
+                            "saved_ms": round(cold - warm, 3),
+                        }
+                    )
+    finally:
+        connection.creation.destroy_test_db(database, verbosity=0)
+        teardown_test_environment()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dealers", type=int, default=1000)
+    parser.add_argument("--reviews", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--data-dir", help="Serve the data files written by benchmarks.datagen."
+    )
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--hot", type=int, default=20, help="Dealer pages viewed.")
+    parser.add_argument("--page-size", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djangobackend.settings")
+    use_own_cache(os.environ)
+    django.setup()
+    results = run(args)
+
+    print(f"{'scenario':<16}{'mode':<12}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+    for result in results["requests"]:
+        print(
+            f"{result['scenario']:<16}{result['mode']:<12}{result['throughput']:>10}"
+            f"{result['p50_ms']:>10}{result['p95_ms']:>10}{result['errors']:>8}"
+        )
+    print()
+    print(f"{'template':<32}{'uncached ms':>14}{'fragments ms':>14}{'saved ms':>10}")
+    for result in results["renders"]:
+        print(
+            f"{result['template']:<32}{result['uncached_ms']:>14}"
+            f"{result['fragments_ms']:>14}{result['saved_ms']:>10}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+A small closed-loop HTTP load generator.
+
+`run_load` keeps ``concurrency`` requests in flight against a list of
+URLs for ``requests`` requests in total and reports the latency
+percentiles and the throughput.
+"""
+import asyncio
+import time
+
+import httpx
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    """
+    Summarize a load run.
+
+    Returns:
+        dict: Request and error counts, throughput in requests per second
+        and p50/p95/p99/max latencies in milliseconds.
+    """
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+async def _run_load(urls, requests, concurrency, timeout):
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+
+        async def worker():
+            nonlocal errors
+            for index in counter:
+                url = urls[index % len(urls)]
+                started = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, errors, elapsed)
+
+
+def run_load(urls, requests, concurrency, timeout=60.0):
+    """
+    Send requests to urls, round robin, with concurrency in flight.
+
+    Returns:
+        dict: The run summary, see `summarize`.
+    """
+    return asyncio.run(_run_load(urls, requests, concurrency, timeout))
@@ -0,0 +1,259 @@
+"""
+Benchmark the dealer pages against the local upstream services.
+
+The dealer listing, dealer details and add review views run in process
+through the Django test client, on a throwaway test database, against
+`djangoapp.localstore.LocalServices` loaded with synthetic data (see
+`benchmarks.datagen`) and answering after an injected latency. Each
+scenario runs at every concurrency level and the latency percentiles and
+throughput are reported. Run from the server directory:
+
+    python -m benchmarks.pages --dealers 1000 --reviews 100000 --output pages.json
+
+Pass the results of an earlier run as ``--baseline`` to fail (exit status
+1) when a p95 latency got worse by more than ``--tolerance``.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import django
+
+from . import datagen, use_own_cache
+from .loadgen import summarize
+from djangoapp.localstore import LocalServices, LocalStore
+
+SCENARIOS = ("dealerships", "dealer_details", "add_review")
+
+
+def build_store(args):
+    """Load the data files of args.data_dir, or generate the data."""
+    if args.data_dir:
+        return LocalStore.from_sample_data(args.data_dir)
+    vocabulary = datagen.Vocabulary()
+    return LocalStore(
+        datagen.generate_dealers(args.dealers, args.seed, vocabulary),
+        datagen.generate_reviews(args.reviews, args.dealers, args.seed, vocabulary),
+    )
+
+
+def build_requests(scenario, store, car_id, seed):
+    """
+    Returns:
+        list: The (method, path, data, expected status) of the requests of
+        a scenario, cycled through during a run.
+    """
+    from django.urls import reverse
+
+    rng = random.Random(seed)
+    dealer_ids = sorted(store.dealers_by_id)
+    if scenario == "dealerships":
+        index = reverse("djangoapp:index")
+        states = sorted(store.dealers_by_state)
+        paths = [index] + [f"{index}?state={state}" for state in states]
+        return [("get", path, None, 200) for path in paths]
+    if scenario == "dealer_details":
+        ids = rng.choices(dealer_ids, k=min(len(dealer_ids), 500))
+        return [
+            ("get", reverse("djangoapp:dealer_details", args=[id]), None, 200)
+            for id in ids
+        ]
+    ids = rng.choices(dealer_ids, k=100)
+    return [
+        (
+            "post",
+            reverse("djangoapp:add_review", args=[id]),
+            {
+                "car": car_id,
+                "content": f"Benchmark review {index}",
+                "purchasecheck": "on",
+                "purchasedate": "01/01/2023",
+            },
+            302,
+        )
+        for index, id in enumerate(ids)
+    ]
+
+
+def reset_caches():
+    """
+    Drop the cached dealers, dealer stats, sentiment labels, upstream
+    validators and page fragments. The default cache is the benchmark's
+    own, see `benchmarks.use_own_cache`.
+    """
+    from django.core.cache import caches
+
+    from djangoapp import fragments, restapis
+
+    restapis.invalidate_dealers()
+    restapis.invalidate_dealer_stats()
+    restapis.conditional_cache.clear()
+    restapis.sentiment_cache.local.clear()
+    caches[restapis.sentiment_cache.alias].clear()
+    fragments.fragment_cache().clear()
+
+
+def run_scenario(clients, requests, count, concurrency, cold=False):
+    """
+    Send count requests, concurrency at a time, one client per thread.
+
+    Returns:
+        dict: The run summary, see `benchmarks.loadgen.summarize`.
+    """
+    latencies = []
+    errors = 0
+    counter = itertools.count()
+    lock = threading.Lock()
+
+    def worker(client):
+        nonlocal errors
+        for index in counter:
+            if index >= count:
+                return
+            method, path, data, expected = requests[index % len(requests)]
+            if cold:
+                reset_caches()
+            started = time.perf_counter()
+            response = getattr(client, method)(path, data)
+            elapsed = time.perf_counter() - started
+            with lock:
+                if response.status_code == expected:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    threads = [
+        threading.Thread(target=worker, args=(client,))
+        for client in clients[:concurrency]
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns:
+        list: A message for every scenario and concurrency whose p95
+        latency is more than tolerance worse than in the baseline.
+    """
+    before = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        previous = before.get((result["scenario"], result["concurrency"]))
+        if previous and result["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{result['scenario']} at concurrency {result['concurrency']}: "
+                f"p95 {result['p95_ms']} ms, was {previous['p95_ms']} ms"
+            )
+    return regressions
+
+
+def run(args):
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test import Client, override_settings
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    from djangoapp.models import CarMake, CarModel
+
+    store = build_store(args)
+    results = {
+        "parameters": dict(vars(args), dealers=len(store.dealers), reviews=store.review_count),
+        "results": [],
+    }
+    concurrencies = sorted({int(value) for value in args.concurrency.split(",")})
+
+    setup_test_environment()
+    database = connection.creation.create_test_db(verbosity=0, serialize=False)
+    try:
+        make = CarMake.objects.create(name="Audi", description="Benchmark make")
+        car = CarModel.objects.create(car_make=make, name="A4", dealer_id=1, type="Sedan")
+        user = User.objects.create_user("benchmark", password="benchmark")
+        clients = []
+        for _ in range(max(concurrencies)):
+            client = Client()
+            client.force_login(user)
+            clients.append(client)
+
+        with LocalServices(store, latency=args.latency) as upstream:
+            with override_settings(**upstream.urls()):
+                for scenario in args.scenarios:
+                    requests = build_requests(scenario, store, car.pk, args.seed)
+                    reset_caches()
+                    # Warm up the connection pools and the caches
+                    run_scenario(clients, requests, len(requests), max(concurrencies))
+                    for concurrency in concurrencies:
+                        summary = run_scenario(
+                            clients, requests, args.requests, concurrency, args.cold
+                        )
+                        results["results"].append(
+                            dict(summary, scenario=scenario, concurrency=concurrency)
+                        )
+    finally:
+        connection.creation.destroy_test_db(database, verbosity=0)
+        teardown_test_environment()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dealers", type=int, default=1000)
+    parser.add_argument("--reviews", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--data-dir", help="Serve the data files written by benchmarks.datagen."
+    )
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS)
+    )
+    parser.add_argument(
+        "--cold",
+        action="store_true",
+        help="Drop the dealer and sentiment caches before every request.",
+    )
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", help="Compare with the results in this file.")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djangobackend.settings")
+    use_own_cache(os.environ)
+    django.setup()
+    results = run(args)
+
+    print(
+        f"{'scenario':<16}{'conc':>6}{'req/s':>10}{'p50 ms':>10}"
+        f"{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}"
+    )
+    for result in results["results"]:
+        print(
+            f"{result['scenario']:<16}{result['concurrency']:>6}"
+            f"{result['throughput']:>10}{result['p50_ms']:>10}"
+            f"{result['p95_ms']:>10}{result['p99_ms']:>10}{result['errors']:>8}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
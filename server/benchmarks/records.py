@@ -0,0 +1,142 @@
+"""
+Benchmark the memory and construction time of dealer and review records.
+
+Builds records from synthetic upstream documents (see `benchmarks.datagen`)
+the way `djangoapp.restapis` does, and compares the slotted `CarDealer` and
+`DealerReview` built with ``from_dict``, the columnar `DealerReviewBatch`,
+and the ``__dict__`` based classes they replaced. Memory is what the
+records add on top of the decoded documents, measured with tracemalloc.
+Run from the server directory:
+
+    python -m benchmarks.records --records 100000
+"""
+import argparse
+import gc
+import json
+import os
+import time
+import tracemalloc
+
+import django
+
+from . import datagen
+
+
+class DictDealer:
+    """`CarDealer` as it was before it had slots."""
+
+    def __init__(self, address, city, full_name, id, lat, long, short_name, st, state, zip, **kwargs):
+        self.address = address
+        self.city = city
+        self.full_name = full_name
+        self.id = id
+        self.lat = lat
+        self.long = long
+        self.short_name = short_name
+        self.st = st
+        self.state = state
+        self.zip = zip
+
+
+class DictReview:
+    """`DealerReview` as it was before it had slots."""
+
+    def __init__(self, dealership, id, name, review, purchase, purchase_date, car_make, car_model, car_year, sentiment="", **kwargs):
+        self.dealership = dealership
+        self.id = id
+        self.name = name
+        self.review = review
+        self.purchase = purchase
+        self.purchase_date = purchase_date
+        self.car_make = car_make
+        self.car_model = car_model
+        self.car_year = car_year
+        self.sentiment = sentiment
+
+
+def upstream_documents(count, seed):
+    """
+    Return count dealers and count reviews as decoded from upstream answers,
+    with the Cloudant fields the records do not keep.
+    """
+    vocabulary = datagen.Vocabulary()
+    dealers = list(datagen.generate_dealers(count, seed, vocabulary))
+    reviews = list(datagen.generate_reviews(count, count, seed, vocabulary))
+    for doc in dealers + reviews:
+        doc["_id"] = f"{doc['id']:032x}"
+        doc["_rev"] = f"1-{doc['id']:032x}"
+    for doc in reviews:
+        doc["time"] = "2023-06-01T12:00:00.000000"
+        doc["sentiment"] = "SENT_NEUTRAL"
+        doc["score"] = 0.5
+    # Decode them again, as every request does, so no string is shared with
+    # the generator state
+    return json.loads(json.dumps(dealers)), json.loads(json.dumps(reviews))
+
+
+def measure(build, docs, repeat):
+    """
+    Returns:
+        dict: The best construction time and the memory held by the result.
+    """
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = build(docs)
+        timings.append(time.perf_counter() - start)
+        del result
+    gc.collect()
+    tracemalloc.start()
+    result = build(docs)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {
+        "ms": round(min(timings) * 1000, 1),
+        "bytes_per_record": round(memory / len(docs), 1),
+    }
+
+
+def run(args):
+    from djangoapp.models import CarDealer, DealerReview, DealerReviewBatch
+
+    dealers, reviews = upstream_documents(args.records, args.seed)
+    variants = [
+        ("dealers", "dict, kwargs", lambda docs: [DictDealer(**doc) for doc in docs], dealers),
+        ("dealers", "slots, from_dict", lambda docs: [CarDealer.from_dict(doc) for doc in docs], dealers),
+        ("reviews", "dict, kwargs", lambda docs: [DictReview(**doc) for doc in docs], reviews),
+        ("reviews", "slots, from_dict", lambda docs: [DealerReview.from_dict(doc) for doc in docs], reviews),
+        ("reviews", "columnar batch", DealerReviewBatch.from_dicts, reviews),
+    ]
+    results = []
+    for kind, variant, build, docs in variants:
+        results.append(dict(measure(build, docs, args.repeat), kind=kind, variant=variant))
+    return {"parameters": vars(args), "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djangobackend.settings")
+    django.setup()
+    results = run(args)
+
+    print(f"{'records':<10}{'variant':<20}{'build ms':>10}{'bytes/record':>14}")
+    for result in results["results"]:
+        print(
+            f"{result['kind']:<10}{result['variant']:<20}"
+            f"{result['ms']:>10}{result['bytes_per_record']:>14}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
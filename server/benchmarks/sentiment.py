@@ -0,0 +1,67 @@
+"""
+Benchmark the throughput of the local sentiment backend.
+
+Scores synthetic review texts (see `benchmarks.datagen`) with
+`djangoapp.sentiment.LexiconSentimentBackend`, in batches as
+`djangoapp.restapis.analyze_reviews_sentiments` passes them. The remote
+backend makes one request per review, so its throughput is bounded by
+SENTIMENT_MAX_WORKERS divided by the service latency. Run from the server
+directory:
+
+    python -m benchmarks.sentiment --reviews 100000 --batch-size 1000
+"""
+import argparse
+import json
+import os
+import time
+from collections import Counter
+
+import django
+
+from . import datagen
+
+
+def run(args):
+    from djangoapp.sentiment import LexiconSentimentBackend
+
+    reviews = datagen.generate_reviews(args.reviews, max(1, args.reviews // 10), args.seed)
+    texts = [review["review"] for review in reviews]
+    backend = LexiconSentimentBackend()
+    timings = []
+    for _ in range(args.repeat):
+        labels = []
+        started = time.perf_counter()
+        for start in range(0, len(texts), args.batch_size):
+            labels.extend(backend.analyze_batch(texts[start : start + args.batch_size]))
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+    return {
+        "parameters": vars(args),
+        "seconds": round(best, 3),
+        "reviews_per_second": round(len(texts) / best),
+        "labels": dict(Counter(labels)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--reviews", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djangobackend.settings")
+    django.setup()
+    results = run(args)
+
+    print(f"{results['reviews_per_second']} reviews/s ({results['seconds']} s)")
+    print(f"labels: {results['labels']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
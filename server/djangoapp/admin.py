@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import CarMake, CarModel
+from .models import CarMake, CarModel, ReviewEnrichment, ReviewOutbox
 
 
 # Register your models here.
@@ -22,6 +22,20 @@ class CarMakeAdmin(admin.ModelAdmin):
     inlines = [CarModelInline]
 
 
+# ReviewOutboxAdmin class to follow the delivery of submitted reviews
+class ReviewOutboxAdmin(admin.ModelAdmin):
+    list_display = ("idempotency_key", "dealer_id", "status", "attempts", "created_at")
+    list_filter = ("status",)
+
+
+# ReviewEnrichmentAdmin class to look up the stored NLU results
+class ReviewEnrichmentAdmin(admin.ModelAdmin):
+    list_display = ("key", "created_at")
+    search_fields = ("key",)
+
+
 # Register models here
 admin.site.register(CarMake, CarMakeAdmin)
 admin.site.register(CarModel, CarModelAdmin)
+admin.site.register(ReviewOutbox, ReviewOutboxAdmin)
+admin.site.register(ReviewEnrichment, ReviewEnrichmentAdmin)
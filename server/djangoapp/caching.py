@@ -0,0 +1,412 @@
+"""
+Caches used by the REST proxy layer.
+
+`LRUCache` is a small thread-safe in-process cache with a size limit and
+per-entry expiry. `TieredCache` puts an `LRUCache` in front of one of the
+Django caches (``settings.CACHES``), so hot keys are served from process
+memory without a round trip to the Django tier. The workers share the
+Django tier only when its backend is shared across processes, such as the
+default file-based cache or memcached, not with ``LocMemCache``. `ReadThroughCache` wraps
+an upstream fetch with stale-while-revalidate and request coalescing. All
+of them count hits and misses for the metrics endpoint.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.core.cache import caches
+
+from . import metrics
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    A bounded least-recently-used cache whose entries expire after a TTL.
+
+    Args:
+    - maxsize (int): The maximum number of entries kept.
+    - ttl (float): Seconds an entry stays valid, None to never expire.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires, value = entry
+            if expires is not None and expires <= now:
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=_MISSING):
+        if ttl is _MISSING:
+            ttl = self.ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TieredCache:
+    """
+    An in-process LRU tier in front of a Django cache, shared by the
+    workers when its backend is, see settings.CACHES.
+
+    Args:
+    - name (str): The cache name, used as key prefix and metrics label.
+    - alias (str): The Django cache alias of the shared tier.
+    - maxsize (int): The maximum number of entries in the local tier.
+    - ttl (float): Seconds an entry stays valid in both tiers.
+    """
+
+    def __init__(self, name, alias, maxsize, ttl):
+        self.name = name
+        self.alias = alias
+        self.ttl = ttl
+        self.local = LRUCache(maxsize, ttl)
+        self._counts = {"local_hit": 0, "shared_hit": 0, "miss": 0}
+        self._counts_lock = threading.Lock()
+        _caches.append(self)
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def _shared_key(self, key):
+        return f"{self.name}:{key}"
+
+    def _count(self, result, amount=1):
+        if amount:
+            with self._counts_lock:
+                self._counts[result] += amount
+
+    def get_many(self, keys):
+        """
+        Look up several keys, local tier first.
+
+        Args:
+        - keys (list[str]): The keys to look up.
+
+        Returns:
+        - dict: The cached values of the keys that were found.
+        """
+        found = {}
+        remote = []
+        for key in keys:
+            value = self.local.get(key, _MISSING)
+            if value is _MISSING:
+                remote.append(key)
+            else:
+                found[key] = value
+        self._count("local_hit", len(found))
+        if remote:
+            shared = self.shared.get_many([self._shared_key(key) for key in remote])
+            for key in remote:
+                value = shared.get(self._shared_key(key), _MISSING)
+                if value is not _MISSING:
+                    found[key] = value
+                    self.local.set(key, value)
+            hits = len(found) - (len(keys) - len(remote))
+            self._count("shared_hit", hits)
+            self._count("miss", len(remote) - hits)
+        return found
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        self.shared.set(self._shared_key(key), value, self.ttl)
+
+    def delete(self, key):
+        self.local.delete(key)
+        self.shared.delete(self._shared_key(key))
+
+    def stats(self):
+        """
+        Returns:
+        - tuple: The lookup counts by result and the local entry count.
+        """
+        with self._counts_lock:
+            return dict(self._counts), len(self.local)
+
+
+_refresh_executor = None
+_refresh_executor_pid = None
+_refresh_executor_lock = threading.Lock()
+
+
+def _get_refresh_executor():
+    global _refresh_executor, _refresh_executor_pid
+    pid = os.getpid()
+    if _refresh_executor is None or _refresh_executor_pid != pid:
+        with _refresh_executor_lock:
+            if _refresh_executor is None or _refresh_executor_pid != pid:
+                _refresh_executor = ThreadPoolExecutor(
+                    max_workers=4, thread_name_prefix="cache-refresh"
+                )
+                _refresh_executor_pid = pid
+    return _refresh_executor
+
+
+class ReadThroughCache:
+    """
+    An in-process read-through cache for upstream lookups.
+
+    An entry is fresh for its TTL and then stale for up to ``stale_ttl``
+    more seconds. A stale entry is still returned, while one background
+    refresh replaces it. Concurrent misses on the same key share a single
+    call to the loader. A loader returning None signals a failed fetch:
+    the result is not cached and a stale entry, if any, is kept.
+
+    Args:
+    - name (str): The cache name, used as metrics label.
+    - maxsize (int): The maximum number of keys kept.
+    - ttl (float): Default seconds an entry stays fresh.
+    - stale_ttl (float): Seconds a stale entry may still be served.
+    - wait_timeout (float): Seconds a caller waits on the load of another
+      caller before giving up as if the load failed.
+    """
+
+    def __init__(self, name, maxsize, ttl, stale_ttl, wait_timeout=30.0):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.wait_timeout = wait_timeout
+        # Entries are (value, fresh_until), the LRU expires them once stale
+        self._entries = LRUCache(maxsize)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, a load started before one does not
+        # store the value it read
+        self._generation = 0
+        self._counts = {
+            "fresh_hit": 0,
+            "stale_hit": 0,
+            "miss": 0,
+            "coalesced": 0,
+            "load_error": 0,
+        }
+        _caches.append(self)
+
+    def _count(self, result):
+        with self._lock:
+            self._counts[result] += 1
+
+    def _store(self, key, value, ttl, generation):
+        if value is None:
+            self._count("load_error")
+            return
+        fresh_until = time.monotonic() + ttl
+        with self._lock:
+            if generation == self._generation:
+                self._entries.set(key, (value, fresh_until), ttl + self.stale_ttl)
+
+    def _load(self, key, loader, ttl, future):
+        generation = self._generation
+        try:
+            value = loader()
+            self._store(key, value, ttl, generation)
+        except Exception as exc:
+            self._count("load_error")
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _start_load(self, key):
+        """Return (future, leader): leader is True if the caller must load."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._inflight[key] = future
+            return future, True
+
+    def get(self, key, loader, ttl=None):
+        """
+        Return the cached value of key, loading it on a miss.
+
+        Args:
+        - key (hashable): The cache key.
+        - loader (callable): Fetches the value, returns None on failure.
+        - ttl (float, optional): Seconds the loaded value stays fresh.
+
+        Returns:
+        - object: The cached or loaded value, None if the load failed.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fresh_until = entry
+            if time.monotonic() < fresh_until:
+                self._count("fresh_hit")
+                return value
+            self._count("stale_hit")
+            future, leader = self._start_load(key)
+            if leader:
+                _get_refresh_executor().submit(self._load, key, loader, ttl, future)
+            return value
+        future, leader = self._start_load(key)
+        if leader:
+            self._count("miss")
+            return self._load(key, loader, ttl, future)
+        self._count("coalesced")
+        try:
+            return future.result(timeout=self.wait_timeout)
+        except (FutureTimeoutError, CancelledError):
+            self._count("load_error")
+            return None
+
+    async def _aload(self, key, loader, ttl, future):
+        generation = self._generation
+        try:
+            value = await loader()
+            self._store(key, value, ttl, generation)
+        except Exception as exc:
+            self._count("load_error")
+            future.set_exception(exc)
+            raise
+        except BaseException:
+            # Cancelled, at a deadline: the callers sharing the load get
+            # the answer of a failed load rather than waiting forever
+            self._count("load_error")
+            future.set_result(None)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def aget(self, key, loader, ttl=None):
+        """
+        Async version of `get`, for a loader that is a coroutine function.
+
+        Async and threaded callers share the same entries and in-flight
+        loads.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fresh_until = entry
+            if time.monotonic() < fresh_until:
+                self._count("fresh_hit")
+                return value
+            self._count("stale_hit")
+            future, leader = self._start_load(key)
+            if leader:
+                task = asyncio.ensure_future(self._aload(key, loader, ttl, future))
+                _refresh_tasks.add(task)
+                task.add_done_callback(_forget_refresh)
+            return value
+        future, leader = self._start_load(key)
+        if leader:
+            self._count("miss")
+            return await self._aload(key, loader, ttl, future)
+        self._count("coalesced")
+        # Shielded, so a caller cancelled while waiting does not cancel the
+        # load shared with the other callers
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(future)), self.wait_timeout
+            )
+        except asyncio.TimeoutError:
+            self._count("load_error")
+            return None
+
+    def invalidate(self, key):
+        """
+        Drop one key, the next lookup loads it again. Loads in flight do
+        not store the value they read.
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.delete(key)
+
+    def invalidate_where(self, predicate):
+        """Drop every key for which predicate(key) is true."""
+        with self._lock:
+            self._generation += 1
+            for key in self._entries.keys():
+                if predicate(key):
+                    self._entries.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts), len(self._entries)
+
+
+_caches = []
+
+# Background refreshes started by `aget`, referenced until they finish
+_refresh_tasks = set()
+
+
+def _forget_refresh(task):
+    _refresh_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Error refreshing cache entry: {task.exception()}")
+
+
+def _collect_cache_stats():
+    for cache in list(_caches):
+        counts, entries = cache.stats()
+        for result, count in counts.items():
+            labels = {"cache": cache.name, "result": result}
+            yield "cache_requests_total", labels, count
+        yield "cache_local_entries", {"cache": cache.name}, entries
+
+
+metrics.register_collector(
+    _collect_cache_stats,
+    {
+        "cache_requests_total": ("counter", "Cache lookups by cache and result."),
+        "cache_local_entries": ("gauge", "Entries held in process memory."),
+    },
+)
@@ -0,0 +1,187 @@
+"""
+Circuit breakers for upstream services.
+
+A `CircuitBreaker` watches the outcome of the last calls to a service. When
+too many of them failed, or were too slow, it opens and callers fail fast
+instead of waiting on the service. After a cool-down it lets a few probe
+calls through (half-open): if they succeed it closes again, otherwise it
+stays open for another cool-down. Breaker states and call counts are
+exported on the metrics endpoint.
+"""
+import threading
+import time
+from collections import deque
+
+from . import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATES = (CLOSED, HALF_OPEN, OPEN)
+
+
+class CircuitBreaker:
+    """
+    A failure-rate circuit breaker.
+
+    Args:
+    - name (str): The breaker name, used as metrics label.
+    - failure_rate (float): Fraction of failed calls in the window that
+      opens the breaker.
+    - window (int): Number of recent calls the failure rate is computed on.
+    - min_calls (int): Calls needed in the window before it can open.
+    - reset_timeout (float): Seconds the breaker stays open before probing.
+    - half_open_calls (int): Probe calls let through while half-open, all
+      must succeed to close the breaker.
+    - slow_call (float, optional): Calls taking longer, in seconds, count
+      as failures even when they succeed.
+    """
+
+    def __init__(
+        self,
+        name,
+        failure_rate=0.5,
+        window=20,
+        min_calls=10,
+        reset_timeout=30.0,
+        half_open_calls=3,
+        slow_call=None,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.slow_call = slow_call
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._outcomes = deque(maxlen=window)
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        self._counts = {"success": 0, "failure": 0, "rejected": 0}
+        self._opened = 0
+        _breakers.append(self)
+
+    def _update_state(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+            self._probe_successes = 0
+
+    def _open(self, now):
+        self._state = OPEN
+        self._opened_at = now
+        self._opened += 1
+
+    @property
+    def state(self):
+        """The current state: CLOSED, HALF_OPEN or OPEN."""
+        with self._lock:
+            self._update_state(time.monotonic())
+            return self._state
+
+    def allow(self):
+        """
+        Ask to make a call.
+
+        Every allowed call must be followed by `record_success` or
+        `record_failure`.
+
+        Returns:
+        - bool: True if the call may go ahead, False to fail fast.
+        """
+        with self._lock:
+            self._update_state(time.monotonic())
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+            self._counts["rejected"] += 1
+            return False
+
+    def record_success(self, duration=0.0):
+        """
+        Record a call that succeeded, after duration seconds.
+        """
+        if self.slow_call is not None and duration > self.slow_call:
+            self.record_failure()
+            return
+        with self._lock:
+            self._counts["success"] += 1
+            if self._state == HALF_OPEN:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+            elif self._state == CLOSED:
+                self._outcomes.append(True)
+
+    def record_failure(self):
+        """
+        Record a call that failed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._counts["failure"] += 1
+            if self._state == HALF_OPEN:
+                self._open(now)
+            elif self._state == CLOSED:
+                self._outcomes.append(False)
+                calls = len(self._outcomes)
+                failures = calls - sum(self._outcomes)
+                if calls >= self.min_calls and failures >= self.failure_rate * calls:
+                    self._open(now)
+                    self._outcomes.clear()
+
+    def reset(self):
+        """Close the breaker and forget the recent calls."""
+        with self._lock:
+            self._state = CLOSED
+            self._outcomes.clear()
+
+    def stats(self):
+        """
+        Returns:
+        - tuple: The state, the call counts by result and the number of
+          times the breaker opened.
+        """
+        with self._lock:
+            self._update_state(time.monotonic())
+            return self._state, dict(self._counts), self._opened
+
+
+_breakers = []
+
+
+def _collect_breaker_stats():
+    for breaker in list(_breakers):
+        state, counts, opened = breaker.stats()
+        for name in STATES:
+            labels = {"breaker": breaker.name, "state": name}
+            yield "circuit_breaker_state", labels, int(name == state)
+        for result, count in counts.items():
+            labels = {"breaker": breaker.name, "result": result}
+            yield "circuit_breaker_calls_total", labels, count
+        yield "circuit_breaker_opened_total", {"breaker": breaker.name}, opened
+
+
+metrics.register_collector(
+    _collect_breaker_stats,
+    {
+        "circuit_breaker_state": (
+            "gauge",
+            "1 for the current state of each circuit breaker, 0 otherwise.",
+        ),
+        "circuit_breaker_calls_total": (
+            "counter",
+            "Calls through each circuit breaker, by result.",
+        ),
+        "circuit_breaker_opened_total": (
+            "counter",
+            "Times each circuit breaker opened.",
+        ),
+    },
+)
@@ -0,0 +1,277 @@
+"""
+Review enrichment with Watson Natural Language Understanding.
+
+`enrich_reviews` extracts the keywords, entities and emotion of review
+texts. Results are looked up by a hash of the text, first in the
+enrichment cache, then in the `ReviewEnrichment` table, and only the texts
+found in neither are sent to NLU, concurrently, then saved to both.
+`attach_enrichments` adds the stored results to the reviews shown on the
+dealer details page, without calling NLU.
+
+All calls go through one NLU client per process, see `get_nlu_client`. Its
+IAM authenticator fetches a token on the first call and shares it with the
+calls that follow. The first call made once the token nears expiry fetches
+a new one before it is sent. Without
+settings.NLU_API_KEY requests are not authenticated, which is what the
+local services (`djangoapp.localstore`) expect. Backfill the stored
+reviews with:
+
+    python manage.py enrich_reviews
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from ibm_cloud_sdk_core import ApiException
+from ibm_cloud_sdk_core.authenticators import IAMAuthenticator, NoAuthAuthenticator
+from ibm_watson import NaturalLanguageUnderstandingV1
+from ibm_watson.natural_language_understanding_v1 import (
+    EmotionOptions,
+    EntitiesOptions,
+    Features,
+    KeywordsOptions,
+)
+
+from . import timing
+from .caching import TieredCache
+from .models import ReviewEnrichment
+from .restapis import get_session
+
+logger = logging.getLogger(__name__)
+
+# Identifies the features requested, stored results are keyed on it
+FEATURES_ID = "keywords-entities-emotion-v1"
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_nlu_client():
+    """
+    Return the NLU client of this process.
+
+    The client and its authenticator live as long as the process, so the
+    IAM token is shared by every call. It sends its requests on the pooled
+    session of `restapis.get_session`.
+
+    Returns:
+    - NaturalLanguageUnderstandingV1: The shared client.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                if settings.NLU_API_KEY:
+                    authenticator = IAMAuthenticator(
+                        settings.NLU_API_KEY, url=settings.NLU_IAM_URL or None
+                    )
+                else:
+                    authenticator = NoAuthAuthenticator()
+                client = NaturalLanguageUnderstandingV1(
+                    version=settings.NLU_VERSION, authenticator=authenticator
+                )
+                client.set_service_url(settings.NLU_API_URL)
+                client.set_http_client(get_session())
+                client.set_http_config(
+                    {
+                        "timeout": (
+                            settings.RESTAPIS_CONNECT_TIMEOUT,
+                            settings.NLU_CALL_TIMEOUT,
+                        )
+                    }
+                )
+                _client = client
+                _client_pid = pid
+    return _client
+
+
+def reset_nlu_client():
+    """Drop the client of this process, after its settings changed."""
+    global _client
+    with _client_lock:
+        _client = None
+
+
+def enrichment_key(text):
+    """
+    Return the content address of a review text under the NLU features.
+    """
+    digest = hashlib.sha256(f"{FEATURES_ID}\0{text}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def analyze_review_text(text):
+    """
+    Extract the keywords, entities and emotion of a review text with NLU.
+
+    Args:
+    - text (str): The review text.
+
+    Returns:
+    - dict: The ``keywords`` and ``entities`` lists, each item with its
+      ``text`` and ``relevance`` (and ``type`` for entities), and the
+      ``emotion`` scores of the text. None if the text could not be
+      analyzed.
+    """
+    features = Features(
+        keywords=KeywordsOptions(limit=settings.NLU_KEYWORDS_LIMIT),
+        entities=EntitiesOptions(limit=settings.NLU_ENTITIES_LIMIT),
+        emotion=EmotionOptions(),
+    )
+    started = time.perf_counter()
+    status, size = "error", 0
+    try:
+        response = get_nlu_client().analyze(
+            text=text, features=features, language="en"
+        )
+        result = response.get_result()
+        status, size = response.get_status_code(), len(json.dumps(result))
+    except ApiException as err:
+        # Texts too short to analyze are rejected with a 4xx
+        status = err.code
+        logger.warning("NLU analysis failed (%s): %s", err.code, err.message)
+        return None
+    except Exception as err:
+        logger.warning("NLU request failed: %s", err)
+        return None
+    finally:
+        timing.record("nlu", time.perf_counter() - started, status, size)
+    return {
+        "keywords": [
+            {"text": keyword["text"], "relevance": keyword.get("relevance")}
+            for keyword in result.get("keywords", [])
+        ],
+        "entities": [
+            {
+                "type": entity.get("type"),
+                "text": entity["text"],
+                "relevance": entity.get("relevance"),
+            }
+            for entity in result.get("entities", [])
+        ],
+        "emotion": result.get("emotion", {}).get("document", {}).get("emotion", {}),
+    }
+
+
+enrichment_cache = TieredCache(
+    "enrichment",
+    alias=settings.ENRICHMENT_CACHE_ALIAS,
+    maxsize=settings.ENRICHMENT_CACHE_MAXSIZE,
+    ttl=settings.ENRICHMENT_CACHE_TTL,
+)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_enrichment_executor():
+    """
+    Return the thread pool running NLU calls in this process.
+
+    Returns:
+    - ThreadPoolExecutor: The shared executor.
+    """
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.NLU_MAX_WORKERS,
+                    thread_name_prefix="enrichment",
+                )
+                _executor_pid = pid
+    return _executor
+
+
+def _load_stored(keys):
+    rows = ReviewEnrichment.objects.filter(key__in=keys)
+    return {row.key: row.to_dict() for row in rows}
+
+
+def stored_enrichments(keys):
+    """
+    Look up enrichments in the enrichment cache, then in the database.
+
+    Args:
+    - keys (list[str]): The enrichment keys, see `enrichment_key`.
+
+    Returns:
+    - dict: The enrichments found, by key.
+    """
+    found = enrichment_cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        stored = _load_stored(missing)
+        for key, enrichment in stored.items():
+            enrichment_cache.set(key, enrichment)
+        found.update(stored)
+    return found
+
+
+def attach_enrichments(reviews):
+    """
+    Set the stored enrichment of reviews, leaving the reviews never
+    enriched without one. NLU is not called, reviews are enriched ahead of
+    time by ``python manage.py enrich_reviews``.
+
+    Args:
+    - reviews (list[DealerReview]): The reviews, updated in place.
+    """
+    keys = [enrichment_key(review.review) for review in reviews]
+    found = stored_enrichments(list(set(keys)))
+    for review, key in zip(reviews, keys):
+        review.enrichment = found.get(key)
+
+
+def enrich_reviews(texts, deadline=None):
+    """
+    Extract the keywords, entities and emotion of several review texts.
+
+    Args:
+    - texts (list[str]): The review texts.
+    - deadline (float, optional): Seconds to wait for the NLU calls,
+      defaults to settings.NLU_BATCH_DEADLINE.
+
+    Returns:
+    - list[dict]: The enrichment of each text, in the order of texts, see
+      `analyze_review_text`. None for the texts that could not be
+      analyzed before the deadline.
+    """
+    if deadline is None:
+        deadline = settings.NLU_BATCH_DEADLINE
+    keys = {text: enrichment_key(text) for text in texts}
+    found = stored_enrichments(list(set(keys.values())))
+    futures = {}
+    if settings.NLU_API_URL:
+        executor = get_enrichment_executor()
+        for text, key in keys.items():
+            if key not in found and key not in futures:
+                futures[key] = timing.submit_in_context(
+                    executor, analyze_review_text, text
+                )
+    if futures:
+        done, _ = wait(futures.values(), timeout=deadline)
+        analyzed = {}
+        for key, future in futures.items():
+            if future in done and future.exception() is None and future.result():
+                analyzed[key] = future.result()
+        ReviewEnrichment.objects.bulk_create(
+            [
+                ReviewEnrichment(key=key, **enrichment)
+                for key, enrichment in analyzed.items()
+            ],
+            ignore_conflicts=True,
+        )
+        for key, enrichment in analyzed.items():
+            enrichment_cache.set(key, enrichment)
+        found.update(analyzed)
+    return [found.get(keys[text]) for text in texts]
@@ -0,0 +1,142 @@
+"""
+Cached fragments of the dealer pages.
+
+The dealer rows of the listing and the reviews of the dealer details page
+are cached rendered, with the ``{% cache %}`` template tag, keyed on the
+dealer id and the version of the dealer's review set. A version is a
+random token kept in the fragment cache for settings.DEALER_FRAGMENT_CACHE_TTL
+seconds. Submitting a review replaces the version of its dealer, so the
+next view renders the fragments again, and an expired version replaces
+every fragment keyed on it, which bounds how stale a fragment gets when
+reviews are written elsewhere.
+
+A random version only works when every web process sees the same one, so
+when the fragment cache is disabled (settings.DEALER_FRAGMENT_CACHE_TTL is
+0) or local to the process, see `versions_are_shared`, the views derive the
+version from the upstream data instead, and the pages keep a stable ETag.
+
+The data a fragment is rendered from is passed to the template as a
+`Deferred`, so a view whose fragments are all cached fetches nothing from
+the upstream services.
+
+Fragments live in the ``template_fragments`` cache when it is configured,
+else in the default cache, like the ``{% cache %}`` tag.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.utils import make_template_fragment_key
+
+# Fragment names of the templates, see djangoapp/templates/djangoapp
+DEALER_ROW = "dealer_row"
+DEALER_REVIEWS = "dealer_reviews"
+
+VERSION_KEY = "review-set-version:%s"
+
+
+def fragment_cache():
+    """
+    Returns:
+    - BaseCache: The cache holding the fragments and review set versions.
+    """
+    try:
+        return caches["template_fragments"]
+    except InvalidCacheBackendError:
+        return caches["default"]
+
+
+def versions_are_shared():
+    """
+    Returns:
+    - bool: Whether review set versions are kept, in a cache shared by the
+      web processes. When they are not, a random version would differ on
+      every request or every process.
+    """
+    if settings.DEALER_FRAGMENT_CACHE_TTL <= 0:
+        return False
+    return not isinstance(fragment_cache(), (DummyCache, LocMemCache))
+
+
+def review_set_versions(ids):
+    """
+    Return the current review set version of dealers.
+
+    Args:
+    - ids (list[int]): The IDs of the dealers.
+
+    Returns:
+    - dict: The version of each dealer by ID.
+    """
+    cache = fragment_cache()
+    keys = {id: VERSION_KEY % id for id in ids}
+    found = cache.get_many(list(keys.values()))
+    versions = {}
+    for id, key in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            # Another request may have started the version first
+            if not cache.add(key, version, settings.DEALER_FRAGMENT_CACHE_TTL):
+                version = cache.get(key, version)
+        versions[id] = version
+    return versions
+
+
+def review_set_version(id):
+    """Return the current review set version of a dealer."""
+    return review_set_versions([id])[id]
+
+
+def bump_review_set_version(id):
+    """
+    Start a new review set version for a dealer, after one of its reviews
+    was submitted, so its cached fragments are rendered again.
+    """
+    fragment_cache().set(
+        VERSION_KEY % id, uuid.uuid4().hex, settings.DEALER_FRAGMENT_CACHE_TTL
+    )
+
+
+def all_cached(name, *vary_ons):
+    """
+    Return whether fragments of a template, each given by its vary on
+    values, are all cached.
+    """
+    keys = [make_template_fragment_key(name, vary_on) for vary_on in vary_ons]
+    return len(fragment_cache().get_many(keys)) == len(keys)
+
+
+def drop_fragments(name, *vary_ons):
+    """
+    Drop cached fragments of a template, each given by its vary on values.
+    """
+    fragment_cache().delete_many(
+        [make_template_fragment_key(name, vary_on) for vary_on in vary_ons]
+    )
+
+
+class Deferred:
+    """
+    A value computed on first use, then kept.
+
+    Args:
+    - compute (callable): Returns the value, called at most once.
+    """
+
+    def __init__(self, compute):
+        self._compute = compute
+        self.computed = False
+        self.value = None
+
+    def get(self):
+        if not self.computed:
+            self.set(self._compute())
+        return self.value
+
+    def set(self, value):
+        """Provide the value up front, when it was fetched asynchronously."""
+        self.value = value
+        self.computed = True
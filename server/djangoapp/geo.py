@@ -0,0 +1,183 @@
+"""
+In-memory spatial index of dealers.
+
+`GeoIndex` buckets dealers in a grid of latitude/longitude cells. A radius
+query only looks at the cells overlapping the circle, and a k-nearest
+query looks at rings of cells around the query point, nearest first,
+until no unvisited cell can hold a closer dealer. Distances are great
+circle distances in kilometers.
+
+The index is built once from the whole dealer set and replaced when the
+dealers are refreshed, see `restapis.get_dealer_geo_index`.
+"""
+import heapq
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, long1, lat2, long2):
+    """
+    Returns:
+    - float: The great circle distance between two points, in kilometers.
+    """
+    lat1, long1, lat2, long2 = map(math.radians, (lat1, long1, lat2, long2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GeoIndex:
+    """
+    A grid index of items with a latitude and longitude.
+
+    Args:
+    - items (iterable): The items, dealers for instance.
+    - cell_degrees (float): The side of a grid cell, in degrees.
+    - position (callable): Returns the (lat, long) of an item, the ``lat``
+      and ``long`` attributes by default. Items without a valid position
+      are left out.
+    """
+
+    def __init__(self, items, cell_degrees=0.5, position=None):
+        position = position or (lambda item: (item.lat, item.long))
+        self.cell_degrees = cell_degrees
+        self.rows = int(math.ceil(180 / cell_degrees))
+        self.columns = int(math.ceil(360 / cell_degrees))
+        self._cells = {}
+        self._max_abs_lat = 0.0
+        self.size = 0
+        for item in items:
+            try:
+                lat, long = (float(value) for value in position(item))
+            except (TypeError, ValueError):
+                continue
+            if not (-90 <= lat <= 90 and -180 <= long <= 180):
+                continue
+            self._cells.setdefault(self._cell(lat, long), []).append((lat, long, item))
+            self._max_abs_lat = max(self._max_abs_lat, abs(lat))
+            self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    def _row(self, lat):
+        return min(int((lat + 90) // self.cell_degrees), self.rows - 1)
+
+    def _column(self, long):
+        return int((long + 180) // self.cell_degrees) % self.columns
+
+    def _cell(self, lat, long):
+        return self._row(lat), self._column(long)
+
+    def _ring(self, row, column, radius, seen):
+        """
+        Yield the cells at Chebyshev distance radius from a cell, skipping
+        the cells in seen, as rings overlap once they wrap around.
+        """
+        for d_row in range(-radius, radius + 1):
+            r = row + d_row
+            if not 0 <= r < self.rows:
+                continue
+            if abs(d_row) == radius:
+                d_columns = range(-radius, radius + 1)
+            else:
+                d_columns = (-radius, radius)
+            for d_column in d_columns:
+                cell = (r, (column + d_column) % self.columns)
+                if cell not in seen:
+                    seen.add(cell)
+                    yield cell
+
+    def _ring_bound_km(self, lat, radius):
+        """
+        A lower bound of the distance from a point at latitude lat to the
+        items beyond a ring around it.
+        """
+        angle = math.radians(radius * self.cell_degrees)
+        across_latitudes = EARTH_RADIUS_KM * angle
+        # Longitude differences shrink towards the poles, bound them at the
+        # highest latitude of the point and the items
+        shrink = math.cos(math.radians(max(self._max_abs_lat, abs(lat))))
+        across_longitudes = (
+            2 * EARTH_RADIUS_KM * math.asin(min(1.0, shrink * math.sin(angle / 2)))
+        )
+        return min(across_latitudes, across_longitudes)
+
+    def nearest(self, lat, long, k=10, max_km=None):
+        """
+        Find the k items nearest to a point.
+
+        Args:
+        - lat (float): The latitude of the point.
+        - long (float): The longitude of the point.
+        - k (int): The number of items to return.
+        - max_km (float, optional): Leave out items farther than this.
+
+        Returns:
+        - list[tuple]: The (distance in km, item) of the items, nearest
+          first.
+        """
+        if k <= 0 or not self.size:
+            return []
+        row, column = self._cell(lat, long)
+        # Max-heap of the k best so far, as (-distance, tie breaker, item)
+        best = []
+        counter = 0
+        seen = set()
+        for radius in range(max(self.rows, self.columns)):
+            for cell in self._ring(row, column, radius, seen):
+                for item_lat, item_long, item in self._cells.get(cell, ()):
+                    distance = haversine_km(lat, long, item_lat, item_long)
+                    if max_km is not None and distance > max_km:
+                        continue
+                    counter += 1
+                    entry = (-distance, counter, item)
+                    if len(best) < k:
+                        heapq.heappush(best, entry)
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, entry)
+            bound = self._ring_bound_km(lat, radius)
+            if max_km is not None and bound > max_km:
+                break
+            if len(best) == k and -best[0][0] <= bound:
+                break
+        return [(-distance, item) for distance, _, item in sorted(best, reverse=True)]
+
+    def within(self, lat, long, radius_km):
+        """
+        Find the items within a radius of a point.
+
+        Returns:
+        - list[tuple]: The (distance in km, item) of the items, nearest
+          first.
+        """
+        angle = radius_km / EARTH_RADIUS_KM
+        lat_delta = math.degrees(angle)
+        min_row = self._row(max(-90.0, lat - lat_delta))
+        max_row = self._row(min(90.0, lat + lat_delta))
+        if abs(lat) + lat_delta >= 90 or angle >= math.pi / 2:
+            columns = range(self.columns)
+        else:
+            # Widest longitude difference of a point of the circle
+            long_delta = math.degrees(
+                math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(lat))))
+            )
+            if long_delta >= 180:
+                columns = range(self.columns)
+            else:
+                first = int((long - long_delta + 180) // self.cell_degrees)
+                last = int((long + long_delta + 180) // self.cell_degrees)
+                count = min(last - first + 1, self.columns)
+                columns = [(first + i) % self.columns for i in range(count)]
+        found = []
+        for row in range(min_row, max_row + 1):
+            for column in columns:
+                for item_lat, item_long, item in self._cells.get((row, column), ()):
+                    distance = haversine_km(lat, long, item_lat, item_long)
+                    if distance <= radius_km:
+                        found.append((distance, item))
+        found.sort(key=lambda pair: pair[0])
+        return found
@@ -0,0 +1,239 @@
+"""
+Mango indexes needed by the dealerships and reviews services.
+
+The dealerships service queries dealers by `id` and `state`, the review
+service queries reviews by `dealership`. Without a JSON index for these
+selectors Cloudant scans the whole database on every query. `INDEXES`
+declares the indexes, `QUERIES` the query shapes that must use them. The
+indexes are ascending and Cloudant rejects sorts mixing directions, so a
+query sorts every field the same way, descending by walking the index
+backwards.
+
+`VIEWS` declares the map/reduce views of the services. The dealer stats
+view aggregates the reviews of every dealer, and Cloudant keeps it up to
+date on every review written, so the stats of a dealer are read without
+reading its reviews.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from ibm_cloud_sdk_core import ApiException
+from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
+from ibmcloudant.cloudant_v1 import (
+    CloudantV1,
+    DesignDocument,
+    DesignDocumentViewsMapReduce,
+    IndexDefinition,
+    IndexField,
+)
+
+logger = logging.getLogger(__name__)
+
+DESIGN_DOC = "djangoapp-indexes"
+
+# Index name and fields, by database
+INDEXES = {
+    "dealerships": [
+        ("id-index", ["id"]),
+        ("state-index", ["state"]),
+    ],
+    "reviews": [
+        ("dealership-index", ["dealership"]),
+        ("dealership-time-index", ["dealership", "time"]),
+    ],
+}
+
+# Database, selector, sort and the index expected to serve the query
+QUERIES = [
+    ("dealerships", {"id": 1}, None, "id-index"),
+    ("dealerships", {"state": "Texas"}, None, "state-index"),
+    ("reviews", {"dealership": 1}, None, "dealership-index"),
+    (
+        "reviews",
+        {"dealership": 1, "time": {"$gt": None}},
+        [{"dealership": "desc"}, {"time": "desc"}],
+        "dealership-time-index",
+    ),
+]
+
+STATS_DESIGN_DOC = "djangoapp-stats"
+
+# Emits [1, purchased, positive, neutral, negative, time in seconds] per
+# review, reduced with _stats into the count, sums and latest time
+DEALER_STATS_MAP = """function (doc) {
+  if (typeof doc.dealership !== "number") {
+    return;
+  }
+  var time = 0;
+  if (typeof doc.time === "string") {
+    time = Date.parse(doc.time.slice(0, 23) + "Z") / 1000 || 0;
+  }
+  emit(doc.dealership, [
+    1,
+    doc.purchase ? 1 : 0,
+    doc.sentiment === "SENT_POSITIVE" ? 1 : 0,
+    doc.sentiment === "SENT_NEUTRAL" ? 1 : 0,
+    doc.sentiment === "SENT_NEGATIVE" ? 1 : 0,
+    time
+  ]);
+}"""
+
+# View name, map function and reducer, by database and design document
+VIEWS = {
+    ("reviews", STATS_DESIGN_DOC): [
+        ("dealer-stats", DEALER_STATS_MAP, "_stats"),
+    ],
+}
+
+
+def get_cloudant_service():
+    """
+    Return a Cloudant client for settings.CLOUDANT_URL.
+
+    Returns:
+        CloudantV1: The client, None if Cloudant is not configured.
+    """
+    if not settings.CLOUDANT_URL or not settings.CLOUDANT_API_KEY:
+        return None
+    service = CloudantV1(authenticator=IAMAuthenticator(settings.CLOUDANT_API_KEY))
+    service.set_service_url(settings.CLOUDANT_URL)
+    return service
+
+
+def existing_indexes(service, db):
+    """
+    Returns:
+        set: The names of the JSON indexes of a database.
+    """
+    result = service.get_indexes_information(db=db).get_result()
+    return {index["name"] for index in result["indexes"] if index["type"] == "json"}
+
+
+def missing_indexes(service):
+    """
+    Returns:
+        list: The (database, index name) of every declared index missing,
+        then the (database, "_design/" name) of every design document of
+        `VIEWS` missing or out of date.
+    """
+    missing = []
+    for db, indexes in INDEXES.items():
+        existing = existing_indexes(service, db)
+        missing.extend((db, name) for name, _ in indexes if name not in existing)
+    for (db, ddoc), views in VIEWS.items():
+        _, current = _design_document_state(service, db, ddoc, views)
+        if current != "exists":
+            missing.append((db, f"_design/{ddoc}"))
+    return missing
+
+
+def ensure_indexes(service):
+    """
+    Create the declared indexes that do not exist yet.
+
+    Returns:
+        list: The (database, index name, result) of every declared index,
+        result being "created" or "exists".
+    """
+    results = []
+    for db, indexes in INDEXES.items():
+        for name, fields in indexes:
+            index = IndexDefinition(
+                fields=[IndexField(**{field: "asc"}) for field in fields]
+            )
+            response = service.post_index(
+                db=db, index=index, ddoc=DESIGN_DOC, name=name, type="json"
+            ).get_result()
+            results.append((db, name, response["result"]))
+    return results
+
+
+def _design_document_state(service, db, ddoc, views):
+    """
+    Returns:
+        tuple: The design document declaring views, with the revision of
+        the current one if any, and "created", "updated" or "exists": what
+        saving it would do.
+    """
+    declared = {
+        name: DesignDocumentViewsMapReduce(map=map, reduce=reduce)
+        for name, map, reduce in views
+    }
+    try:
+        current = service.get_design_document(db=db, ddoc=ddoc).get_result()
+    except ApiException as err:
+        if err.code != 404:
+            raise
+        current = None
+    document = DesignDocument(views=declared)
+    if current is None:
+        return document, "created"
+    if current.get("views") == document.to_dict()["views"]:
+        return document, "exists"
+    document.rev = current["_rev"]
+    return document, "updated"
+
+
+def ensure_views(service):
+    """
+    Create or update the design documents declaring `VIEWS`.
+
+    Returns:
+        list: The (database, design document, result) of every design
+        document, result being "created", "updated" or "exists".
+    """
+    results = []
+    for (db, ddoc), views in VIEWS.items():
+        document, result = _design_document_state(service, db, ddoc, views)
+        if result != "exists":
+            service.put_design_document(db=db, ddoc=ddoc, design_document=document)
+        results.append((db, ddoc, result))
+    return results
+
+
+def explain_queries(service):
+    """
+    Ask Cloudant which index serves each query of `QUERIES`.
+
+    Returns:
+        list: The (database, selector, expected index, used index) of
+        every query.
+    """
+    explained = []
+    for db, selector, sort, expected in QUERIES:
+        options = {"sort": sort} if sort else {}
+        result = service.post_explain(db=db, selector=selector, **options).get_result()
+        explained.append((db, selector, expected, result["index"]["name"]))
+    return explained
+
+
+def warn_missing_indexes():
+    """
+    Log a warning for every declared index missing in Cloudant.
+    """
+    service = get_cloudant_service()
+    if service is None:
+        return
+    try:
+        missing = missing_indexes(service)
+    except ApiException as err:
+        logger.warning("Unable to check the Cloudant indexes: %s", err)
+        return
+    for db, name in missing:
+        logger.warning(
+            "Cloudant index %s is missing or out of date on %s, queries will "
+            "scan the database. Run 'python manage.py ensure_cloudant_indexes'.",
+            name,
+            db,
+        )
+
+
+def start_index_check():
+    """
+    Warn about missing indexes from a background thread, without delaying
+    startup, if settings.CLOUDANT_CHECK_INDEXES is set. Called by the WSGI
+    and ASGI entry points.
+    """
+    if settings.CLOUDANT_CHECK_INDEXES:
+        threading.Thread(target=warn_missing_indexes, daemon=True).start()
@@ -0,0 +1,333 @@
+"""
+Bulk loading of dealers and reviews, see ``python manage.py load_data``.
+
+`iter_json_documents` streams the documents of a JSON array, such as the
+files of ``cloudant/data``, without reading the whole file. `load` writes
+documents in batches to a target, several batches at a time, and records
+in a `Checkpoint` how many documents are safely written, so a load that
+failed can resume where it stopped.
+
+Documents get ids derived from their ``id`` field, so documents written
+twice (by a resumed load, or by loading a file again) are stored once.
+"""
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from ibm_cloud_sdk_core import ApiException
+
+from .restapis import post_request
+
+
+class LoadError(Exception):
+    """A batch could not be written."""
+
+
+def _find_array_start(f, key, buffer, chunk_size):
+    """Read until the array holding the documents starts."""
+    pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key)) if key else None
+    while True:
+        stripped = buffer.lstrip()
+        if stripped.startswith("["):
+            return stripped[1:]
+        if pattern is not None:
+            match = pattern.search(buffer)
+            if match:
+                return buffer[match.end() :]
+        chunk = f.read(chunk_size)
+        if not chunk:
+            raise ValueError(f"No array of documents found for key {key!r}")
+        buffer += chunk
+
+
+def iter_json_documents(f, key=None, chunk_size=1 << 16):
+    """
+    Yield the documents of a JSON array, reading f chunk by chunk.
+
+    Args:
+    - f (file): A text file holding the array, or an object with the array
+      as value of key.
+    - key (str, optional): The key of the array, as in
+      ``{"reviews": [...]}``. A top-level array is read in any case.
+    - chunk_size (int): Characters read at a time.
+    """
+    decoder = json.JSONDecoder()
+    buffer = _find_array_start(f, key, "", chunk_size)
+    pos = 0
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buffer):
+            buffer = f.read(chunk_size)
+            pos = 0
+            if not buffer:
+                raise ValueError("Unexpected end of file in the array")
+            continue
+        if buffer[pos] == "]":
+            return
+        try:
+            doc, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield doc
+        pos = end
+        if pos >= chunk_size:
+            buffer = buffer[pos:]
+            pos = 0
+
+
+def iter_json_lines(f):
+    """
+    Yield the documents of a JSON lines file.
+    """
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def prepare_document(kind, doc):
+    """
+    Give a dealer or review a document id derived from its ``id``.
+
+    Reviews get an idempotency key, from which the review service derives
+    the same document id.
+    """
+    if kind == "dealerships":
+        return dict(doc, _id=f"dealer-{doc['id']}")
+    key = f"import-{doc['id']}"
+    return dict(doc, idempotency_key=key, _id=f"review-{key}")
+
+
+class CloudantTarget:
+    """
+    Write documents to a Cloudant database with _bulk_docs.
+
+    Args:
+    - service (CloudantV1): The Cloudant client.
+    - db (str): The database name.
+    """
+
+    def __init__(self, service, db):
+        self.service = service
+        self.db = db
+
+    def write(self, docs):
+        """
+        Returns:
+        - dict: The number of documents created and already existing, and
+          the errors by index in docs, as the bulk review endpoint does.
+        """
+        results = self.service.post_bulk_docs(
+            db=self.db, bulk_docs={"docs": docs}
+        ).get_result()
+        report = {"created": 0, "exists": 0, "errors": []}
+        for index, result in enumerate(results):
+            if "error" not in result:
+                report["created"] += 1
+            elif result["error"] == "conflict":
+                report["exists"] += 1
+            else:
+                report["errors"].append(
+                    {
+                        "index": index,
+                        "error": result["error"],
+                        "reason": result.get("reason"),
+                    }
+                )
+        return report
+
+
+class HttpTarget:
+    """
+    Write reviews to the bulk endpoint of the review service.
+
+    Args:
+    - url (str): The bulk endpoint, settings.POST_REVIEWS_BULK_API_URL.
+    """
+
+    def __init__(self, url):
+        self.url = url
+
+    def write(self, docs):
+        response = post_request(self.url, docs)
+        if response.status_code != 200:
+            raise LoadError(f"HTTP {response.status_code}: {response.text[:200]}")
+        return response.json()
+
+
+class Checkpoint:
+    """
+    The number of documents of a load written so far, kept in a JSON file
+    shared by several loads.
+
+    Args:
+    - path (str): The checkpoint file.
+    - name (str): The name of the load in the file.
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.done = self._read().get(name, 0)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save(self, done):
+        self.done = done
+        data = self._read()
+        data[self.name] = done
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temporary, self.path)
+
+
+class LoadStats:
+    """Counts of a load in progress, safe to read from another thread."""
+
+    def __init__(self, skipped=0):
+        self.started = time.monotonic()
+        self.skipped = skipped
+        self.created = 0
+        self.exists = 0
+        self.failed = 0
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def add(self, report, offset):
+        with self._lock:
+            self.created += report["created"]
+            self.exists += report["exists"]
+            self.failed += len(report["errors"])
+            for error in report["errors"]:
+                self.errors.append(dict(error, index=offset + error["index"]))
+
+    @property
+    def written(self):
+        return self.created + self.exists + self.failed
+
+    def throughput(self):
+        """
+        Returns:
+        - float: Documents written per second since the load started.
+        """
+        elapsed = time.monotonic() - self.started
+        return self.written / elapsed if elapsed else 0.0
+
+
+def _batches(documents, batch_size):
+    iterator = iter(documents)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_batch(target, batch, retries=3, backoff=1.0):
+    """
+    Write one batch, retrying failed requests with exponential backoff.
+
+    Raises:
+    - LoadError: If the batch still fails after the retries.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return target.write(batch)
+        except (LoadError, requests.exceptions.RequestException, ApiException) as e:
+            if attempt == retries:
+                raise LoadError(f"Batch failed after {retries + 1} attempts: {e}")
+            time.sleep(backoff * 2 ** attempt)
+
+
+def load(
+    documents,
+    target,
+    batch_size=500,
+    workers=4,
+    checkpoint=None,
+    on_batch=None,
+    retries=3,
+):
+    """
+    Write documents to a target in batches, workers batches at a time.
+
+    Documents already written according to the checkpoint are skipped. The
+    checkpoint advances once every batch before it is written, so it never
+    counts a document that may be missing.
+
+    Args:
+    - documents (iterable): The documents, in a stable order.
+    - target (object): Has a ``write(docs)`` method, see `HttpTarget`.
+    - batch_size (int): Documents per write.
+    - workers (int): Writes in flight at once.
+    - checkpoint (Checkpoint, optional): Where progress is recorded.
+    - on_batch (callable, optional): Called with the `LoadStats` after
+      every batch written.
+    - retries (int): Retries of a failed batch before giving up.
+
+    Returns:
+    - LoadStats: The counts of the load.
+
+    Raises:
+    - LoadError: If a batch could not be written. The checkpoint then
+      records the documents written before it.
+    """
+    skip = checkpoint.done if checkpoint is not None else 0
+    stats = LoadStats(skipped=skip)
+    documents = itertools.islice(documents, skip, None)
+    in_flight = {}
+    finished_sizes = {}
+    next_batch = 0
+    done = skip
+
+    def collect(futures):
+        nonlocal next_batch, done
+        for future in futures:
+            number, offset, size = in_flight.pop(future)
+            stats.add(future.result(), offset)
+            finished_sizes[number] = size
+        advanced = False
+        while next_batch in finished_sizes:
+            done += finished_sizes.pop(next_batch)
+            next_batch += 1
+            advanced = True
+        if advanced and checkpoint is not None:
+            checkpoint.save(done)
+        if on_batch is not None:
+            on_batch(stats)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            offset = skip
+            for number, batch in enumerate(_batches(documents, batch_size)):
+                future = executor.submit(write_batch, target, batch, retries)
+                in_flight[future] = (number, offset, len(batch))
+                offset += len(batch)
+                # Bound the documents held in memory
+                if len(in_flight) >= workers * 2:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(finished)
+            while in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(finished)
+        except BaseException:
+            for future in in_flight:
+                future.cancel()
+            raise
+    return stats
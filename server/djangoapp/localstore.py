@@ -0,0 +1,514 @@
+"""
+Local stand-ins for the dealerships and reviews services.
+
+`LocalStore` loads the sample data of ``cloudant/data`` into memory and
+indexes it the way the Cloudant queries of the services need: dealers by
+id and state, reviews by dealership. `LocalServices` serves the store over
+HTTP with the contracts of the cloud functions:
+
+- ``GET /dealerships/get`` with optional ``id``, ``state``, ``limit`` and
+  ``bookmark``, see ``functions/get-dealership.js``
+- ``GET /api/get_reviews`` with ``id`` and optional ``limit``, ``bookmark``
+  and ``format=jsonl``, see ``functions/reviews.py``. Answers carry an
+  ETag and a request with a matching If-None-Match gets a 304.
+- ``POST /api/post_review`` and ``POST /api/post_reviews``, the bulk
+  version taking a JSON array or JSON lines
+- ``GET /api/get_dealer_stats`` with optional ``ids``, the review stats
+  of dealers, kept up to date as reviews are added
+- ``GET /api/reviews/changes`` with optional ``since`` and ``limit``, the
+  reviews in the order they were added
+- ``POST /sentiment``, a fixed neutral answer standing in for the
+  sentiment service
+- ``POST /nlu/v1/analyze``, standing in for Watson Natural Language
+  Understanding: the most frequent words of the text as keywords, its
+  capitalized words as entities and a fixed emotion
+- ``POST /identity/token``, standing in for the IAM token service, with
+  tokens valid for an hour
+
+An optional latency is added to every answer. Run the services with
+``python manage.py runlocalservices`` and select them with UPSTREAM=local.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import jwt
+
+DATA_DIR = Path(__file__).resolve().parent.parent.parent / "cloudant" / "data"
+
+# Fields a review must have, as checked by the review service
+REQUIRED_REVIEW_FIELDS = (
+    "id",
+    "name",
+    "dealership",
+    "review",
+    "purchase",
+    "purchase_date",
+    "car_make",
+    "car_model",
+    "car_year",
+)
+
+# Unpaged dealer queries return at most this many dealers, as the
+# dealerships function does
+UNPAGED_DEALERS_LIMIT = 10
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 200
+
+
+def load_json_data(name, key, data_dir=DATA_DIR):
+    with open(Path(data_dir) / name) as f:
+        return json.load(f)[key]
+
+
+# Sentiment labels counted in the dealer stats, by stats key
+SENTIMENT_KEYS = {
+    "SENT_POSITIVE": "positive",
+    "SENT_NEUTRAL": "neutral",
+    "SENT_NEGATIVE": "negative",
+}
+
+# The emotion of every text analyzed by the local NLU stand-in
+NLU_EMOTION = {
+    "joy": 0.5,
+    "sadness": 0.1,
+    "anger": 0.1,
+    "fear": 0.1,
+    "disgust": 0.1,
+}
+_WORD = re.compile(r"[A-Za-z][A-Za-z'-]*")
+# Signs the tokens of the local IAM stand-in, which nothing verifies
+TOKEN_KEY = "local-services-token-signing-key"
+
+
+def _page(docs, limit, bookmark):
+    """Slice one page, bookmarks being the offset of the next page."""
+    start = int(bookmark) if bookmark else 0
+    end = start + limit
+    return docs[start:end], str(end)
+
+
+class LocalStore:
+    """
+    Indexed in-memory dealers and reviews.
+
+    Args:
+        dealers (list): The dealer documents.
+        reviews (list): The review documents.
+    """
+
+    def __init__(self, dealers=(), reviews=()):
+        self._lock = threading.Lock()
+        self.dealers = []
+        self.dealers_by_id = {}
+        self.dealers_by_state = {}
+        self.reviews_by_dealership = {}
+        self.stats_by_dealership = {}
+        self.review_log = []
+        self.review_keys = set()
+        self.review_count = 0
+        # Part of every ETag, so that no other store answers a 304 to them
+        self.etag_salt = uuid.uuid4().hex
+        for dealer in dealers:
+            self.add_dealer(dealer)
+        for review in reviews:
+            self.add_review(review)
+
+    @classmethod
+    def from_sample_data(cls, data_dir=DATA_DIR):
+        """Load dealerships.json and reviews-full.json."""
+        return cls(
+            load_json_data("dealerships.json", "dealerships", data_dir),
+            load_json_data("reviews-full.json", "reviews", data_dir),
+        )
+
+    def add_dealer(self, dealer):
+        with self._lock:
+            self.dealers.append(dealer)
+            self.dealers_by_id.setdefault(dealer["id"], []).append(dealer)
+            self.dealers_by_state.setdefault(dealer["state"], []).append(dealer)
+
+    def add_review(self, review):
+        """
+        Returns:
+            dict: The review, None if a review with the same idempotency
+            key was already added.
+        """
+        key = review.get("idempotency_key")
+        with self._lock:
+            if key:
+                if key in self.review_keys:
+                    return None
+                self.review_keys.add(key)
+            self.reviews_by_dealership.setdefault(review["dealership"], []).append(
+                review
+            )
+            self._count_review(review)
+            self.review_log.append(review)
+            self.review_count += 1
+        return review
+
+    def _count_review(self, review):
+        stats = self.stats_by_dealership.get(review["dealership"])
+        if stats is None:
+            stats = self.stats_by_dealership[review["dealership"]] = {
+                "dealership": review["dealership"],
+                "review_count": 0,
+                "purchase_count": 0,
+                "sentiment": {"positive": 0, "neutral": 0, "negative": 0},
+                "latest_review_time": None,
+            }
+        stats["review_count"] += 1
+        if review.get("purchase"):
+            stats["purchase_count"] += 1
+        sentiment = SENTIMENT_KEYS.get(review.get("sentiment"))
+        if sentiment:
+            stats["sentiment"][sentiment] += 1
+        time = review.get("time")
+        if time and (stats["latest_review_time"] or "") < time:
+            stats["latest_review_time"] = time
+
+    def find_dealers(self, id=None, state=None):
+        """
+        Returns:
+            list: The dealers matching the optional id and state.
+        """
+        if id is not None:
+            docs = self.dealers_by_id.get(id, [])
+            if state is not None:
+                docs = [dealer for dealer in docs if dealer["state"] == state]
+        elif state is not None:
+            docs = self.dealers_by_state.get(state, [])
+        else:
+            docs = self.dealers
+        return list(docs)
+
+    def find_reviews(self, dealership):
+        """
+        Returns:
+            list: The reviews of a dealership.
+        """
+        return list(self.reviews_by_dealership.get(dealership, []))
+
+    def reviews_etag(self, dealership, query):
+        """
+        Returns:
+            str: The ETag of an answer of the reviews of a dealership, which
+            changes when a review of the dealership is added.
+        """
+        count = len(self.reviews_by_dealership.get(dealership, ()))
+        version = f"{self.etag_salt}\0{dealership}\0{count}\0{query}"
+        return '"' + hashlib.sha1(version.encode()).hexdigest() + '"'
+
+    def changes(self, since=0, limit=1000):
+        """
+        Returns:
+            dict: The reviews added after the first since, as a page of the
+            changes feed of the review service.
+        """
+        with self._lock:
+            reviews = self.review_log[since : since + limit]
+            pending = since + limit < len(self.review_log)
+        results = [
+            {"id": review.get("_id") or f"local-{since + offset}", "doc": review}
+            for offset, review in enumerate(reviews)
+        ]
+        last_seq = str(since + len(results))
+        return {"results": results, "last_seq": last_seq, "pending": pending}
+
+    def dealer_stats(self, ids=None):
+        """
+        Returns:
+            list: The review stats of the dealers in ids, or of every
+            dealer, leaving out dealers without reviews.
+        """
+        with self._lock:
+            if ids is None:
+                ids = sorted(self.stats_by_dealership)
+            found = [self.stats_by_dealership.get(id) for id in ids]
+            return [json.loads(json.dumps(stats)) for stats in found if stats]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/dealerships/get":
+            self._get_dealerships(query)
+        elif url.path == "/api/get_reviews":
+            self._get_reviews(query, url.query)
+        elif url.path == "/api/get_dealer_stats":
+            self._get_dealer_stats(query)
+        elif url.path == "/api/reviews/changes":
+            self._get_changes(query)
+        else:
+            self._reply({"error": "Not found"}, status=404)
+
+    def do_POST(self):
+        time.sleep(self.server.latency)
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if url.path == "/api/post_reviews":
+            self._post_reviews(body)
+            return
+        try:
+            payload = json.loads(body or b"null")
+        except ValueError:
+            payload = None
+        if url.path == "/api/post_review":
+            self._post_review(payload)
+        elif url.path == "/sentiment":
+            self._reply({"documentSentiment": {"label": "SENT_NEUTRAL", "score": 0.5}})
+        elif url.path == "/nlu/v1/analyze":
+            self._analyze(payload)
+        elif url.path == "/identity/token":
+            self._issue_token()
+        else:
+            self._reply({"error": "Not found"}, status=404)
+
+    def _paging(self, query):
+        """Return the page size asked for, None for an unpaged request."""
+        if "limit" not in query and "bookmark" not in query:
+            return None
+        try:
+            limit = int(query.get("limit", DEFAULT_PAGE_SIZE))
+        except ValueError:
+            limit = DEFAULT_PAGE_SIZE
+        return max(1, min(limit, MAX_PAGE_SIZE))
+
+    def _get_dealerships(self, query):
+        store = self.server.store
+        try:
+            dealer_id = int(query["id"]) if query.get("id") else None
+        except ValueError:
+            self._reply({"error": "'id' parameter must be an integer"}, status=400)
+            return
+        dealers = store.find_dealers(id=dealer_id, state=query.get("state") or None)
+        limit = self._paging(query)
+        if limit is None:
+            self._reply(dealers[:UNPAGED_DEALERS_LIMIT])
+        else:
+            docs, bookmark = _page(dealers, limit, query.get("bookmark"))
+            self._reply({"docs": docs, "bookmark": bookmark})
+
+    def _get_reviews(self, query, query_string):
+        if "id" not in query:
+            self._reply({"error": "Missing 'id' parameter in the URL"}, status=400)
+            return
+        try:
+            dealership = int(query["id"])
+        except ValueError:
+            self._reply({"error": "'id' parameter must be an integer"}, status=400)
+            return
+        store = self.server.store
+        etag = store.reviews_etag(dealership, query_string)
+        if etag in self.headers.get("If-None-Match", ""):
+            self._send(b"", None, status=304, etag=etag)
+            return
+        reviews = store.find_reviews(dealership)
+        if query.get("format") == "jsonl":
+            body = "".join(json.dumps(review) + "\n" for review in reviews)
+            self._send(body.encode(), "application/x-ndjson", etag=etag)
+            return
+        limit = self._paging(query)
+        if limit is None:
+            self._reply(reviews, etag=etag)
+        else:
+            docs, bookmark = _page(reviews, limit, query.get("bookmark"))
+            self._reply({"docs": docs, "bookmark": bookmark}, etag=etag)
+
+    def _get_dealer_stats(self, query):
+        ids = None
+        if query.get("ids"):
+            try:
+                ids = [int(id) for id in query["ids"].split(",")]
+            except ValueError:
+                error = {"error": "'ids' must be integers separated by commas"}
+                self._reply(error, status=400)
+                return
+        self._reply(self.server.store.dealer_stats(ids))
+
+    def _get_changes(self, query):
+        try:
+            since = int(query.get("since") or 0)
+            limit = int(query.get("limit") or 1000)
+        except ValueError:
+            self._reply({"error": "'since' and 'limit' must be integers"}, status=400)
+            return
+        self._reply(self.server.store.changes(since, max(1, limit)))
+
+    def _post_review(self, payload):
+        if not isinstance(payload, dict):
+            self._reply({"error": "Invalid JSON data"}, status=400)
+            return
+        if isinstance(payload.get("review"), dict):
+            payload = payload["review"]
+        for field in REQUIRED_REVIEW_FIELDS:
+            if field not in payload:
+                self._reply({"error": f"Missing required field: {field}"}, status=400)
+                return
+        if self.server.store.add_review(payload) is None:
+            self._reply({"message": "Review already posted"})
+        else:
+            self._reply({"message": "Review posted successfully"}, status=201)
+
+    def _post_reviews(self, body):
+        content_type = self.headers.get("Content-Type", "").split(";")[0]
+        if content_type in ("application/x-ndjson", "application/jsonl"):
+            lines = [line for line in body.splitlines() if line.strip()]
+        else:
+            try:
+                docs = json.loads(body or b"null")
+            except ValueError:
+                docs = None
+            if not isinstance(docs, list):
+                error = {"error": "Expected a JSON array or JSON lines"}
+                self._reply(error, status=400)
+                return
+            lines = [json.dumps(doc) for doc in docs]
+        report = {"created": 0, "exists": 0, "errors": []}
+        for index, line in enumerate(lines):
+            try:
+                doc = json.loads(line)
+            except ValueError as err:
+                reason = f"Invalid JSON: {err}"
+            else:
+                reason = self._review_error(doc)
+            if reason:
+                error = {"index": index, "error": "invalid", "reason": reason}
+                report["errors"].append(error)
+            elif self.server.store.add_review(doc) is None:
+                report["exists"] += 1
+            else:
+                report["created"] += 1
+        self._reply(report)
+
+    def _review_error(self, doc):
+        if not isinstance(doc, dict):
+            return "Review must be a JSON object"
+        for field in REQUIRED_REVIEW_FIELDS:
+            if field not in doc:
+                return f"Missing required field: {field}"
+        return None
+
+    def _analyze(self, payload):
+        text = payload.get("text") if isinstance(payload, dict) else None
+        if not text or not text.strip():
+            self._reply({"error": "no text to analyze", "code": 422}, status=422)
+            return
+        words = [word for word in _WORD.findall(text) if len(word) > 3]
+        counts = Counter(word.lower() for word in words)
+        keywords = [
+            {"text": word, "relevance": round(count / len(words), 3), "count": count}
+            for word, count in counts.most_common(5)
+        ]
+        entities = [
+            {"type": "Organization", "text": word, "relevance": 0.5, "count": 1}
+            for word in dict.fromkeys(words[1:])
+            if word[0].isupper()
+        ][:5]
+        emotion = {"document": {"emotion": dict(NLU_EMOTION)}}
+        self._reply(
+            {
+                "language": "en",
+                "keywords": keywords,
+                "entities": entities,
+                "emotion": emotion,
+            }
+        )
+
+    def _issue_token(self):
+        now = int(time.time())
+        claims = {"iat": now, "exp": now + 3600, "sub": "local"}
+        self.server.tokens_issued += 1
+        self._reply(
+            {
+                "access_token": jwt.encode(claims, TOKEN_KEY, algorithm="HS256"),
+                "refresh_token": "not_supported",
+                "token_type": "Bearer",
+                "expires_in": 3600,
+                "expiration": claims["exp"],
+            }
+        )
+
+    def _reply(self, payload, status=200, etag=None):
+        self._send(json.dumps(payload).encode(), "application/json", status, etag)
+
+    def _send(self, body, content_type, status=200, etag=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class LocalServices:
+    """
+    Serve a `LocalStore` over HTTP, in a background thread.
+
+    Args:
+        store (LocalStore): The data served, the sample data by default.
+        latency (float): Seconds to wait before answering each request.
+        host (str): The interface to listen on.
+        port (int): The port to listen on, any free port by default.
+    """
+
+    def __init__(self, store=None, latency=0.0, host="127.0.0.1", port=0):
+        self.store = store if store is not None else LocalStore.from_sample_data()
+        self.server = _Server((host, port), _Handler)
+        self.server.store = self.store
+        self.server.latency = latency
+        # IAM tokens handed out, see `_Handler._issue_token`
+        self.server.tokens_issued = 0
+        host, port = self.server.server_address[:2]
+        self.url = f"http://{host}:{port}"
+
+    def urls(self):
+        """Return the upstream URL settings pointing at these services."""
+        return {
+            "DEALERSHIPS_API_URL": self.url + "/dealerships/get",
+            "REVIEWS_API_URL": self.url + "/api/get_reviews",
+            "POST_REVIEW_API_URL": self.url + "/api/post_review",
+            "POST_REVIEWS_BULK_API_URL": self.url + "/api/post_reviews",
+            "DEALER_STATS_API_URL": self.url + "/api/get_dealer_stats",
+            "REVIEW_CHANGES_API_URL": self.url + "/api/reviews/changes",
+            "SENTIMENT_API_URL": self.url + "/sentiment",
+            "NLU_API_URL": self.url + "/nlu",
+            "NLU_IAM_URL": self.url,
+        }
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
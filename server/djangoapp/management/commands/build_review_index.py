@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from djangoapp.search import ReviewIndex, update_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the review search index from the whole changes feed of the "
+        "review service and save it to REVIEW_SEARCH_INDEX_PATH."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        index = ReviewIndex()
+        try:
+            update_index(index, settings.REVIEW_CHANGES_API_URL, options["batch_size"])
+        except RuntimeError as err:
+            raise CommandError(str(err))
+        index.save(settings.REVIEW_SEARCH_INDEX_PATH)
+        self.stdout.write(
+            f"Indexed {len(index)} reviews, {len(index.postings)} terms, in "
+            f"{time.monotonic() - started:.1f}s"
+        )
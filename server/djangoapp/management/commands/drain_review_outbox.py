@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from djangoapp.outbox import drain_all
+
+
+class Command(BaseCommand):
+    help = (
+        "Post the reviews waiting in the review outbox to the review service. "
+        "With --loop, keep draining every --interval seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--loop", action="store_true")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help="Seconds between drains with --loop, OUTBOX_POLL_INTERVAL by default.",
+        )
+
+    def handle(self, *args, **options):
+        interval = options["interval"] or settings.OUTBOX_POLL_INTERVAL
+        try:
+            while True:
+                counts = drain_all(options["batch_size"])
+                if any(counts.values()):
+                    self.stdout.write(
+                        f"Sent {counts['sent']}, retrying {counts['retry']}, "
+                        f"failed {counts['failed']}"
+                    )
+                if not options["loop"]:
+                    return
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,57 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from djangoapp.enrichment import enrich_reviews
+from djangoapp.restapis import get_review_changes_from_cf
+
+
+class Command(BaseCommand):
+    help = (
+        "Extract the keywords, entities and emotion of every review of the "
+        "review service with Watson NLU, reading them from its changes feed. "
+        "Reviews already enriched are not sent again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument(
+            "--since", default="0", help="Changes feed sequence to start after."
+        )
+
+    def handle(self, *args, **options):
+        if not settings.NLU_API_URL:
+            raise CommandError("NLU_API_URL is not set.")
+        started = time.monotonic()
+        since = options["since"]
+        enriched = failed = 0
+        while True:
+            page = get_review_changes_from_cf(
+                settings.REVIEW_CHANGES_API_URL,
+                since=since,
+                limit=options["batch_size"],
+            )
+            if page is None:
+                raise CommandError(
+                    f"Unable to read the changes feed after {since}, "
+                    f"rerun with --since {since}"
+                )
+            texts = [
+                change["doc"]["review"]
+                for change in page["results"]
+                if not change.get("deleted") and "review" in (change.get("doc") or {})
+            ]
+            results = enrich_reviews(texts)
+            enriched += sum(1 for result in results if result is not None)
+            failed += sum(1 for result in results if result is None)
+            # A feed that does not advance would be read again forever
+            if not page["results"] or page["last_seq"] == since:
+                break
+            since = page["last_seq"]
+            if not page.get("pending"):
+                break
+        self.stdout.write(
+            f"Enriched {enriched} reviews, {failed} failed, in "
+            f"{time.monotonic() - started:.1f}s"
+        )
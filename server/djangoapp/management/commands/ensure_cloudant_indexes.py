@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from djangoapp import indexes
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the Mango indexes and map/reduce views used by the dealerships "
+        "and reviews services and check with explain that their queries use "
+        "the indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report missing indexes and views, do not create them.",
+        )
+
+    def handle(self, *args, **options):
+        service = indexes.get_cloudant_service()
+        if service is None:
+            raise CommandError("Set IBM_URL and IBM_API_KEY first.")
+
+        if options["check"]:
+            missing = indexes.missing_indexes(service)
+            for db, name in missing:
+                self.stdout.write(self.style.WARNING(f"{db}: {name} is missing"))
+            if missing:
+                raise CommandError(f"{len(missing)} indexes or views are missing.")
+            self.stdout.write(self.style.SUCCESS("All indexes and views exist."))
+            return
+
+        for db, name, result in indexes.ensure_indexes(service):
+            self.stdout.write(f"{db}: {name} {result}")
+        for db, ddoc, result in indexes.ensure_views(service):
+            self.stdout.write(f"{db}: _design/{ddoc} {result}")
+
+        mismatches = 0
+        for db, selector, expected, used in indexes.explain_queries(service):
+            if used == expected:
+                self.stdout.write(f"{db} {selector}: uses {used}")
+            else:
+                mismatches += 1
+                self.stdout.write(
+                    self.style.WARNING(f"{db} {selector}: uses {used}, not {expected}")
+                )
+        if mismatches:
+            raise CommandError(f"{mismatches} queries do not use their index.")
+        self.stdout.write(self.style.SUCCESS("All queries use their index."))
@@ -0,0 +1,123 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from djangoapp.indexes import get_cloudant_service
+from djangoapp.loader import (
+    Checkpoint,
+    CloudantTarget,
+    HttpTarget,
+    LoadError,
+    iter_json_documents,
+    iter_json_lines,
+    load,
+    prepare_document,
+)
+from djangoapp.localstore import DATA_DIR
+
+DEFAULT_FILES = {
+    "dealerships": DATA_DIR / "dealerships.json",
+    "reviews": DATA_DIR / "reviews-full.json",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Load dealerships or reviews from a JSON file (an array, or an object "
+        "holding the array under the kind name) or a JSON lines file, in "
+        "batches, into Cloudant or, for reviews, the bulk endpoint of the "
+        "review service. With --checkpoint, a failed load resumes where it "
+        "stopped when run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(DEFAULT_FILES))
+        parser.add_argument(
+            "path", nargs="?", help="The file to load, the sample data by default."
+        )
+        parser.add_argument(
+            "--target",
+            choices=["cloudant", "http"],
+            default="cloudant",
+            help="Cloudant (IBM_URL, IBM_API_KEY) or POST_REVIEWS_BULK_API_URL.",
+        )
+        parser.add_argument("--db", help="The Cloudant database, the kind by default.")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--retries", type=int, default=3)
+        parser.add_argument("--checkpoint", help="The checkpoint file.")
+        parser.add_argument(
+            "--report-interval",
+            type=float,
+            default=5.0,
+            help="Seconds between progress reports.",
+        )
+
+    def get_target(self, options):
+        kind = options["kind"]
+        if options["target"] == "http":
+            if kind != "reviews":
+                raise CommandError("The http target only loads reviews.")
+            if not settings.POST_REVIEWS_BULK_API_URL:
+                raise CommandError("POST_REVIEWS_BULK_API_URL is not set.")
+            return HttpTarget(settings.POST_REVIEWS_BULK_API_URL)
+        service = get_cloudant_service()
+        if service is None:
+            raise CommandError("Set IBM_URL and IBM_API_KEY to load into Cloudant.")
+        return CloudantTarget(service, options["db"] or kind)
+
+    def handle(self, *args, **options):
+        kind = options["kind"]
+        path = os.path.abspath(options["path"] or DEFAULT_FILES[kind])
+        target = self.get_target(options)
+        checkpoint = None
+        if options["checkpoint"]:
+            name = f"{kind}:{options['target']}:{path}"
+            checkpoint = Checkpoint(options["checkpoint"], name)
+            if checkpoint.done:
+                self.stdout.write(f"Resuming after {checkpoint.done} documents")
+
+        last_report = time.monotonic()
+
+        def report(stats):
+            nonlocal last_report
+            if time.monotonic() - last_report >= options["report_interval"]:
+                last_report = time.monotonic()
+                self.stdout.write(
+                    f"{stats.written} documents written, "
+                    f"{stats.throughput():.0f} documents/s"
+                )
+
+        with open(path, encoding="utf-8") as f:
+            if path.endswith((".jsonl", ".ndjson")):
+                documents = iter_json_lines(f)
+            else:
+                documents = iter_json_documents(f, key=kind)
+            documents = (prepare_document(kind, doc) for doc in documents)
+            try:
+                stats = load(
+                    documents,
+                    target,
+                    batch_size=options["batch_size"],
+                    workers=options["workers"],
+                    checkpoint=checkpoint,
+                    on_batch=report,
+                    retries=options["retries"],
+                )
+            except LoadError as e:
+                done = checkpoint.done if checkpoint is not None else 0
+                raise CommandError(f"{e}. {done} documents are checkpointed.")
+
+        for error in stats.errors[:20]:
+            self.stderr.write(
+                f"Document {error['index']}: {error['error']}: {error.get('reason')}"
+            )
+        elapsed = time.monotonic() - stats.started
+        self.stdout.write(
+            f"Loaded {stats.written} {kind} in {elapsed:.1f}s "
+            f"({stats.throughput():.0f} documents/s): {stats.created} created, "
+            f"{stats.exists} already loaded, {stats.failed} failed, "
+            f"{stats.skipped} skipped from the checkpoint"
+        )
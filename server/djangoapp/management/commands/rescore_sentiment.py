@@ -0,0 +1,97 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ibmcloudant.cloudant_v1 import BulkDocs, Document
+
+from djangoapp import indexes
+from djangoapp.fragments import bump_review_set_version
+from djangoapp.restapis import get_review_changes_from_cf
+from djangoapp.sentiment import get_sentiment_backend
+
+
+class Command(BaseCommand):
+    help = (
+        "Score the reviews of the review service with the sentiment backend "
+        "of settings.SENTIMENT_BACKEND, reading them from its changes feed, "
+        "and store the labels in Cloudant. Reviews already scored are left "
+        "alone unless --rescore is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--since", default="0", help="Changes feed sequence to start after."
+        )
+        parser.add_argument(
+            "--rescore",
+            action="store_true",
+            help="Also score the reviews scored by another sentiment model.",
+        )
+
+    def handle(self, *args, **options):
+        service = indexes.get_cloudant_service()
+        if service is None:
+            raise CommandError("Set IBM_URL and IBM_API_KEY first.")
+        backend = get_sentiment_backend()
+        started = time.monotonic()
+        since = options["since"]
+        scored = failed = 0
+        while True:
+            page = get_review_changes_from_cf(
+                settings.REVIEW_CHANGES_API_URL,
+                since=since,
+                limit=options["batch_size"],
+            )
+            if page is None:
+                raise CommandError(
+                    f"Unable to read the changes feed after {since}, "
+                    f"rerun with --since {since}"
+                )
+            docs = [
+                change["doc"]
+                for change in page["results"]
+                if not change.get("deleted")
+                and "review" in (change.get("doc") or {})
+                and self._needs_score(change["doc"], backend, options["rescore"])
+            ]
+            labels = backend.analyze_batch([doc["review"] for doc in docs])
+            updates = []
+            for doc, label in zip(docs, labels):
+                if label is None:
+                    failed += 1
+                    continue
+                doc["sentiment"] = label
+                doc["sentiment_model"] = backend.model_id
+                # The score of the previous model does not go with the label
+                doc.pop("score", None)
+                updates.append(doc)
+            if updates:
+                outcomes = service.post_bulk_docs(
+                    db="reviews",
+                    bulk_docs=BulkDocs(docs=[Document.from_dict(d) for d in updates]),
+                ).get_result()
+                for doc, outcome in zip(updates, outcomes):
+                    if outcome.get("error"):
+                        failed += 1
+                        self.stderr.write(f"{outcome.get('id')}: {outcome['error']}")
+                    else:
+                        scored += 1
+                for dealership in {doc.get("dealership") for doc in updates}:
+                    bump_review_set_version(dealership)
+            # A feed that does not advance would be read again forever
+            if not page["results"] or page["last_seq"] == since:
+                break
+            since = page["last_seq"]
+            if not page.get("pending"):
+                break
+        self.stdout.write(
+            f"Scored {scored} reviews with {backend.model_id}, {failed} failed, "
+            f"in {time.monotonic() - started:.1f}s"
+        )
+
+    @staticmethod
+    def _needs_score(doc, backend, rescore):
+        if not doc.get("sentiment"):
+            return True
+        return rescore and doc.get("sentiment_model") != backend.model_id
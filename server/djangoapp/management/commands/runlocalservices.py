@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from djangoapp.localstore import LocalServices, LocalStore
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the sample dealers and reviews with the contracts of the "
+        "dealerships (port 3000) and reviews (port 5000) services. Point the "
+        "app at them with UPSTREAM=local."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--dealerships-port", type=int, default=3000)
+        parser.add_argument("--reviews-port", type=int, default=5000)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.0,
+            help="Seconds added before every answer.",
+        )
+
+    def handle(self, *args, **options):
+        store = LocalStore.from_sample_data()
+        services = [
+            LocalServices(store, options["latency"], options["host"], port).start()
+            for port in (options["dealerships_port"], options["reviews_port"])
+        ]
+        self.stdout.write(
+            f"Serving {len(store.dealers)} dealers and {store.review_count} reviews "
+            f"on {services[0].url} and {services[1].url}, CONTROL-C to quit."
+        )
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for service in services:
+                service.stop()
@@ -0,0 +1,52 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from djangoapp.search import ReviewIndex, update_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the reviews written since the last update to the review search "
+        "index saved at REVIEW_SEARCH_INDEX_PATH. With --loop, keep updating "
+        "every --interval seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--loop", action="store_true")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5.0,
+            help="Seconds between updates with --loop.",
+        )
+
+    def handle(self, *args, **options):
+        path = settings.REVIEW_SEARCH_INDEX_PATH
+        if not os.path.exists(path):
+            raise CommandError(f"No index at {path}, run build_review_index first.")
+        index = ReviewIndex.load(path)
+        try:
+            while True:
+                try:
+                    applied = update_index(
+                        index, settings.REVIEW_CHANGES_API_URL, options["batch_size"]
+                    )
+                except RuntimeError as err:
+                    if not options["loop"]:
+                        raise CommandError(str(err))
+                    self.stderr.write(str(err))
+                    applied = 0
+                if applied:
+                    index.save(path)
+                    self.stdout.write(
+                        f"Applied {applied} changes, {len(index)} reviews indexed"
+                    )
+                if not options["loop"]:
+                    return
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,121 @@
+"""
+Process-local metrics exposed in the Prometheus text format.
+
+Modules register a collector, a callable yielding ``(name, labels, value)``
+samples, together with the type and help text of each metric name. The
+`metrics` view renders every registered collector on each scrape.
+`Histogram` is a ready-made collector for latency and size distributions.
+"""
+import bisect
+import threading
+
+_collectors = []
+_descriptions = {}
+_lock = threading.Lock()
+
+
+def register_collector(collector, descriptions):
+    """
+    Register a sample collector.
+
+    Args:
+    - collector (callable): Returns an iterable of (name, labels, value).
+    - descriptions (dict): Maps each metric name to a (type, help) tuple.
+    """
+    with _lock:
+        _collectors.append(collector)
+        _descriptions.update(descriptions)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+# Upper bounds, in seconds, of the default histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_HISTOGRAM_SUFFIXES = ("_bucket", "_sum", "_count")
+
+
+class Histogram:
+    """
+    A histogram with one series per label set, registered on creation.
+
+    Args:
+    - name (str): The metric name.
+    - help_text (str): The metric help text.
+    - buckets (tuple, optional): The bucket upper bounds, ascending.
+    """
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        register_collector(self.collect, {name: ("histogram", help_text)})
+
+    def observe(self, value, **labels):
+        """Count one observation in the series of labels."""
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self):
+        with self._lock:
+            series = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._series.items()
+            ]
+        for key, counts, total in series:
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", dict(labels, le=bound), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+def _family(name, descriptions):
+    """Return the described metric a sample name belongs to."""
+    if name not in descriptions:
+        for suffix in _HISTOGRAM_SUFFIXES:
+            if name.endswith(suffix) and name[: -len(suffix)] in descriptions:
+                return name[: -len(suffix)]
+    return name
+
+
+def render():
+    """
+    Render all registered metrics.
+
+    Returns:
+    - str: The metrics in the Prometheus text exposition format.
+    """
+    with _lock:
+        collectors = list(_collectors)
+        descriptions = dict(_descriptions)
+    samples = {}
+    for collector in collectors:
+        for name, labels, value in collector():
+            family = _family(name, descriptions)
+            samples.setdefault(family, []).append((name, labels, value))
+    lines = []
+    for family in sorted(samples):
+        metric_type, help_text = descriptions.get(family, ("untyped", ""))
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {metric_type}")
+        for name, labels, value in samples[family]:
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
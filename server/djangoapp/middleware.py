@@ -0,0 +1,46 @@
+import asyncio
+
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from . import timing
+
+
+@sync_and_async_middleware
+def upstream_timing_middleware(get_response):
+    """
+    Time the upstream calls of each request, see `djangoapp.timing`.
+
+    With settings.SERVER_TIMING_HEADER set, the time spent per upstream is
+    reported to the client in a Server-Timing header.
+    """
+
+    def finish(timings, token, response):
+        timing.finish_request(timings, token)
+        if settings.SERVER_TIMING_HEADER:
+            response["Server-Timing"] = timings.server_timing()
+        return response
+
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            timings, token = timing.start_request()
+            try:
+                response = await get_response(request)
+            except BaseException:
+                timing.finish_request(timings, token)
+                raise
+            return finish(timings, token, response)
+
+    else:
+
+        def middleware(request):
+            timings, token = timing.start_request()
+            try:
+                response = get_response(request)
+            except BaseException:
+                timing.finish_request(timings, token)
+                raise
+            return finish(timings, token, response)
+
+    return middleware
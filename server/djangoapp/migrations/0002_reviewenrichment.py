@@ -0,0 +1,25 @@
+# Generated by Django 3.2 on 2026-10-18 20:18
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangoapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewEnrichment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('keywords', models.JSONField(default=list)),
+                ('entities', models.JSONField(default=list)),
+                ('emotion', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
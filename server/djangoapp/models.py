@@ -38,7 +38,23 @@ class CarModel(models.Model):
 
 
 # <HINT> Create a plain Python class `CarDealer` to hold dealer data
+# Dealers and reviews are built for every upstream answer, they use slots
+# rather than a per-instance __dict__ and are built from the upstream JSON
+# with from_dict, which only reads the fields they hold.
 class CarDealer:
+    __slots__ = (
+        "address",
+        "city",
+        "full_name",
+        "id",
+        "lat",
+        "long",
+        "short_name",
+        "st",
+        "state",
+        "zip",
+    )
+
     def __init__(
         self,
         address,
@@ -51,7 +67,6 @@ class CarDealer:
         st,
         state,
         zip,
-        **kwargs
     ):
         self.address = address
         self.city = city
@@ -64,12 +79,47 @@ class CarDealer:
         self.state = state
         self.zip = zip
 
+    @classmethod
+    def from_dict(cls, doc):
+        """Build a dealer from a document of the dealerships service."""
+        dealer = cls.__new__(cls)
+        dealer.address = doc["address"]
+        dealer.city = doc["city"]
+        dealer.full_name = doc["full_name"]
+        dealer.id = doc["id"]
+        dealer.lat = doc["lat"]
+        dealer.long = doc["long"]
+        dealer.short_name = doc["short_name"]
+        dealer.st = doc["st"]
+        dealer.state = doc["state"]
+        dealer.zip = doc["zip"]
+        return dealer
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
     def __str__(self):
         return self.full_name
 
 
 # <HINT> Create a plain Python class `DealerReview` to hold review data
 class DealerReview:
+    __slots__ = (
+        "dealership",
+        "id",
+        "name",
+        "review",
+        "purchase",
+        "purchase_date",
+        "car_make",
+        "car_model",
+        "car_year",
+        "sentiment",
+        # The keywords, entities and emotion of the review text, None until
+        # it is enriched, see djangoapp.enrichment
+        "enrichment",
+    )
+
     def __init__(
         self,
         dealership,
@@ -82,7 +132,7 @@ class DealerReview:
         car_model,
         car_year,
         sentiment="",
-        **kwargs
+        enrichment=None,
     ):
         self.dealership = dealership
         self.id = id
@@ -94,6 +144,161 @@ class DealerReview:
         self.car_model = car_model
         self.car_year = car_year
         self.sentiment = sentiment
+        self.enrichment = enrichment
+
+    @classmethod
+    def from_dict(cls, doc):
+        """Build a review from a document of the review service."""
+        review = cls.__new__(cls)
+        review.dealership = doc["dealership"]
+        review.id = doc["id"]
+        review.name = doc["name"]
+        review.review = doc["review"]
+        review.purchase = doc["purchase"]
+        review.purchase_date = doc["purchase_date"]
+        review.car_make = doc["car_make"]
+        review.car_model = doc["car_model"]
+        review.car_year = doc["car_year"]
+        review.sentiment = doc.get("sentiment", "")
+        review.enrichment = None
+        return review
 
     def __str__(self):
         return self.name
+
+
+# Many reviews held column by column, for bulk work on large review lists
+class DealerReviewBatch:
+    """
+    Reviews stored as one list per `DealerReview` field.
+
+    A batch holds no object per review, and a field of every review, such
+    as the texts to analyze, is read as one list.
+    """
+
+    __slots__ = DealerReview.__slots__
+
+    @classmethod
+    def from_dicts(cls, docs):
+        """Build a batch from documents of the review service."""
+        docs = docs if isinstance(docs, list) else list(docs)
+        batch = cls.__new__(cls)
+        batch.dealership = [doc["dealership"] for doc in docs]
+        batch.id = [doc["id"] for doc in docs]
+        batch.name = [doc["name"] for doc in docs]
+        batch.review = [doc["review"] for doc in docs]
+        batch.purchase = [doc["purchase"] for doc in docs]
+        batch.purchase_date = [doc["purchase_date"] for doc in docs]
+        batch.car_make = [doc["car_make"] for doc in docs]
+        batch.car_model = [doc["car_model"] for doc in docs]
+        batch.car_year = [doc["car_year"] for doc in docs]
+        batch.sentiment = [doc.get("sentiment", "") for doc in docs]
+        batch.enrichment = [None] * len(docs)
+        return batch
+
+    def __len__(self):
+        return len(self.id)
+
+    def __getitem__(self, index):
+        review = DealerReview.__new__(DealerReview)
+        for field in self.__slots__:
+            setattr(review, field, getattr(self, field)[index])
+        return review
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def unscored(self):
+        """
+        Returns:
+            list: The indexes of the reviews without sentiment.
+        """
+        return [index for index, label in enumerate(self.sentiment) if not label]
+
+
+# Plain Python class `DealerStats` to hold the review stats of a dealer
+class DealerStats:
+    __slots__ = (
+        "dealership",
+        "review_count",
+        "purchase_count",
+        "positive",
+        "neutral",
+        "negative",
+        "latest_review_time",
+    )
+
+    def __init__(
+        self,
+        dealership,
+        review_count=0,
+        purchase_count=0,
+        sentiment=None,
+        latest_review_time=None,
+        **kwargs
+    ):
+        sentiment = sentiment or {}
+        self.dealership = dealership
+        self.review_count = review_count
+        self.purchase_count = purchase_count
+        self.positive = sentiment.get("positive", 0)
+        self.neutral = sentiment.get("neutral", 0)
+        self.negative = sentiment.get("negative", 0)
+        self.latest_review_time = latest_review_time
+
+    @property
+    def purchase_ratio(self):
+        """The fraction of reviewers who bought their car there."""
+        return self.purchase_count / self.review_count if self.review_count else 0.0
+
+    def __str__(self):
+        return f"{self.dealership}: {self.review_count} reviews"
+
+
+# Reviews submitted by users, waiting to be posted to the review service
+# by the outbox drainer (djangoapp.outbox)
+class ReviewOutbox(models.Model):
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+    ]
+
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    dealer_id = models.IntegerField()
+    payload = models.JSONField()
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=PENDING, db_index=True
+    )
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=now, db_index=True)
+    last_error = models.CharField(max_length=256, blank=True)
+    created_at = models.DateTimeField(default=now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.idempotency_key} ({self.status})"
+
+
+# Keywords, entities and emotion of a review text, extracted with Watson NLU
+# by djangoapp.enrichment and stored by a hash of the text
+class ReviewEnrichment(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    keywords = models.JSONField(default=list)
+    entities = models.JSONField(default=list)
+    emotion = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=now)
+
+    def to_dict(self):
+        return {
+            "keywords": self.keywords,
+            "entities": self.entities,
+            "emotion": self.emotion,
+        }
+
+    def __str__(self):
+        return self.key
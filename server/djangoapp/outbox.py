@@ -0,0 +1,306 @@
+"""
+Outbox of the reviews submitted by users.
+
+`add_review` stores each submitted review as a `ReviewOutbox` row in the
+local database and returns without waiting on the review service. A
+drainer posts the pending rows to settings.POST_REVIEW_API_URL in batches
+and retries failed posts with exponential backoff. Every review carries an
+idempotency key, which the review service uses as document id, so a review
+posted twice (a double submit, or a retry after a lost answer) is stored
+once.
+
+Batches go to the bulk endpoint of the review service
+(settings.POST_REVIEWS_BULK_API_URL) in one request, or one review per
+request when it is not configured.
+
+The drainer runs in a background thread of each web process, started by
+the WSGI and ASGI entry points so reviews left by an earlier run are
+delivered, and woken when a review is enqueued, unless
+settings.OUTBOX_DRAIN_IN_PROCESS is off. It can
+also run on its own with ``python manage.py drain_review_outbox``. Rows are
+leased before being posted, so several drainers can run side by side.
+"""
+import hashlib
+import logging
+import os
+import random
+import threading
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .fragments import bump_review_set_version
+from .models import ReviewOutbox
+from .restapis import invalidate_dealer_stats, post_request
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of a delivery attempt
+SENT = "sent"
+RETRY = "retry"
+FAILED = "failed"
+
+
+def review_idempotency_key(username, token):
+    """
+    Return the idempotency key of a review form submission.
+
+    Args:
+    - username (str): The user submitting the review.
+    - token (str): The token rendered in the review form.
+
+    Returns:
+    - str: The key, unique per user and form.
+    """
+    return hashlib.sha256(f"{username}\0{token}".encode("utf-8")).hexdigest()
+
+
+def enqueue_review(payload, idempotency_key):
+    """
+    Store a review for delivery, once per idempotency key.
+
+    Args:
+    - payload (dict): The review, as built by `build_review_payload`.
+    - idempotency_key (str): The key deduplicating submissions.
+
+    Returns:
+    - tuple: The `ReviewOutbox` row and whether it was created.
+    """
+    entry, created = ReviewOutbox.objects.get_or_create(
+        idempotency_key=idempotency_key,
+        defaults={
+            "dealer_id": payload["dealership"],
+            "payload": dict(payload, idempotency_key=idempotency_key),
+        },
+    )
+    if created:
+        transaction.on_commit(wake_drainer)
+    return entry, created
+
+
+def retry_delay(attempts):
+    """
+    Returns:
+    - float: Seconds to wait before the next attempt, doubling with every
+      failed attempt up to settings.OUTBOX_RETRY_MAX, with jitter.
+    """
+    delay = settings.OUTBOX_RETRY_BASE * 2 ** max(0, attempts - 1)
+    return min(delay, settings.OUTBOX_RETRY_MAX) * random.uniform(0.5, 1.0)
+
+
+def claim_batch(batch_size):
+    """
+    Lease up to batch_size pending rows that are due to this drainer.
+
+    A leased row is not due again before settings.OUTBOX_LEASE seconds, so
+    other drainers skip it while it is being posted.
+
+    Returns:
+    - list[ReviewOutbox]: The leased rows, oldest first.
+    """
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=settings.OUTBOX_LEASE)
+    due = ReviewOutbox.objects.filter(
+        status=ReviewOutbox.PENDING, next_attempt_at__lte=now
+    ).order_by("next_attempt_at", "id")
+    claimed = []
+    for pk, next_attempt_at in due.values_list("id", "next_attempt_at")[:batch_size]:
+        leased = ReviewOutbox.objects.filter(
+            pk=pk, status=ReviewOutbox.PENDING, next_attempt_at=next_attempt_at
+        ).update(next_attempt_at=lease_until)
+        if leased:
+            claimed.append(pk)
+    return list(ReviewOutbox.objects.filter(pk__in=claimed).order_by("id"))
+
+
+def deliver(entry):
+    """
+    Post one review to the review service.
+
+    Returns:
+    - tuple: The outcome, SENT, RETRY or FAILED, and the error message.
+    """
+    try:
+        response = post_request(
+            settings.POST_REVIEW_API_URL, {"review": entry.payload}, id=entry.dealer_id
+        )
+    except requests.exceptions.RequestException as e:
+        return RETRY, str(e)
+    status = response.status_code
+    # 409: the review was already stored under its idempotency key
+    if status < 300 or status == 409:
+        return SENT, ""
+    if status >= 500 or status == 429:
+        return RETRY, f"HTTP {status}"
+    return FAILED, f"HTTP {status}: {response.text}"
+
+
+def deliver_each(entries):
+    """
+    Post reviews one by one. Once a post must be retried, the service is
+    assumed down and the remaining reviews are not tried.
+
+    Returns:
+    - list[tuple]: The outcome and error of each entry, None as outcome
+      for the entries not tried.
+    """
+    results = []
+    for entry in entries:
+        if results and results[-1][0] == RETRY:
+            results.append((None, ""))
+        else:
+            results.append(deliver(entry))
+    return results
+
+
+def deliver_batch(entries):
+    """
+    Post reviews in one request to settings.POST_REVIEWS_BULK_API_URL.
+
+    Falls back to `deliver_each` when the review service has no bulk
+    endpoint.
+
+    Returns:
+    - list[tuple]: The outcome and error of each entry.
+    """
+    try:
+        response = post_request(
+            settings.POST_REVIEWS_BULK_API_URL, [entry.payload for entry in entries]
+        )
+    except requests.exceptions.RequestException as e:
+        return [(RETRY, str(e))] * len(entries)
+    status = response.status_code
+    if status in (404, 405):
+        return deliver_each(entries)
+    if status >= 500 or status == 429:
+        return [(RETRY, f"HTTP {status}")] * len(entries)
+    if status != 200:
+        return [(FAILED, f"HTTP {status}: {response.text}")] * len(entries)
+    errors = {error["index"]: error for error in response.json()["errors"]}
+    results = []
+    for index in range(len(entries)):
+        error = errors.get(index)
+        if error is None:
+            results.append((SENT, ""))
+        else:
+            outcome = FAILED if error["error"] == "invalid" else RETRY
+            results.append((outcome, f"{error['error']}: {error.get('reason')}"))
+    return results
+
+
+def drain(batch_size=None):
+    """
+    Deliver one batch of due reviews, in a single request when the review
+    service has a bulk endpoint.
+
+    Returns:
+    - dict: The number of rows by outcome.
+    """
+    entries = claim_batch(batch_size or settings.OUTBOX_BATCH_SIZE)
+    if not entries:
+        return {SENT: 0, RETRY: 0, FAILED: 0}
+    if settings.POST_REVIEWS_BULK_API_URL:
+        results = deliver_batch(entries)
+    else:
+        results = deliver_each(entries)
+    counts = {SENT: 0, RETRY: 0, FAILED: 0}
+    postponed_until = None
+    for entry, (outcome, error) in zip(entries, results):
+        if outcome is None:
+            if postponed_until is None:
+                postponed_until = timezone.now() + timedelta(seconds=retry_delay(1))
+            entry.next_attempt_at = postponed_until
+            entry.save(update_fields=["next_attempt_at"])
+            continue
+        entry.attempts += 1
+        entry.last_error = error[:256]
+        if outcome == SENT:
+            entry.status = ReviewOutbox.SENT
+            entry.sent_at = timezone.now()
+            invalidate_dealer_stats(entry.dealer_id)
+            bump_review_set_version(entry.dealer_id)
+        elif outcome == RETRY and entry.attempts < settings.OUTBOX_MAX_ATTEMPTS:
+            delay = timedelta(seconds=retry_delay(entry.attempts))
+            entry.next_attempt_at = postponed_until = timezone.now() + delay
+        else:
+            outcome = FAILED
+            entry.status = ReviewOutbox.FAILED
+            logger.error("Giving up on review %s: %s", entry.idempotency_key, error)
+        entry.save(
+            update_fields=[
+                "attempts",
+                "last_error",
+                "status",
+                "sent_at",
+                "next_attempt_at",
+            ]
+        )
+        counts[outcome] += 1
+    return counts
+
+
+def drain_all(batch_size=None):
+    """
+    Deliver batches until no review is due.
+
+    Returns:
+    - dict: The number of rows by outcome.
+    """
+    totals = {SENT: 0, RETRY: 0, FAILED: 0}
+    while True:
+        counts = drain(batch_size)
+        for outcome, count in counts.items():
+            totals[outcome] += count
+        if not any(counts.values()) or counts[RETRY]:
+            return totals
+
+
+_drainer = None
+_drainer_pid = None
+_drainer_lock = threading.Lock()
+
+
+def _drain_forever(wakeup):
+    while True:
+        wakeup.wait(settings.OUTBOX_POLL_INTERVAL)
+        wakeup.clear()
+        try:
+            drain_all()
+        except Exception:
+            logger.exception("Error draining the review outbox")
+        finally:
+            connection.close()
+
+
+def get_drainer_wakeup():
+    """
+    Return the event waking the drainer thread of this process, starting
+    the thread on first use.
+
+    Returns:
+    - threading.Event: Set it to drain now rather than at the next poll.
+    """
+    global _drainer, _drainer_pid
+    pid = os.getpid()
+    if _drainer is None or _drainer_pid != pid:
+        with _drainer_lock:
+            if _drainer is None or _drainer_pid != pid:
+                wakeup = threading.Event()
+                threading.Thread(
+                    target=_drain_forever,
+                    args=(wakeup,),
+                    name="review-outbox",
+                    daemon=True,
+                ).start()
+                _drainer = wakeup
+                _drainer_pid = pid
+    return _drainer
+
+
+def wake_drainer():
+    """Drain the outbox in the background now, if drained in process."""
+    if settings.OUTBOX_DRAIN_IN_PROCESS:
+        get_drainer_wakeup().set()
@@ -1,25 +1,175 @@
 import requests
-import json
+import asyncio
+import concurrent.futures
+import hashlib
+import httpx
 import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # import related models here
+from django.conf import settings
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
-from .models import CarDealer, DealerReview
-from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
-from ibm_watson import NaturalLanguageUnderstandingV1
-from ibm_watson.natural_language_understanding_v1 import (
-    Features,
-    EntitiesOptions,
-    KeywordsOptions,
-    EmotionOptions,
-    SentimentOptions,
+from . import metrics, timing
+from .caching import LRUCache, ReadThroughCache, TieredCache
+from .circuitbreaker import OPEN, CircuitBreaker
+from .geo import GeoIndex
+from .models import CarDealer, DealerReview, DealerStats
+from .sentiment import SentimentBackend, get_sentiment_backend
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the shared HTTP session of the current process.
+
+    The session keeps one connection pool per upstream host, so repeated
+    calls to the dealerships, reviews and sentiment services reuse
+    keep-alive connections instead of paying a TCP+TLS handshake each
+    time. A forked worker builds its own session on first use.
+
+    Returns:
+    - requests.Session: The pooled session.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                adapter = HTTPAdapter(
+                    pool_connections=settings.RESTAPIS_POOL_CONNECTIONS,
+                    pool_maxsize=settings.RESTAPIS_POOL_MAXSIZE,
+                )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+                _session_pid = pid
+    return _session
+
+
+def get_timeout():
+    """
+    Return the (connect, read) timeout applied to every upstream call.
+    """
+    return (settings.RESTAPIS_CONNECT_TIMEOUT, settings.RESTAPIS_READ_TIMEOUT)
+
+
+def get_pool_stats():
+    """
+    Summarize connection reuse of the shared session, per upstream host.
+
+    Returns:
+    - dict: Maps "scheme://host:port" to a dict with the number of
+      requests sent and connections opened by that host's pool.
+    """
+    stats = {}
+    session = _session
+    if session is None or _session_pid != os.getpid():
+        return stats
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        # Looking the pools up by key would mark them recently used and
+        # change which ones get evicted, so read a snapshot of the container
+        try:
+            with pools.lock:
+                pool_list = list(pools._container.values())
+        except AttributeError:
+            # Internals of another urllib3 version, leave the stats out
+            continue
+        for pool in pool_list:
+            key = f"{pool.scheme}://{pool.host}:{pool.port}"
+            entry = stats.setdefault(key, {"requests": 0, "connections": 0})
+            entry["requests"] += pool.num_requests
+            entry["connections"] += pool.num_connections
+    return stats
+
+
+def _collect_pool_stats():
+    for host, entry in get_pool_stats().items():
+        labels = {"host": host}
+        yield "restapis_pool_requests_total", labels, entry["requests"]
+        yield "restapis_pool_connections_total", labels, entry["connections"]
+        yield (
+            "restapis_pool_reused_total",
+            labels,
+            entry["requests"] - entry["connections"],
+        )
+
+
+metrics.register_collector(
+    _collect_pool_stats,
+    {
+        "restapis_pool_requests_total": (
+            "counter",
+            "Requests sent through the shared connection pool.",
+        ),
+        "restapis_pool_connections_total": (
+            "counter",
+            "New connections opened by the shared connection pool.",
+        ),
+        "restapis_pool_reused_total": (
+            "counter",
+            "Requests served on an already open keep-alive connection.",
+        ),
+    },
 )
 
 
+# Validators (ETag, Last-Modified) of upstream answers with their decoded
+# body, by URL and parameters. Later requests are conditional and a 304
+# answer reuses the body, which must therefore not be modified by callers.
+conditional_cache = LRUCache(settings.CONDITIONAL_FETCH_MAXSIZE)
+
+
+def _conditional_key(url, params):
+    if not params:
+        return (url, ())
+    return (url, tuple(sorted((str(k), str(v)) for k, v in params.items())))
+
+
+def _conditional_headers(key):
+    """
+    Return the validator headers of the answer cached under key, and the
+    cached entry.
+    """
+    entry = conditional_cache.get(key)
+    if entry is None:
+        return {}, None
+    etag, last_modified, _ = entry
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers, entry
+
+
+def _remember_validators(key, response, body):
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if etag or last_modified:
+        conditional_cache.set(key, (etag, last_modified, body))
+    else:
+        conditional_cache.delete(key)
+
+
 def get_request(url, params=None, apikey=None):
     """
     Make an HTTP GET request to a specified URL.
 
+    Answers with an ETag or Last-Modified header are kept, and the next
+    request for the same URL and parameters is made conditional: a 304
+    answer returns the kept body without downloading or parsing it again.
+
     Args:
     - url (str): The URL to make the GET request to.
     - params (dict, optional): Parameters to be sent with the request.
@@ -30,17 +180,27 @@ def get_request(url, params=None, apikey=None):
     """
     try:
         # Set headers and authentication
-        headers = {"Content-Type": "application/json"}
+        key = _conditional_key(url, params)
+        headers, cached = _conditional_headers(key)
+        headers["Content-Type"] = "application/json"
         auth = HTTPBasicAuth("apikey", apikey) if apikey else None
 
         # Make the GET request
-        response = requests.get(url, params=params, headers=headers, auth=auth)
+        with timing.upstream_call(url) as call:
+            call.response = get_session().get(
+                url, params=params, headers=headers, auth=auth, timeout=get_timeout()
+            )
+        response = call.response
+        if response.status_code == 304 and cached is not None:
+            return cached[2]
 
         # Check if the response was successful
         response.raise_for_status()
 
         # Return the JSON data from the response
-        return response.json()
+        body = response.json()
+        _remember_validators(key, response, body)
+        return body
 
     except requests.exceptions.HTTPError as http_err:
         print(f"HTTP error occurred: {http_err}")
@@ -55,14 +215,52 @@ def get_request(url, params=None, apikey=None):
 
 
 def post_request(url, json_payload, **kwargs):
-    response = requests.post(url, params=kwargs, json=json_payload)
-    return response
+    with timing.upstream_call(url) as call:
+        call.response = get_session().post(
+            url, params=kwargs, json=json_payload, timeout=get_timeout()
+        )
+    return call.response
+
+
+# Callers sharing a load wait at most as long as one upstream request
+_LOAD_WAIT_TIMEOUT = settings.RESTAPIS_CONNECT_TIMEOUT + settings.RESTAPIS_READ_TIMEOUT
+
+dealer_cache = ReadThroughCache(
+    "dealers",
+    maxsize=settings.DEALER_CACHE_MAXSIZE,
+    ttl=settings.DEALER_CACHE_TTL,
+    stale_ttl=settings.DEALER_CACHE_STALE_TTL,
+    wait_timeout=_LOAD_WAIT_TIMEOUT,
+)
+
+
+def _load_dealers(url, params=None):
+    json_result = get_request(url, params=params)
+    if json_result is None:
+        return None
+    return [CarDealer.from_dict(dealer) for dealer in json_result]
+
+
+def invalidate_dealers(id=None):
+    """
+    Drop cached dealers so the next lookup fetches them again.
+
+    Args:
+    - id (int, optional): Only drop this dealer and the dealer lists that
+      may contain it. Drops every cached dealer when omitted.
+    """
+    if id is None:
+        dealer_cache.clear()
+    else:
+        dealer_cache.invalidate_where(lambda key: key[0] == "dealers" or key[2] == id)
 
 
 def get_dealers_from_cf(url):
     """
     Fetch dealers from a cloud function.
 
+    Dealers are served from the dealer cache, see settings.DEALER_CACHE_*.
+
     Args:
     - url (str): The URL to fetch dealers from.
 
@@ -70,24 +268,77 @@ def get_dealers_from_cf(url):
     - list[CarDealer]: A list of CarDealer objects.
     """
     try:
-        json_result = get_request(url)
-        if json_result:
-            dealers = []
-            for dealer in json_result:
-                # Create a CarDealer instance with the modified dealer dictionary
-                dealers.append(CarDealer(**dealer))
-            return dealers
-        else:
-            return []
+        dealers = dealer_cache.get(
+            ("dealers", url),
+            lambda: _load_dealers(url),
+            ttl=settings.DEALER_LIST_CACHE_TTL,
+        )
+        return list(dealers) if dealers else []
     except Exception as e:
         print(f"Error fetching dealers: {e}")
         return []
 
 
+def _page_params(state, limit, bookmark):
+    limit = min(limit or settings.DEALERS_PAGE_SIZE, settings.DEALERS_MAX_PAGE_SIZE)
+    params = {"limit": limit}
+    if state:
+        params["state"] = state
+    if bookmark:
+        params["bookmark"] = bookmark
+    return params
+
+
+def _parse_dealers_page(json_result, limit):
+    if json_result is None:
+        return None
+    dealers = [CarDealer.from_dict(dealer) for dealer in json_result.get("docs", [])]
+    # A short page is the last one
+    bookmark = json_result.get("bookmark") if len(dealers) >= limit else None
+    return dealers, bookmark
+
+
+def get_dealers_page_from_cf(url, state=None, limit=None, bookmark=None):
+    """
+    Fetch one page of dealers from a cloud function.
+
+    Filtering by state is done by the dealerships service, and pages are
+    served from the dealer cache.
+
+    Args:
+    - url (str): The URL to fetch dealers from.
+    - state (str, optional): Only return dealers of this state.
+    - limit (int, optional): The page size, settings.DEALERS_PAGE_SIZE by
+      default and at most settings.DEALERS_MAX_PAGE_SIZE.
+    - bookmark (str, optional): The bookmark of the page to fetch, as
+      returned with the previous page. Fetches the first page when omitted.
+
+    Returns:
+    - tuple: The list of CarDealer objects of the page, and the bookmark
+      of the next page or None on the last page.
+    """
+    params = _page_params(state, limit, bookmark)
+    try:
+        page = dealer_cache.get(
+            ("dealers", url, state, params["limit"], bookmark),
+            lambda: _parse_dealers_page(get_request(url, params=params), params["limit"]),
+            ttl=settings.DEALER_LIST_CACHE_TTL,
+        )
+        if page:
+            dealers, next_bookmark = page
+            return list(dealers), next_bookmark
+        return [], None
+    except Exception as e:
+        print(f"Error fetching dealers: {e}")
+        return [], None
+
+
 def get_dealer_by_id_from_cf(url, id):
     """
     Get a dealer by ID from a cloud function.
 
+    The dealer is served from the dealer cache, see settings.DEALER_CACHE_*.
+
     Args:
     - url (str): The URL to fetch the dealer from.
     - id (int): The ID of the dealer.
@@ -96,9 +347,11 @@ def get_dealer_by_id_from_cf(url, id):
     - CarDealer: A CarDealer object.
     """
     try:
-        dealer_data = get_request(url, params={"id": id})
+        dealer_data = dealer_cache.get(
+            ("dealer", url, id), lambda: _load_dealers(url, params={"id": id})
+        )
         if dealer_data:
-            return CarDealer(**dealer_data[0])
+            return dealer_data[0]
         else:
             return None
     except Exception as e:
@@ -106,41 +359,896 @@ def get_dealer_by_id_from_cf(url, id):
         return None
 
 
+def _load_geo_index(url):
+    # Page through every dealer, the index needs the whole set
+    dealers = []
+    bookmark = None
+    while True:
+        params = _page_params(None, settings.DEALERS_MAX_PAGE_SIZE, bookmark)
+        page = _parse_dealers_page(get_request(url, params=params), params["limit"])
+        if page is None:
+            return None
+        page_dealers, bookmark = page
+        dealers.extend(page_dealers)
+        if bookmark is None:
+            return GeoIndex(dealers, cell_degrees=settings.GEO_CELL_DEGREES)
+
+
+def get_dealer_geo_index(url):
+    """
+    Return the spatial index of every dealer.
+
+    The index is kept in the dealer cache, so it is built once and rebuilt
+    in the background once stale, see settings.DEALER_GEO_INDEX_TTL, or
+    after `invalidate_dealers`.
+
+    Args:
+    - url (str): The URL to fetch dealers from.
+
+    Returns:
+    - GeoIndex: The index, None if the dealers could not be fetched.
+    """
+    return dealer_cache.get(
+        ("dealers", url, "geo"),
+        lambda: _load_geo_index(url),
+        ttl=settings.DEALER_GEO_INDEX_TTL,
+    )
+
+
+def find_dealers_near(index, lat, long, k=None, radius_km=None):
+    """
+    Search an index for the k dealers nearest to a point, the dealers
+    within radius_km of it, or the k nearest within radius_km.
+
+    Returns:
+    - list[tuple]: The (distance in km, CarDealer) of at most
+      settings.GEO_MAX_RESULTS dealers, nearest first.
+    """
+    if index is None:
+        return []
+    limit = settings.GEO_MAX_RESULTS
+    if k is None and radius_km is not None:
+        return index.within(lat, long, radius_km)[:limit]
+    return index.nearest(lat, long, k=min(k or 10, limit), max_km=radius_km)
+
+
+def get_dealers_near_from_cf(url, lat, long, k=None, radius_km=None):
+    """
+    Find the dealers near a point.
+
+    Args:
+    - url (str): The URL to fetch dealers from.
+    - lat (float): The latitude of the point.
+    - long (float): The longitude of the point.
+    - k (int, optional): Return the k nearest dealers, 10 by default.
+    - radius_km (float, optional): Only return dealers within this
+      distance, all of them when k is not given.
+
+    Returns:
+    - list[tuple]: The (distance in km, CarDealer) of the dealers, nearest
+      first, see `find_dealers_near`.
+    """
+    try:
+        index = get_dealer_geo_index(url)
+        return find_dealers_near(index, lat, long, k=k, radius_km=radius_km)
+    except Exception as e:
+        print(f"Error searching dealers: {e}")
+        return []
+
+
+dealer_stats_cache = ReadThroughCache(
+    "dealer_stats",
+    maxsize=settings.DEALER_CACHE_MAXSIZE,
+    ttl=settings.DEALER_STATS_CACHE_TTL,
+    stale_ttl=settings.DEALER_STATS_CACHE_STALE_TTL,
+    wait_timeout=_LOAD_WAIT_TIMEOUT,
+)
+
+
+def _parse_dealer_stats(json_result, ids):
+    if json_result is None:
+        return None
+    stats = {id: DealerStats(dealership=id) for id in ids}
+    for row in json_result:
+        stats[row["dealership"]] = DealerStats(**row)
+    return stats
+
+
+def invalidate_dealer_stats(id=None):
+    """
+    Drop cached dealer stats so the next lookup fetches them again.
+
+    Args:
+    - id (int, optional): Only drop the cached stats including this
+      dealer. Drops every cached stats when omitted.
+    """
+    if id is None:
+        dealer_stats_cache.clear()
+    else:
+        dealer_stats_cache.invalidate_where(lambda key: id in key[1])
+
+
+def get_dealer_stats_from_cf(url, ids):
+    """
+    Fetch the review stats of dealers from the review service.
+
+    The review service keeps the stats up to date as reviews are written,
+    so one request returns them without reading any review. Stats are
+    served from the dealer stats cache, see settings.DEALER_STATS_CACHE_*.
+
+    Args:
+    - url (str): The URL to fetch the stats from, stats are disabled when
+      empty.
+    - ids (list[int]): The IDs of the dealers.
+
+    Returns:
+    - dict: The DealerStats of every dealer by ID, empty if the stats
+      could not be fetched.
+    """
+    ids = tuple(sorted(set(ids)))
+    if not url or not ids:
+        return {}
+    params = {"ids": ",".join(str(id) for id in ids)}
+    try:
+        stats = dealer_stats_cache.get(
+            (url, ids),
+            lambda: _parse_dealer_stats(get_request(url, params=params), ids),
+        )
+        return dict(stats) if stats else {}
+    except Exception as e:
+        print(f"Error fetching dealer stats: {e}")
+        return {}
+
+
+SENTIMENT_MODEL_ID = "sentiment_aggregated-bert-workflow_lang_multi_stock"
+
+
+# Fails sentiment calls fast while the sentiment service is failing
+sentiment_breaker = CircuitBreaker(
+    "sentiment",
+    failure_rate=settings.SENTIMENT_BREAKER_FAILURE_RATE,
+    window=settings.SENTIMENT_BREAKER_WINDOW,
+    min_calls=settings.SENTIMENT_BREAKER_MIN_CALLS,
+    reset_timeout=settings.SENTIMENT_BREAKER_RESET_TIMEOUT,
+    half_open_calls=settings.SENTIMENT_BREAKER_HALF_OPEN_CALLS,
+    slow_call=settings.SENTIMENT_BREAKER_SLOW_CALL,
+)
+
+
+def _sentiment_result(response, duration):
+    """
+    Return the label of a sentiment response and record its outcome.
+
+    Server errors, rate limiting and malformed answers count as failures
+    of the sentiment service, other client errors do not.
+    """
+    status = response.status_code
+    if status >= 500 or status == 429:
+        sentiment_breaker.record_failure()
+        print(f"Sentiment service error: {status}")
+        return None
+    if status != 200:
+        sentiment_breaker.record_success(duration)
+        print(f"Sentiment request rejected: {status}")
+        return None
+    try:
+        label = response.json()["documentSentiment"]["label"]
+    except (ValueError, KeyError, TypeError) as e:
+        sentiment_breaker.record_failure()
+        print(f"Invalid sentiment response: {e}")
+        return None
+    sentiment_breaker.record_success(duration)
+    return label
+
+
 def analyze_review_sentiments(dealer_review):
-    url = "https://sn-watson-sentiment-bert.labs.skills.network/v1/watson.runtime.nlp.v1/NlpService/SentimentPredict"
+    """
+    Analyze the sentiment of a review text.
+
+    While the sentiment circuit breaker is open no call is made. Timeouts,
+    connection errors and slow calls count as failures of the service.
+
+    Args:
+    - dealer_review (str): The review text.
+
+    Returns:
+    - str: The sentiment label, None if the text could not be analyzed.
+    """
+    if not sentiment_breaker.allow():
+        return None
     myobj = {"raw_document": {"text": dealer_review}}
-    header = {
-        "grpc-metadata-mm-model-id": "sentiment_aggregated-bert-workflow_lang_multi_stock"
-    }
-    response = requests.post(url, json=myobj, headers=header)
-    formatted_response = json.loads(response.text)
-    if response.status_code == 200:
-        label = formatted_response["documentSentiment"]["label"]
-        score = formatted_response["documentSentiment"]["score"]
-        print(label, score)
-    elif response.status_code == 500:
+    header = {"grpc-metadata-mm-model-id": SENTIMENT_MODEL_ID}
+    started = time.monotonic()
+    try:
+        with timing.upstream_call(settings.SENTIMENT_API_URL) as call:
+            call.response = get_session().post(
+                settings.SENTIMENT_API_URL,
+                json=myobj,
+                headers=header,
+                timeout=(
+                    settings.RESTAPIS_CONNECT_TIMEOUT,
+                    settings.SENTIMENT_CALL_TIMEOUT,
+                ),
+            )
+    except Exception as e:
+        sentiment_breaker.record_failure()
+        print(f"Sentiment request failed: {e}")
+        return None
+    return _sentiment_result(call.response, time.monotonic() - started)
+
+
+class RemoteSentimentBackend(SentimentBackend):
+    """
+    The Watson BERT sentiment service at settings.SENTIMENT_API_URL.
+    """
+
+    model_id = SENTIMENT_MODEL_ID
+
+    def analyze_batch(self, texts):
+        return [analyze_review_sentiments(text) for text in texts]
+
+
+# Label given to reviews whose sentiment could not be analyzed in time
+SENTIMENT_UNKNOWN = "unknown"
+
+_sentiment_executor = None
+_sentiment_executor_pid = None
+_sentiment_executor_lock = threading.Lock()
+
+
+def get_sentiment_executor():
+    """
+    Return the thread pool running sentiment calls in this process.
+
+    The pool size caps how many sentiment requests are in flight at once,
+    across all page requests served by the process.
+
+    Returns:
+    - ThreadPoolExecutor: The shared executor.
+    """
+    global _sentiment_executor, _sentiment_executor_pid
+    pid = os.getpid()
+    if _sentiment_executor is None or _sentiment_executor_pid != pid:
+        with _sentiment_executor_lock:
+            if _sentiment_executor is None or _sentiment_executor_pid != pid:
+                _sentiment_executor = ThreadPoolExecutor(
+                    max_workers=settings.SENTIMENT_MAX_WORKERS,
+                    thread_name_prefix="sentiment",
+                )
+                _sentiment_executor_pid = pid
+    return _sentiment_executor
+
+
+sentiment_cache = TieredCache(
+    "sentiment",
+    alias=settings.SENTIMENT_CACHE_ALIAS,
+    maxsize=settings.SENTIMENT_CACHE_MAXSIZE,
+    ttl=settings.SENTIMENT_CACHE_TTL,
+)
+
+# Sentiment calls in flight in this process, by cache key
+_sentiment_inflight = {}
+_sentiment_inflight_lock = threading.Lock()
+
+
+def sentiment_cache_key(text, model_id=SENTIMENT_MODEL_ID):
+    """
+    Return the content address of a review text under a sentiment model.
+    """
+    digest = hashlib.sha256(f"{model_id}\0{text}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _analyze_and_cache(backend, key, text):
+    try:
+        label = backend.analyze_batch([text])[0]
+        if label:
+            sentiment_cache.set(key, label)
+        return label
+    finally:
+        with _sentiment_inflight_lock:
+            _sentiment_inflight.pop(key, None)
+
+
+def _submit_sentiment(executor, backend, key, text):
+    with _sentiment_inflight_lock:
+        future = _sentiment_inflight.get(key)
+        if future is None:
+            future = timing.submit_in_context(
+                executor, _analyze_and_cache, backend, key, text
+            )
+            _sentiment_inflight[key] = future
+        return future
+
+
+def _analyze_locally(backend, texts):
+    labels = backend.analyze_batch(texts)
+    return [label or SENTIMENT_UNKNOWN for label in labels]
+
+
+def analyze_reviews_sentiments(texts, deadline=None):
+    """
+    Analyze the sentiment of several reviews concurrently.
+
+    Texts are analyzed by the backend of settings.SENTIMENT_BACKEND, see
+    `djangoapp.sentiment`. A local backend scores the whole batch in
+    process. With a remote one, labels are looked up in the sentiment
+    cache first, by a hash of the text and model id. Every distinct text
+    that misses the cache is analyzed once, in parallel on the sentiment
+    executor, and joins a call already in flight for the same text. Texts that fail or are not
+    analyzed before the deadline get the SENTIMENT_UNKNOWN label, so a
+    slow sentiment service delays the caller by at most the deadline.
+    While the sentiment circuit breaker is open, texts missing the cache
+    get the SENTIMENT_UNKNOWN label without waiting at all.
+
+    Args:
+    - texts (list[str]): The review texts.
+    - deadline (float, optional): Seconds to wait for the whole batch,
+      defaults to settings.SENTIMENT_BATCH_DEADLINE.
+
+    Returns:
+    - list[str]: The sentiment labels, in the order of texts.
+    """
+    backend = get_sentiment_backend()
+    if backend.local:
+        return _analyze_locally(backend, texts)
+    if deadline is None:
+        deadline = settings.SENTIMENT_BATCH_DEADLINE
+    keys = {text: sentiment_cache_key(text, backend.model_id) for text in texts}
+    cached = sentiment_cache.get_many(list(set(keys.values())))
+    labels = {text: cached[key] for text, key in keys.items() if key in cached}
+    if sentiment_breaker.state == OPEN:
+        return [labels.get(text, SENTIMENT_UNKNOWN) for text in texts]
+    executor = get_sentiment_executor()
+    futures = {}
+    for text, key in keys.items():
+        if text not in labels:
+            futures[text] = _submit_sentiment(executor, backend, key, text)
+    done, not_done = wait(futures.values(), timeout=deadline)
+    for text, future in futures.items():
         label = None
-        score = None
-    return label
+        if future in done and future.exception() is None:
+            label = future.result()
+        labels[text] = label or SENTIMENT_UNKNOWN
+    return [labels[text] for text in texts]
+
+
+def _parse_reviews_page(json_result, limit):
+    if isinstance(json_result, list):
+        # A bare list holds every review, as one last page
+        return [DealerReview.from_dict(review) for review in json_result], None
+    docs = json_result.get("docs", [])
+    reviews = [DealerReview.from_dict(review) for review in docs]
+    # A short page is the last one
+    bookmark = json_result.get("bookmark") if len(reviews) >= limit else None
+    return reviews, bookmark
+
+
+def _reviews_page_params(id, page_size, bookmark):
+    params = {"id": id, "limit": page_size}
+    if bookmark:
+        params["bookmark"] = bookmark
+    return params
+
+
+def iter_dealer_review_pages_from_cf(url, id, page_size=None):
+    """
+    Fetch the reviews of a dealer page by page.
+
+    A page is only requested once the previous one has been consumed, so
+    a caller that stops early never fetches the remaining pages.
+
+    Args:
+    - url (str): The URL to fetch reviews from.
+    - id (int): The ID of the dealer.
+    - page_size (int, optional): Reviews per page, settings.REVIEWS_PAGE_SIZE
+      by default.
+
+    Yields:
+    - list[DealerReview]: The reviews of each page.
+    """
+    page_size = page_size or settings.REVIEWS_PAGE_SIZE
+    bookmark = None
+    while True:
+        json_result = get_request(
+            url, params=_reviews_page_params(id, page_size, bookmark)
+        )
+        if json_result is None:
+            return
+        reviews, bookmark = _parse_reviews_page(json_result, page_size)
+        if reviews:
+            yield reviews
+        if bookmark is None:
+            return
 
 
-def get_dealer_reviews_from_cf(url, id):
+def _unscored(dealer_reviews):
+    # The review service stores the sentiment once scored, only the
+    # reviews it has not scored yet need to be analyzed
+    return [review_obj for review_obj in dealer_reviews if not review_obj.sentiment]
+
+
+def get_dealer_reviews_from_cf(url, id, limit=None):
+    """
+    Fetch the reviews of a dealer and analyze their sentiment.
+
+    Args:
+    - url (str): The URL to fetch reviews from.
+    - id (int): The ID of the dealer.
+    - limit (int, optional): Only fetch the first limit reviews.
+
+    Returns:
+    - list[DealerReview]: A list of DealerReview objects.
+    """
     try:
-        reviews_data = get_request(url, params={"id": id})
-        if reviews_data:
-            dealer_reviews = []
-            for review in reviews_data:
-                review_obj = DealerReview(**review)
-                # Analyze the sentiment of the review
-                sentiment = analyze_review_sentiments(review_obj.review)
-                print(sentiment)  # Print the sentiment
-                review_obj.sentiment = (
-                    sentiment  # Assign sentiment to the review object
+        dealer_reviews = []
+        for page in iter_dealer_review_pages_from_cf(url, id):
+            dealer_reviews.extend(page)
+            if limit is not None and len(dealer_reviews) >= limit:
+                del dealer_reviews[limit:]
+                break
+        # Analyze the sentiment of all unscored reviews at once
+        unscored = _unscored(dealer_reviews)
+        if unscored:
+            sentiments = analyze_reviews_sentiments(
+                [review_obj.review for review_obj in unscored]
+            )
+            for review_obj, sentiment in zip(unscored, sentiments):
+                review_obj.sentiment = sentiment
+        return dealer_reviews
+    except Exception as e:
+        print(f"Error fetching reviews: {e}")
+        return []
+
+
+def get_review_changes_from_cf(url, since="0", limit=1000):
+    """
+    Fetch one page of the changes feed of the review service.
+
+    Args:
+    - url (str): The changes feed, settings.REVIEW_CHANGES_API_URL.
+    - since (str): The sequence to read from, as returned with the last
+      page. Reads from the start when "0".
+    - limit (int): Changes per page.
+
+    Returns:
+    - dict: The changes as ``results``, each with the ``id`` of the review,
+      ``deleted`` and the review as ``doc``, the ``last_seq`` to read the
+      next page from and whether more changes are ``pending``. None if
+      the feed could not be read.
+    """
+    return get_request(url, params={"since": since, "limit": limit})
+
+
+_fetch_executor = None
+_fetch_executor_pid = None
+_fetch_executor_lock = threading.Lock()
+
+
+def get_fetch_executor():
+    """
+    Return the thread pool running independent upstream fetches.
+
+    It is separate from the sentiment executor, whose tasks are submitted
+    from within these fetches.
+
+    Returns:
+    - ThreadPoolExecutor: The shared executor.
+    """
+    global _fetch_executor, _fetch_executor_pid
+    pid = os.getpid()
+    if _fetch_executor is None or _fetch_executor_pid != pid:
+        with _fetch_executor_lock:
+            if _fetch_executor is None or _fetch_executor_pid != pid:
+                _fetch_executor = ThreadPoolExecutor(
+                    max_workers=settings.RESTAPIS_FETCH_WORKERS,
+                    thread_name_prefix="fetch",
                 )
-                dealer_reviews.append(review_obj)
-            return dealer_reviews
+                _fetch_executor_pid = pid
+    return _fetch_executor
+
+
+def fetch_concurrently(*fetches, deadline=None, default=None):
+    """
+    Run independent upstream fetches concurrently.
+
+    Args:
+    - fetches (callable): Functions without arguments, one per fetch.
+    - deadline (float, optional): Seconds to wait for all fetches together.
+    - default (object, optional): Result of a fetch that failed or did
+      not finish before the deadline.
+
+    Returns:
+    - list: The results, in the order of fetches.
+    """
+    executor = get_fetch_executor()
+    futures = [timing.submit_in_context(executor, fetch) for fetch in fetches]
+    done, not_done = wait(futures, timeout=deadline)
+    for future in not_done:
+        future.cancel()
+    results = []
+    for future in futures:
+        if future in done and future.exception() is None:
+            results.append(future.result())
+        else:
+            if future in done:
+                print(f"Error during concurrent fetch: {future.exception()}")
+            results.append(default)
+    return results
+
+
+# Async client, used by the async views when served under ASGI
+
+_async_state = weakref.WeakKeyDictionary()
+
+# Sentiment calls started by the async views, referenced until they finish
+_sentiment_tasks = set()
+
+
+def _get_async_state():
+    loop = asyncio.get_running_loop()
+    state = _async_state.get(loop)
+    if state is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.RESTAPIS_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.RESTAPIS_ASYNC_MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(
+                settings.RESTAPIS_READ_TIMEOUT,
+                connect=settings.RESTAPIS_CONNECT_TIMEOUT,
+            ),
+        )
+        state = {
+            "client": client,
+            "sentiment_slots": asyncio.Semaphore(settings.SENTIMENT_MAX_WORKERS),
+        }
+        _async_state[loop] = state
+    return state
+
+
+def get_async_client():
+    """
+    Return the pooled async HTTP client of the running event loop.
+
+    One client, and so one keep-alive connection pool per upstream host,
+    is shared by every request served on the loop.
+
+    Returns:
+    - httpx.AsyncClient: The pooled client.
+    """
+    return _get_async_state()["client"]
+
+
+async def async_get_request(url, params=None, apikey=None):
+    """
+    Async version of get_request, sharing its validators.
+
+    Args:
+    - url (str): The URL to make the GET request to.
+    - params (dict, optional): Parameters to be sent with the request.
+    - apikey (str, optional): API key for authentication, if needed.
+
+    Returns:
+    - dict: JSON response from the request.
+    """
+    try:
+        key = _conditional_key(url, params)
+        headers, cached = _conditional_headers(key)
+        headers["Content-Type"] = "application/json"
+        auth = ("apikey", apikey) if apikey else None
+        with timing.upstream_call(url) as call:
+            call.response = await get_async_client().get(
+                url, params=params, headers=headers, auth=auth
+            )
+        response = call.response
+        if response.status_code == 304 and cached is not None:
+            return cached[2]
+        response.raise_for_status()
+        body = response.json()
+        _remember_validators(key, response, body)
+        return body
+
+    except httpx.HTTPStatusError as http_err:
+        print(f"HTTP error occurred: {http_err}")
+    except httpx.TimeoutException as timeout_err:
+        print(f"Timeout error occurred: {timeout_err}")
+    except httpx.TransportError as conn_err:
+        print(f"Connection error occurred: {conn_err}")
+    except httpx.HTTPError as req_err:
+        print(f"Error during request: {req_err}")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+
+async def async_post_request(url, json_payload, **kwargs):
+    with timing.upstream_call(url) as call:
+        call.response = await get_async_client().post(
+            url, params=kwargs, json=json_payload
+        )
+    return call.response
+
+
+async def _aload_dealers(url, params=None):
+    json_result = await async_get_request(url, params=params)
+    if json_result is None:
+        return None
+    return [CarDealer.from_dict(dealer) for dealer in json_result]
+
+
+async def async_get_dealers_from_cf(url):
+    """
+    Async version of get_dealers_from_cf, sharing its cache.
+    """
+    try:
+        dealers = await dealer_cache.aget(
+            ("dealers", url),
+            lambda: _aload_dealers(url),
+            ttl=settings.DEALER_LIST_CACHE_TTL,
+        )
+        return list(dealers) if dealers else []
+    except Exception as e:
+        print(f"Error fetching dealers: {e}")
+        return []
+
+
+async def async_get_dealers_page_from_cf(url, state=None, limit=None, bookmark=None):
+    """
+    Async version of get_dealers_page_from_cf, sharing its cache.
+    """
+    params = _page_params(state, limit, bookmark)
+
+    async def load():
+        json_result = await async_get_request(url, params=params)
+        return _parse_dealers_page(json_result, params["limit"])
+
+    try:
+        page = await dealer_cache.aget(
+            ("dealers", url, state, params["limit"], bookmark),
+            load,
+            ttl=settings.DEALER_LIST_CACHE_TTL,
+        )
+        if page:
+            dealers, next_bookmark = page
+            return list(dealers), next_bookmark
+        return [], None
+    except Exception as e:
+        print(f"Error fetching dealers: {e}")
+        return [], None
+
+
+async def async_get_dealer_by_id_from_cf(url, id):
+    """
+    Async version of get_dealer_by_id_from_cf, sharing its cache.
+    """
+    try:
+        dealer_data = await dealer_cache.aget(
+            ("dealer", url, id), lambda: _aload_dealers(url, params={"id": id})
+        )
+        if dealer_data:
+            return dealer_data[0]
         else:
-            return []
+            return None
+    except Exception as e:
+        print(f"Error fetching dealer by ID: {e}")
+        return None
+
+
+async def _aload_geo_index(url):
+    dealers = []
+    bookmark = None
+    while True:
+        params = _page_params(None, settings.DEALERS_MAX_PAGE_SIZE, bookmark)
+        json_result = await async_get_request(url, params=params)
+        page = _parse_dealers_page(json_result, params["limit"])
+        if page is None:
+            return None
+        page_dealers, bookmark = page
+        dealers.extend(page_dealers)
+        if bookmark is None:
+            return GeoIndex(dealers, cell_degrees=settings.GEO_CELL_DEGREES)
+
+
+async def async_get_dealers_near_from_cf(url, lat, long, k=None, radius_km=None):
+    """
+    Async version of get_dealers_near_from_cf, sharing its index.
+    """
+    try:
+        index = await dealer_cache.aget(
+            ("dealers", url, "geo"),
+            lambda: _aload_geo_index(url),
+            ttl=settings.DEALER_GEO_INDEX_TTL,
+        )
+        return find_dealers_near(index, lat, long, k=k, radius_km=radius_km)
+    except Exception as e:
+        print(f"Error searching dealers: {e}")
+        return []
+
+
+async def async_get_dealer_stats_from_cf(url, ids):
+    """
+    Async version of get_dealer_stats_from_cf, sharing its cache.
+    """
+    ids = tuple(sorted(set(ids)))
+    if not url or not ids:
+        return {}
+    params = {"ids": ",".join(str(id) for id in ids)}
+
+    async def load():
+        return _parse_dealer_stats(await async_get_request(url, params=params), ids)
+
+    try:
+        stats = await dealer_stats_cache.aget((url, ids), load)
+        return dict(stats) if stats else {}
+    except Exception as e:
+        print(f"Error fetching dealer stats: {e}")
+        return {}
+
+
+async def async_analyze_review_sentiments(dealer_review):
+    """
+    Async version of analyze_review_sentiments, sharing its breaker.
+    """
+    if not sentiment_breaker.allow():
+        return None
+    myobj = {"raw_document": {"text": dealer_review}}
+    header = {"grpc-metadata-mm-model-id": SENTIMENT_MODEL_ID}
+    started = time.monotonic()
+    try:
+        with timing.upstream_call(settings.SENTIMENT_API_URL) as call:
+            call.response = await get_async_client().post(
+                settings.SENTIMENT_API_URL,
+                json=myobj,
+                headers=header,
+                timeout=httpx.Timeout(
+                    settings.SENTIMENT_CALL_TIMEOUT,
+                    connect=settings.RESTAPIS_CONNECT_TIMEOUT,
+                ),
+            )
+    except (Exception, asyncio.CancelledError) as e:
+        sentiment_breaker.record_failure()
+        if isinstance(e, asyncio.CancelledError):
+            raise
+        print(f"Sentiment request failed: {e}")
+        return None
+    return _sentiment_result(call.response, time.monotonic() - started)
+
+
+async def _async_analyze_and_cache(key, text, future):
+    try:
+        async with _get_async_state()["sentiment_slots"]:
+            label = await async_analyze_review_sentiments(text)
+        if label:
+            sentiment_cache.set(key, label)
+    except Exception as e:
+        print(f"Error analyzing sentiment: {e}")
+        future.set_result(None)
+    except BaseException:
+        # Cancelled, at a deadline or loop shutdown: the requests sharing
+        # the call get no label rather than waiting until their deadline
+        future.set_result(None)
+        raise
+    else:
+        future.set_result(label)
+    finally:
+        with _sentiment_inflight_lock:
+            _sentiment_inflight.pop(key, None)
+
+
+def _start_async_sentiment(key, text):
+    with _sentiment_inflight_lock:
+        future = _sentiment_inflight.get(key)
+        if future is None:
+            future = concurrent.futures.Future()
+            _sentiment_inflight[key] = future
+            task = asyncio.ensure_future(_async_analyze_and_cache(key, text, future))
+            _sentiment_tasks.add(task)
+            task.add_done_callback(_sentiment_tasks.discard)
+    return asyncio.wrap_future(future)
+
+
+async def async_analyze_reviews_sentiments(texts, deadline=None):
+    """
+    Async version of analyze_reviews_sentiments.
+
+    Calls share the sentiment cache and in-flight calls of the threaded
+    version, and at most settings.SENTIMENT_MAX_WORKERS run at once per
+    event loop. Remote backends other than `RemoteSentimentBackend` run
+    the threaded version on the sentiment executor.
+    """
+    backend = get_sentiment_backend()
+    if backend.local:
+        return _analyze_locally(backend, texts)
+    if not isinstance(backend, RemoteSentimentBackend):
+        return await asyncio.get_running_loop().run_in_executor(
+            get_sentiment_executor(), analyze_reviews_sentiments, texts, deadline
+        )
+    if deadline is None:
+        deadline = settings.SENTIMENT_BATCH_DEADLINE
+    keys = {text: sentiment_cache_key(text) for text in texts}
+    cached = sentiment_cache.get_many(list(set(keys.values())))
+    labels = {text: cached[key] for text, key in keys.items() if key in cached}
+    if sentiment_breaker.state == OPEN:
+        return [labels.get(text, SENTIMENT_UNKNOWN) for text in texts]
+    futures = {}
+    for text, key in keys.items():
+        if text not in labels:
+            futures[text] = _start_async_sentiment(key, text)
+    done = set()
+    if futures:
+        done, _ = await asyncio.wait(futures.values(), timeout=deadline)
+    for text, future in futures.items():
+        label = future.result() if future in done else None
+        labels[text] = label or SENTIMENT_UNKNOWN
+    return [labels[text] for text in texts]
+
+
+async def async_iter_dealer_review_pages_from_cf(url, id, page_size=None):
+    """
+    Async version of iter_dealer_review_pages_from_cf.
+    """
+    page_size = page_size or settings.REVIEWS_PAGE_SIZE
+    bookmark = None
+    while True:
+        json_result = await async_get_request(
+            url, params=_reviews_page_params(id, page_size, bookmark)
+        )
+        if json_result is None:
+            return
+        reviews, bookmark = _parse_reviews_page(json_result, page_size)
+        if reviews:
+            yield reviews
+        if bookmark is None:
+            return
+
+
+async def async_get_dealer_reviews_from_cf(url, id, limit=None):
+    """
+    Async version of get_dealer_reviews_from_cf.
+    """
+    try:
+        dealer_reviews = []
+        async for page in async_iter_dealer_review_pages_from_cf(url, id):
+            dealer_reviews.extend(page)
+            if limit is not None and len(dealer_reviews) >= limit:
+                del dealer_reviews[limit:]
+                break
+        unscored = _unscored(dealer_reviews)
+        if unscored:
+            sentiments = await async_analyze_reviews_sentiments(
+                [review_obj.review for review_obj in unscored]
+            )
+            for review_obj, sentiment in zip(unscored, sentiments):
+                review_obj.sentiment = sentiment
+        return dealer_reviews
     except Exception as e:
         print(f"Error fetching reviews: {e}")
         return []
+
+
+async def async_fetch_concurrently(*fetches, deadline=None, default=None):
+    """
+    Async version of fetch_concurrently.
+
+    Args:
+    - fetches (awaitable): The fetches to run concurrently.
+    - deadline (float, optional): Seconds to wait for all fetches together.
+    - default (object, optional): Result of a fetch that failed or did
+      not finish before the deadline.
+
+    Returns:
+    - list: The results, in the order of fetches.
+    """
+    tasks = [asyncio.ensure_future(fetch) for fetch in fetches]
+    done, not_done = await asyncio.wait(tasks, timeout=deadline)
+    for task in not_done:
+        task.cancel()
+    results = []
+    for task in tasks:
+        if task in done and task.exception() is None:
+            results.append(task.result())
+        else:
+            if task in done:
+                print(f"Error during concurrent fetch: {task.exception()}")
+            results.append(default)
+    return results
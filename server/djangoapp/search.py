@@ -0,0 +1,434 @@
+"""
+Full-text search of reviews.
+
+`ReviewIndex` is an inverted index of the review texts, with facets on the
+car make, model and year and on purchase. Results are ranked with BM25.
+The index is fed from the changes feed of the review service
+(settings.REVIEW_CHANGES_API_URL), so it is built once and then only
+applies the reviews written since its last update:
+
+    python manage.py build_review_index
+    python manage.py update_review_index --loop
+
+Both commands save the index to settings.REVIEW_SEARCH_INDEX_PATH, which
+web processes load on first search and reload when it changes.
+"""
+import heapq
+import logging
+import math
+import operator
+import os
+import pickle
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from itertools import compress
+
+from django.conf import settings
+
+from .caching import LRUCache
+from .restapis import get_review_changes_from_cf
+
+logger = logging.getLogger(__name__)
+
+# Review fields kept in the index and returned with the results
+STORED_FIELDS = (
+    "dealership",
+    "id",
+    "name",
+    "review",
+    "purchase",
+    "purchase_date",
+    "car_make",
+    "car_model",
+    "car_year",
+    "sentiment",
+)
+FACETS = ("car_make", "car_model", "car_year", "purchase")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Searches whose results are kept, per index, and the results ranked at
+# least, so that the first pages of a search share one ranking
+RESULTS_CACHE_SIZE = 256
+RESULTS_DEPTH = 100
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have i in is it its my of on or "
+    "so that the their there they this to was we were with you".split()
+)
+
+
+def tokenize(text):
+    """
+    Returns:
+    - list[str]: The lowercase words of text, without stop words.
+    """
+    return [
+        token
+        for token in _TOKEN.findall(str(text or "").lower())
+        if token not in STOP_WORDS
+    ]
+
+
+def facet_value(value):
+    """Return the form of a facet value used for filtering."""
+    return str(value).lower()
+
+
+class ReviewIndex:
+    """
+    An inverted index of reviews.
+
+    Reviews get consecutive numbers as they are added. Each term maps to
+    the numbers of the reviews containing it, in increasing order, and its
+    frequency in each. Stored fields are kept column by column. A review
+    updated with a new text is removed and added again, removed reviews
+    are skipped until the index is rebuilt.
+    """
+
+    def __init__(self):
+        # The sequence of the changes feed the index is up to date with
+        self.since = "0"
+        self.keys = []
+        self.numbers = {}
+        self.columns = {field: [] for field in STORED_FIELDS}
+        self.lengths = array("H")
+        self.total_length = 0
+        self.postings = {}
+        self.facets = {field: {} for field in FACETS}
+        self.facet_columns = {field: [] for field in FACETS}
+        self.deleted = set()
+        # Bumped by every change, results cached for another version are
+        # not used
+        self.version = 0
+
+    def __len__(self):
+        return len(self.keys) - len(self.deleted)
+
+    def add(self, key, doc):
+        """
+        Index a review, replacing the review indexed under the same key.
+
+        Args:
+        - key (str): The document id of the review.
+        - doc (dict): The review.
+        """
+        self.version += 1
+        number = self.numbers.get(key)
+        if number is not None and number not in self.deleted:
+            if self._same_terms(number, doc):
+                # Only stored fields changed, such as the sentiment
+                for field in STORED_FIELDS:
+                    self.columns[field][number] = doc.get(field)
+                return
+            self.remove(key)
+        number = len(self.keys)
+        self.keys.append(key)
+        self.numbers[key] = number
+        for field in STORED_FIELDS:
+            self.columns[field].append(doc.get(field))
+        tokens = tokenize(doc.get("review"))
+        self.lengths.append(min(len(tokens), 65535))
+        self.total_length += len(tokens)
+        for term, frequency in Counter(tokens).items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = (array("I"), array("H"))
+            postings[0].append(number)
+            postings[1].append(min(frequency, 65535))
+        for field in FACETS:
+            value = facet_value(doc.get(field))
+            self.facets[field].setdefault(value, array("I")).append(number)
+            self.facet_columns[field].append(value)
+
+    def _same_terms(self, number, doc):
+        fields = ("review",) + FACETS
+        return all(self.columns[field][number] == doc.get(field) for field in fields)
+
+    def remove(self, key):
+        """Drop the review indexed under key, if any."""
+        number = self.numbers.pop(key, None)
+        if number is not None and number not in self.deleted:
+            self.version += 1
+            self.deleted.add(number)
+            self.total_length -= self.lengths[number]
+
+    def apply_changes(self, results):
+        """
+        Apply the results of a changes feed page.
+
+        Returns:
+        - int: The number of changes applied.
+        """
+        for change in results:
+            doc = change.get("doc")
+            if change.get("deleted") or not doc:
+                self.remove(change["id"])
+            elif "review" in doc and "dealership" in doc:
+                self.add(change["id"], doc)
+        return len(results)
+
+    def _norms(self):
+        """
+        Return the length normalization of every review, recomputed once
+        the average review length changed.
+        """
+        state = (len(self.keys), self.total_length)
+        if getattr(self, "_norms_state", None) != state:
+            count = len(self)
+            average_length = self.total_length / count if count else 1.0
+            base = K1 * (1 - B)
+            per_length = K1 * B / average_length
+            self._norms_cache = array(
+                "d", [base + per_length * length for length in self.lengths]
+            )
+            self._norms_state = state
+        return self._norms_cache
+
+    def _allowed(self, filters):
+        """
+        Return the live reviews matching filters, None without filters.
+        """
+        if not filters:
+            return None
+        ordered = sorted(
+            filters.items(),
+            key=lambda item: len(self.facets[item[0]].get(item[1], ())),
+        )
+        field, value = ordered[0]
+        allowed = set(self.facets[field].get(value, ()))
+        for field, value in ordered[1:]:
+            column = self.facet_columns[field]
+            allowed = {number for number in allowed if column[number] == value}
+        allowed -= self.deleted
+        return allowed
+
+    def _live_postings(self, term, allowed):
+        numbers, frequencies = self.postings[term]
+        if allowed is not None:
+            keep = list(map(allowed.__contains__, numbers))
+        elif self.deleted:
+            keep = list(map(operator.not_, map(self.deleted.__contains__, numbers)))
+        else:
+            return numbers, frequencies
+        return list(compress(numbers, keep)), list(compress(frequencies, keep))
+
+    def _score(self, terms, allowed):
+        """Return the BM25 score of every live review matching terms."""
+        count = len(self)
+        norms = self._norms()
+        scores = {}
+        for term in set(terms):
+            if term not in self.postings:
+                continue
+            frequency = len(self.postings[term][0])
+            idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            numbers, frequencies = self._live_postings(term, allowed)
+            # boost * tf / (tf + norm), computed without a Python loop
+            weights = map(
+                (idf * (K1 + 1)).__mul__,
+                map(
+                    operator.truediv,
+                    frequencies,
+                    map(operator.add, frequencies, map(norms.__getitem__, numbers)),
+                ),
+            )
+            if not scores:
+                scores = dict(zip(numbers, weights))
+            else:
+                get = scores.get
+                for number, weight in zip(numbers, weights):
+                    scores[number] = get(number, 0.0) + weight
+        return scores
+
+    def search(self, query="", filters=None, offset=0, limit=20, facet_limit=10):
+        """
+        Search reviews.
+
+        Args:
+        - query (str): Words to search in the review texts. Reviews
+          containing any of them are ranked by BM25. An empty query lists
+          the reviews matching the filters, newest first.
+        - filters (dict, optional): Facet values the reviews must have, by
+          facet name, see `FACETS`.
+        - offset (int): Results to skip, for pagination.
+        - limit (int): Results to return.
+        - facet_limit (int): Most frequent values returned per facet.
+
+        Returns:
+        - dict: The total number of matching reviews, the page of results
+          as (score, review) and the facet counts of all matching reviews.
+        """
+        filters = {
+            field: facet_value(value)
+            for field, value in (filters or {}).items()
+            if field in FACETS and value not in (None, "")
+        }
+        terms = tokenize(query)
+        depth = -(-(offset + limit) // RESULTS_DEPTH) * RESULTS_DEPTH
+        cache_key = (
+            self.version,
+            tuple(sorted(set(terms))),
+            tuple(sorted(filters.items())),
+            depth,
+            facet_limit,
+        )
+        results = self._results().get(cache_key)
+        if results is None:
+            results = self._search(terms, filters, depth, facet_limit)
+            self._results().set(cache_key, results)
+        total, ranked, facets = results
+        return {
+            "total": total,
+            "hits": [
+                (score, self.document(number))
+                for number, score in ranked[offset : offset + limit]
+            ],
+            "facets": facets,
+        }
+
+    def _results(self):
+        cache = getattr(self, "_results_cache", None)
+        if cache is None:
+            cache = self._results_cache = LRUCache(RESULTS_CACHE_SIZE)
+        return cache
+
+    def _search(self, terms, filters, count, facet_limit):
+        """
+        Returns:
+        - tuple: The number of matches, the first count as (number, score)
+          and the facet counts.
+        """
+        allowed = self._allowed(filters)
+        if terms:
+            scores = self._score(terms, allowed)
+            matches = scores.keys()
+            ranked = heapq.nlargest(count, scores.items(), key=operator.itemgetter(1))
+        else:
+            if allowed is None:
+                matches = [
+                    number
+                    for number in range(len(self.keys) - 1, -1, -1)
+                    if number not in self.deleted
+                ]
+                newest = matches[:count]
+            else:
+                matches = allowed
+                newest = heapq.nlargest(count, allowed)
+            ranked = [(number, 0.0) for number in newest]
+        facets = {}
+        for field in FACETS:
+            counts = Counter(map(self.columns[field].__getitem__, matches))
+            facets[field] = [
+                (str(value), count) for value, count in counts.most_common(facet_limit)
+            ]
+        return len(matches), ranked, facets
+
+    def document(self, number):
+        """Return the stored fields of a review, by number."""
+        return {field: self.columns[field][number] for field in STORED_FIELDS}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # Recomputed on first search
+        state.pop("_norms_cache", None)
+        state.pop("_norms_state", None)
+        state.pop("_results_cache", None)
+        return state
+
+    def save(self, path):
+        """Write the index to path, atomically."""
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns:
+        - ReviewIndex: The index saved at path.
+        """
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def update_index(index, url, batch_size=1000):
+    """
+    Apply to an index the reviews written since its last update.
+
+    Args:
+    - index (ReviewIndex): The index, updated in place.
+    - url (str): The changes feed of the review service.
+    - batch_size (int): Changes fetched per request.
+
+    Returns:
+    - int: The number of changes applied.
+
+    Raises:
+    - RuntimeError: If the changes feed could not be read.
+    """
+    applied = 0
+    while True:
+        page = get_review_changes_from_cf(url, since=index.since, limit=batch_size)
+        if page is None:
+            raise RuntimeError(f"Unable to read the changes feed at {url}")
+        applied += index.apply_changes(page["results"])
+        advanced = page["last_seq"] != index.since
+        index.since = page["last_seq"]
+        # A feed that does not advance would be read again forever
+        if not page.get("pending") or not page["results"] or not advanced:
+            return applied
+
+
+_index = None
+_index_mtime = None
+_index_checked = 0.0
+_index_lock = threading.Lock()
+
+
+def get_review_index():
+    """
+    Return the review index of this process, loaded from
+    settings.REVIEW_SEARCH_INDEX_PATH and reloaded when the file changed,
+    checked at most every settings.REVIEW_SEARCH_RELOAD_INTERVAL seconds.
+
+    Returns:
+    - ReviewIndex: The index, empty if it was never built.
+    """
+    global _index, _index_mtime, _index_checked
+    interval = settings.REVIEW_SEARCH_RELOAD_INTERVAL
+    if _index is not None and time.monotonic() - _index_checked < interval:
+        return _index
+    with _index_lock:
+        now = time.monotonic()
+        if _index is not None and now - _index_checked < interval:
+            return _index
+        _index_checked = now
+        path = settings.REVIEW_SEARCH_INDEX_PATH
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime is None:
+            if _index is None:
+                logger.warning(
+                    "No review index at %s, run 'python manage.py build_review_index'",
+                    path,
+                )
+                _index = ReviewIndex()
+        elif mtime != _index_mtime:
+            try:
+                _index = ReviewIndex.load(path)
+                _index_mtime = mtime
+            except (OSError, pickle.UnpicklingError, EOFError) as err:
+                logger.error("Unable to load the review index %s: %s", path, err)
+                if _index is None:
+                    _index = ReviewIndex()
+        return _index
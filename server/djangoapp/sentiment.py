@@ -0,0 +1,262 @@
+"""
+Sentiment analysis backends.
+
+Review sentiments are computed by the backend named by the dotted path in
+settings.SENTIMENT_BACKEND:
+
+- ``djangoapp.restapis.RemoteSentimentBackend`` (the default) calls the
+  Watson BERT sentiment service, one request per review, through the
+  cache, thread pool and circuit breaker of `djangoapp.restapis`.
+- ``djangoapp.sentiment.LexiconSentimentBackend`` scores reviews in
+  process with a word lexicon, a whole batch at once. It needs no network, so it suits bulk
+  backfills and offline environments.
+
+A backend is a `SentimentBackend` subclass. Local backends are called with
+the whole batch of texts at once, remote ones one text at a time.
+"""
+import math
+import threading
+from itertools import compress
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+SENT_POSITIVE = "SENT_POSITIVE"
+SENT_NEUTRAL = "SENT_NEUTRAL"
+SENT_NEGATIVE = "SENT_NEGATIVE"
+
+
+class SentimentBackend:
+    """
+    The interface of sentiment backends.
+
+    Attributes:
+    - model_id (str): Identifies the model, cached labels are keyed on it.
+    - local (bool): Whether the backend runs in process. Labels of local
+      backends are neither cached nor computed on the sentiment thread
+      pool.
+    """
+
+    model_id = ""
+    local = False
+
+    def analyze_batch(self, texts):
+        """
+        Analyze the sentiment of review texts.
+
+        Args:
+        - texts (list[str]): The review texts.
+
+        Returns:
+        - list[str]: The sentiment labels, in the order of texts, None for
+          the texts that could not be analyzed.
+        """
+        raise NotImplementedError
+
+
+# Valence of common review words, from -3 (very negative) to 3
+LEXICON = {
+    "amazing": 3.0,
+    "awesome": 3.0,
+    "excellent": 3.0,
+    "fantastic": 3.0,
+    "outstanding": 3.0,
+    "perfect": 3.0,
+    "superb": 3.0,
+    "wonderful": 3.0,
+    "best": 2.5,
+    "great": 2.5,
+    "love": 2.5,
+    "loved": 2.5,
+    "recommend": 2.0,
+    "recommended": 2.0,
+    "friendly": 2.0,
+    "happy": 2.0,
+    "helpful": 2.0,
+    "honest": 2.0,
+    "impressed": 2.0,
+    "pleased": 2.0,
+    "professional": 2.0,
+    "satisfied": 2.0,
+    "smooth": 1.5,
+    "easy": 1.5,
+    "fair": 1.5,
+    "fast": 1.5,
+    "good": 1.5,
+    "knowledgeable": 1.5,
+    "nice": 1.5,
+    "quick": 1.5,
+    "reliable": 1.5,
+    "thanks": 1.5,
+    "clean": 1.0,
+    "fine": 1.0,
+    "ok": 0.5,
+    "okay": 0.5,
+    "awful": -3.0,
+    "horrible": -3.0,
+    "scam": -3.0,
+    "terrible": -3.0,
+    "worst": -3.0,
+    "avoid": -2.5,
+    "hate": -2.5,
+    "rude": -2.5,
+    "bad": -2.0,
+    "broken": -2.0,
+    "dishonest": -2.0,
+    "disappointed": -2.0,
+    "disappointing": -2.0,
+    "lied": -2.0,
+    "poor": -2.0,
+    "problem": -1.5,
+    "problems": -1.5,
+    "unhappy": -2.0,
+    "unprofessional": -2.0,
+    "expensive": -1.5,
+    "overpriced": -2.0,
+    "pushy": -2.0,
+    "slow": -1.5,
+    "waited": -1.0,
+    "waiting": -1.0,
+    "issue": -1.0,
+    "issues": -1.0,
+}
+
+# Words flipping the valence of the next words, and how many words they reach
+NEGATIONS = frozenset(
+    "not no never none nobody nothing neither nor cannot "
+    "dont didnt doesnt isnt wasnt wont wouldnt cant couldnt".split()
+)
+NEGATION_SCOPE = 3
+NEGATION_FACTOR = -0.75
+
+# Texts of a batch are split into words with one bytes.translate: letters
+# and the mark ending each text are kept, apostrophes dropped ("don't" is
+# "dont") and every other character, non-ASCII ones included, separates words
+_END = "\x00"
+_SEPARATOR = f" {_END} "
+_WORD_BYTES = bytes(
+    byte if byte == 0 or 97 <= byte <= 122 else 32 for byte in range(256)
+)
+
+
+def load_lexicon(path):
+    """
+    Read a lexicon file, one ``word<TAB>valence`` per line as in the AFINN
+    and VADER lexicons. Lines starting with ``#`` are ignored.
+
+    Returns:
+    - dict: The valence of each word.
+    """
+    lexicon = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            word, valence = line.split("\t")[:2]
+            lexicon[word.strip().lower()] = float(valence)
+    return lexicon
+
+
+class LexiconSentimentBackend(SentimentBackend):
+    """
+    Scores texts by the valence of their words.
+
+    The valence of the words found in the lexicon is summed, negated words
+    counting the other way round, and normalized to -1..1. Texts scoring
+    above threshold are positive, below -threshold negative.
+
+    Args:
+    - lexicon (dict, optional): Word valences, settings.SENTIMENT_LEXICON_PATH
+      or the built-in `LEXICON` by default.
+    - threshold (float): The score from which a text is not neutral.
+    """
+
+    local = True
+
+    def __init__(self, lexicon=None, threshold=0.05):
+        if lexicon is None:
+            path = settings.SENTIMENT_LEXICON_PATH
+            lexicon = load_lexicon(path) if path else LEXICON
+        self.lexicon = lexicon
+        self.threshold = threshold
+        self.model_id = f"lexicon-{len(lexicon)}"
+        self._counted = frozenset(lexicon) | NEGATIONS | {_END}
+
+    def score(self, text):
+        """
+        Returns:
+        - float: The sentiment of text, from -1 (negative) to 1.
+        """
+        return self.scores([text])[0]
+
+    def scores(self, texts):
+        """
+        Score a batch of texts at once.
+
+        The batch is lowercased and split into words at once, and the
+        words that count (lexicon words, negations and ends of text) are
+        picked out in bulk. Only those are then looked at one by one, most
+        words of a review being in neither list.
+
+        Returns:
+        - list[float]: The sentiment of each text, from -1 (negative) to 1.
+        """
+        joined = _SEPARATOR.join((text or "").replace(_END, " ") for text in texts)
+        tokens = (
+            joined.lower()
+            .encode("ascii", "replace")
+            .translate(_WORD_BYTES, b"'")
+            .decode("ascii")
+            .split()
+        )
+        counted = compress(range(len(tokens)), map(self._counted.__contains__, tokens))
+        lexicon = self.lexicon
+        totals = [0.0] * len(texts)
+        text = 0
+        last_negation = -NEGATION_SCOPE - 1
+        for position in counted:
+            token = tokens[position]
+            if token == _END:
+                text += 1
+                last_negation = -NEGATION_SCOPE - 1
+            elif token in NEGATIONS:
+                last_negation = position
+            elif position - last_negation <= NEGATION_SCOPE:
+                totals[text] += lexicon[token] * NEGATION_FACTOR
+            else:
+                totals[text] += lexicon[token]
+        # Normalization of the VADER lexicon scorer
+        return [total / math.sqrt(total * total + 15) for total in totals]
+
+    def analyze_batch(self, texts):
+        threshold = self.threshold
+        labels = []
+        for score in self.scores(texts):
+            if score >= threshold:
+                labels.append(SENT_POSITIVE)
+            elif score <= -threshold:
+                labels.append(SENT_NEGATIVE)
+            else:
+                labels.append(SENT_NEUTRAL)
+        return labels
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_sentiment_backend():
+    """
+    Return the sentiment backend of this process, settings.SENTIMENT_BACKEND.
+
+    Returns:
+    - SentimentBackend: One instance per backend class.
+    """
+    path = settings.SENTIMENT_BACKEND
+    backend = _backends.get(path)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(path)
+            if backend is None:
+                backend = _backends[path] = import_string(path)()
+    return backend
@@ -1,3 +1,1361 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import random
+import tempfile
+import threading
+import time
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.apps import apps
+from django.test import (
+    AsyncRequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+)
+from django.urls import reverse
+from django.utils import timezone
+from ibm_cloud_sdk_core import ApiException
+
+from benchmarks import datagen
+
+from . import (
+    circuitbreaker,
+    enrichment,
+    geo,
+    indexes,
+    loader,
+    metrics,
+    outbox,
+    restapis,
+    search,
+    sentiment,
+    timing,
+    views,
+)
+from .caching import ReadThroughCache
+from .fragments import VERSION_KEY, fragment_cache, versions_are_shared
+from .circuitbreaker import CircuitBreaker
+from .localstore import (
+    REQUIRED_REVIEW_FIELDS,
+    LocalServices,
+    LocalStore,
+    load_json_data,
+)
+from .models import (
+    CarDealer,
+    CarMake,
+    CarModel,
+    DealerReview,
+    DealerReviewBatch,
+    DealerStats,
+    ReviewEnrichment,
+    ReviewOutbox,
+)
 
 # Create your tests here.
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._reply(self.server.routes.get(self.path.split("?")[0], []))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.server.posted.append(json.loads(self.rfile.read(length) or b"null"))
+        self._reply({"message": "ok"}, status=201)
+
+    def _reply(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubUpstream:
+    """A keep-alive JSON server standing in for the cloud functions."""
+
+    def __init__(self, routes=None):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+        self.server.daemon_threads = True
+        self.server.routes = routes or {}
+        self.server.posted = []
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+DEALER = {
+    "id": 1,
+    "city": "El Paso",
+    "state": "Texas",
+    "st": "TX",
+    "address": "3 Nova Court",
+    "zip": "88563",
+    "lat": 31.6948,
+    "long": -106.3,
+    "short_name": "Holdlamis",
+    "full_name": "Holdlamis Car Dealership",
+}
+
+
+class SessionPoolTests(SimpleTestCase):
+    def test_requests_reuse_pooled_connection(self):
+        with StubUpstream({"/dealerships/get": [DEALER]}) as upstream:
+            for _ in range(3):
+                dealers = restapis.get_request(upstream.url + "/dealerships/get")
+            self.assertEqual(dealers, [DEALER])
+            stats = restapis.get_pool_stats()[upstream.url]
+            self.assertEqual(stats["requests"], 3)
+            self.assertEqual(stats["connections"], 1)
+
+    def test_session_is_shared(self):
+        self.assertIs(restapis.get_session(), restapis.get_session())
+
+    def test_upstream_calls_use_timeouts(self):
+        connect, read = restapis.get_timeout()
+        self.assertGreater(connect, 0)
+        self.assertGreater(read, 0)
+
+
+def _slow_sentiment(text):
+    time.sleep(0.2 if text != "stuck" else 2)
+    return "SENT_POSITIVE"
+
+
+class SentimentBatchTests(SimpleTestCase):
+    def setUp(self):
+        restapis.sentiment_cache.local.clear()
+        restapis.sentiment_breaker.reset()
+        cache.clear()
+
+    @mock.patch.object(restapis, "analyze_review_sentiments", _slow_sentiment)
+    def test_reviews_are_analyzed_concurrently(self):
+        started = time.monotonic()
+        labels = restapis.analyze_reviews_sentiments(["a", "b", "c", "d", "a"])
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(labels, ["SENT_POSITIVE"] * 5)
+
+    @mock.patch.object(restapis, "analyze_review_sentiments", _slow_sentiment)
+    def test_deadline_degrades_to_unknown(self):
+        labels = restapis.analyze_reviews_sentiments(["a", "stuck"], deadline=0.5)
+        self.assertEqual(labels, ["SENT_POSITIVE", restapis.SENTIMENT_UNKNOWN])
+
+    @mock.patch.object(restapis, "analyze_review_sentiments", side_effect=ValueError)
+    def test_failures_degrade_to_unknown(self, _):
+        labels = restapis.analyze_reviews_sentiments(["a"])
+        self.assertEqual(labels, [restapis.SENTIMENT_UNKNOWN])
+
+    def test_cached_labels_skip_the_sentiment_service(self):
+        with mock.patch.object(
+            restapis, "analyze_review_sentiments", return_value="SENT_NEUTRAL"
+        ) as analyze:
+            restapis.analyze_reviews_sentiments(["a", "b"])
+            restapis.sentiment_cache.local.clear()
+            labels = restapis.analyze_reviews_sentiments(["b", "a", "a"])
+        self.assertEqual(labels, ["SENT_NEUTRAL"] * 3)
+        self.assertEqual(analyze.call_count, 2)
+
+    def test_local_backend_scores_without_the_sentiment_service(self):
+        texts = ["Great, friendly staff", "Not good at all, rude", "A blue car", ""]
+        backend = "djangoapp.sentiment.LexiconSentimentBackend"
+        with self.settings(SENTIMENT_BACKEND=backend), mock.patch.object(
+            restapis, "get_session"
+        ) as session:
+            labels = restapis.analyze_reviews_sentiments(texts)
+            async_labels = asyncio.run(restapis.async_analyze_reviews_sentiments(texts))
+        self.assertEqual(
+            labels, ["SENT_POSITIVE", "SENT_NEGATIVE", "SENT_NEUTRAL", "SENT_NEUTRAL"]
+        )
+        self.assertEqual(async_labels, labels)
+        session.assert_not_called()
+
+    def test_local_backend_scores_a_batch_as_each_text_alone(self):
+        backend = sentiment.LexiconSentimentBackend()
+        texts = ["It wasn't good", "Great—friendly staff", "not", "great", None]
+        scores = backend.scores(texts)
+        self.assertEqual(scores, [backend.score(text) for text in texts])
+        # The negation ending a text does not reach into the next one
+        self.assertLess(scores[0], 0)
+        self.assertGreater(scores[1], 0)
+        self.assertGreater(scores[3], 0)
+
+    def test_local_backend_scores_thousands_of_reviews_per_second(self):
+        backend = sentiment.LexiconSentimentBackend()
+        texts = ["Great, friendly staff, but the wait was not good at all"] * 5000
+        started = time.perf_counter()
+        backend.analyze_batch(texts)
+        self.assertLess(time.perf_counter() - started, 1)
+
+    def test_cancelled_async_call_releases_the_requests_sharing_it(self):
+        async def stuck(text):
+            await asyncio.sleep(10)
+
+        async def run():
+            running = set(restapis._sentiment_tasks)
+            waiter = restapis._start_async_sentiment("cancelled", "Great")
+            await asyncio.sleep(0.05)
+            for task in restapis._sentiment_tasks - running:
+                task.cancel()
+            return await asyncio.wait_for(waiter, 1)
+
+        with mock.patch.object(restapis, "async_analyze_review_sentiments", stuck):
+            self.assertIsNone(asyncio.run(run()))
+        self.assertNotIn("cancelled", restapis._sentiment_inflight)
+
+    def test_command_rescores_reviews_with_the_local_backend(self):
+        reviews = [
+            dict(REVIEW, id=1, review="Great, friendly staff"),
+            dict(REVIEW, id=2, review="Rude and pushy", sentiment="SENT_POSITIVE"),
+            dict(REVIEW, id=3, review="A blue car", sentiment="SENT_NEUTRAL"),
+        ]
+        reviews[2]["sentiment_model"] = "lexicon-%d" % len(sentiment.LEXICON)
+        service = mock.Mock()
+        service.post_bulk_docs.side_effect = lambda db, bulk_docs: mock.Mock(
+            get_result=mock.Mock(return_value=[{"ok": True}] * len(bulk_docs.docs))
+        )
+        backend = "djangoapp.sentiment.LexiconSentimentBackend"
+        out = io.StringIO()
+        with LocalServices(LocalStore([DEALER], reviews)) as services, self.settings(
+            SENTIMENT_BACKEND=backend, **services.urls()
+        ), mock.patch.object(
+            indexes, "get_cloudant_service", return_value=service
+        ), mock.patch.object(restapis, "analyze_review_sentiments") as remote:
+            call_command("rescore_sentiment", "--rescore", stdout=out)
+        remote.assert_not_called()
+        docs = service.post_bulk_docs.call_args.kwargs["bulk_docs"].docs
+        self.assertEqual(
+            [(doc.to_dict()["id"], doc.to_dict()["sentiment"]) for doc in docs],
+            [(1, "SENT_POSITIVE"), (2, "SENT_NEGATIVE")],
+        )
+        self.assertIn("Scored 2 reviews", out.getvalue())
+
+    def test_cache_key_depends_on_model(self):
+        self.assertNotEqual(
+            restapis.sentiment_cache_key("great", "model-a"),
+            restapis.sentiment_cache_key("great", "model-b"),
+        )
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        restapis.sentiment_cache.local.clear()
+        restapis.sentiment_breaker.reset()
+        cache.clear()
+
+    def test_breaker_opens_on_failure_rate_and_probes(self):
+        breaker = CircuitBreaker(
+            "test", failure_rate=0.5, window=4, min_calls=4, reset_timeout=0.2
+        )
+        for success in (True, False, True, False):
+            self.assertTrue(breaker.allow())
+            breaker.record_success() if success else breaker.record_failure()
+        self.assertEqual(breaker.state, circuitbreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        time.sleep(0.25)
+        self.assertEqual(breaker.state, circuitbreaker.HALF_OPEN)
+        probes = [breaker.allow() for _ in range(4)]
+        self.assertEqual(probes, [True, True, True, False])
+        for _ in range(3):
+            breaker.record_success()
+        self.assertEqual(breaker.state, circuitbreaker.CLOSED)
+
+    def test_slow_calls_count_as_failures(self):
+        breaker = CircuitBreaker("test", min_calls=2, window=2, slow_call=0.1)
+        breaker.record_success(0.05)
+        breaker.record_success(0.5)
+        self.assertEqual(breaker.state, circuitbreaker.OPEN)
+
+    def test_failing_sentiment_service_is_skipped(self):
+        session = mock.Mock()
+        session.post.return_value = mock.Mock(status_code=503, content=b"")
+        texts = [f"review {index}" for index in range(30)]
+        with mock.patch.object(restapis, "get_session", return_value=session):
+            first = restapis.analyze_reviews_sentiments(texts)
+            calls = session.post.call_count
+            started = time.monotonic()
+            second = restapis.analyze_reviews_sentiments(texts)
+        self.assertEqual(first + second, [restapis.SENTIMENT_UNKNOWN] * 60)
+        self.assertLess(calls, len(texts))
+        self.assertEqual(session.post.call_count, calls)
+        self.assertLess(time.monotonic() - started, 0.1)
+        self.assertIn(
+            'circuit_breaker_state{breaker="sentiment",state="open"} 1',
+            metrics.render(),
+        )
+
+    def test_unexpected_status_is_not_an_error(self):
+        session = mock.Mock()
+        session.post.return_value = mock.Mock(status_code=400, content=b"")
+        with mock.patch.object(restapis, "get_session", return_value=session):
+            self.assertIsNone(restapis.analyze_review_sentiments("great"))
+        self.assertEqual(restapis.sentiment_breaker.state, circuitbreaker.CLOSED)
+
+
+REVIEW = {
+    "id": 1,
+    "name": "Berkly Shepley",
+    "dealership": 1,
+    "review": "Total grid-enabled service-desk",
+    "purchase": True,
+    "purchase_date": "07/11/2020",
+    "car_make": "Audi",
+    "car_model": "A6",
+    "car_year": 2010,
+}
+
+
+class DealerReviewsTests(SimpleTestCase):
+    def test_review_pages_are_fetched_lazily(self):
+        pages = [
+            {"docs": [dict(REVIEW, id=1), dict(REVIEW, id=2)], "bookmark": "b1"},
+            {"docs": [dict(REVIEW, id=3), dict(REVIEW, id=4)], "bookmark": "b2"},
+            {"docs": [dict(REVIEW, id=5)], "bookmark": "b3"},
+        ]
+        with self.settings(REVIEWS_PAGE_SIZE=2), mock.patch.object(
+            restapis, "get_request", side_effect=pages
+        ) as get, mock.patch.object(
+            restapis, "analyze_reviews_sentiments", side_effect=lambda t: ["x"] * len(t)
+        ):
+            reviews = restapis.get_dealer_reviews_from_cf("http://reviews", 1, limit=3)
+            self.assertEqual([review.id for review in reviews], [1, 2, 3])
+            self.assertEqual(get.call_count, 2)
+            self.assertEqual(
+                get.call_args[1]["params"], {"id": 1, "limit": 2, "bookmark": "b1"}
+            )
+            pages = list(restapis.iter_dealer_review_pages_from_cf("http://reviews", 1))
+        self.assertEqual([len(page) for page in pages], [1])
+
+    def test_stored_sentiment_is_not_recomputed(self):
+        scored = dict(REVIEW, sentiment="SENT_NEGATIVE", score=0.9)
+        unscored = dict(REVIEW, id=2, review="Expanded global groupware")
+        routes = {"/api/get_reviews": [scored, unscored]}
+        with StubUpstream(routes) as upstream, mock.patch.object(
+            restapis, "analyze_reviews_sentiments", return_value=["SENT_POSITIVE"]
+        ) as analyze:
+            reviews = restapis.get_dealer_reviews_from_cf(
+                upstream.url + "/api/get_reviews", id=1
+            )
+        analyze.assert_called_once_with(["Expanded global groupware"])
+        self.assertEqual(
+            [review.sentiment for review in reviews], ["SENT_NEGATIVE", "SENT_POSITIVE"]
+        )
+
+
+    def test_records_keep_only_their_fields(self):
+        doc = dict(REVIEW, _id="review-1", _rev="1-a", score=0.9)
+        review = DealerReview.from_dict(doc)
+        self.assertEqual(review.car_model, "A6")
+        self.assertEqual(review.sentiment, "")
+        self.assertFalse(hasattr(review, "__dict__"))
+        self.assertEqual(CarDealer.from_dict(DEALER).full_name, DEALER["full_name"])
+
+        batch = DealerReviewBatch.from_dicts(
+            [doc, dict(REVIEW, id=2, sentiment="SENT_POSITIVE")]
+        )
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(batch.unscored(), [0])
+        self.assertEqual([review.id for review in batch], [1, 2])
+        self.assertEqual(batch[1].sentiment, "SENT_POSITIVE")
+
+
+class ReadThroughCacheTests(SimpleTestCase):
+    def test_concurrent_misses_share_one_load(self):
+        cache = ReadThroughCache("test", maxsize=10, ttl=60, stale_ttl=60)
+        calls = []
+
+        def loader():
+            calls.append(1)
+            time.sleep(0.2)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get("k", loader)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_stale_entry_is_served_while_refreshing(self):
+        cache = ReadThroughCache("test", maxsize=10, ttl=0, stale_ttl=60)
+        refreshed = threading.Event()
+        cache.get("k", lambda: "old")
+
+        def loader():
+            refreshed.set()
+            return "new"
+
+        self.assertEqual(cache.get("k", loader), "old")
+        self.assertTrue(refreshed.wait(1))
+        time.sleep(0.05)
+        self.assertEqual(cache.get("k", lambda: None), "new")
+
+    def test_failed_loads_are_not_cached(self):
+        cache = ReadThroughCache("test", maxsize=10, ttl=60, stale_ttl=60)
+        self.assertIsNone(cache.get("k", lambda: None))
+        self.assertEqual(cache.get("k", lambda: "value"), "value")
+
+    def test_invalidation_during_a_load_is_not_undone(self):
+        cache = ReadThroughCache("test", maxsize=10, ttl=60, stale_ttl=60)
+
+        def loader():
+            # Read before the upstream changed, then invalidated
+            cache.invalidate("k")
+            return "old"
+
+        self.assertEqual(cache.get("k", loader), "old")
+        self.assertEqual(cache.get("k", lambda: "new"), "new")
+
+    def test_cancelled_load_releases_the_callers_sharing_it(self):
+        cache = ReadThroughCache("test", maxsize=10, ttl=60, stale_ttl=60)
+
+        async def stuck():
+            await asyncio.sleep(10)
+            return "value"
+
+        async def run():
+            leader = asyncio.ensure_future(cache.aget("k", stuck))
+            await asyncio.sleep(0)
+            waiter = asyncio.ensure_future(cache.aget("k", stuck))
+            await asyncio.sleep(0.05)
+            leader.cancel()
+            return await asyncio.wait_for(waiter, 1)
+
+        self.assertIsNone(asyncio.run(run()))
+
+    def test_cancelled_caller_does_not_cancel_the_shared_load(self):
+        cache = ReadThroughCache("test", maxsize=10, ttl=60, stale_ttl=60)
+
+        async def slow():
+            await asyncio.sleep(0.1)
+            return "value"
+
+        async def run():
+            leader = asyncio.ensure_future(cache.aget("k", slow))
+            await asyncio.sleep(0)
+            waiter = asyncio.ensure_future(cache.aget("k", slow))
+            await asyncio.sleep(0.05)
+            waiter.cancel()
+            return await leader
+
+        self.assertEqual(asyncio.run(run()), "value")
+
+    def test_threads_waiting_on_a_load_give_up_after_the_timeout(self):
+        cache = ReadThroughCache(
+            "test", maxsize=10, ttl=60, stale_ttl=60, wait_timeout=0.1
+        )
+        started = threading.Event()
+
+        def stuck():
+            started.set()
+            time.sleep(0.5)
+            return "value"
+
+        leader = threading.Thread(target=cache.get, args=("k", stuck))
+        leader.start()
+        started.wait(1)
+        self.assertIsNone(cache.get("k", stuck))
+        leader.join()
+
+
+class DealerCacheTests(SimpleTestCase):
+    def setUp(self):
+        restapis.invalidate_dealers()
+
+    def test_dealer_lookups_are_cached_until_invalidated(self):
+        with StubUpstream({"/dealerships/get": [DEALER]}) as upstream:
+            url = upstream.url + "/dealerships/get"
+            for _ in range(3):
+                dealer = restapis.get_dealer_by_id_from_cf(url, id=1)
+            self.assertEqual(restapis.get_pool_stats()[upstream.url]["requests"], 1)
+            restapis.invalidate_dealers(id=1)
+            restapis.get_dealer_by_id_from_cf(url, id=1)
+            self.assertEqual(restapis.get_pool_stats()[upstream.url]["requests"], 2)
+        self.assertEqual(dealer.full_name, DEALER["full_name"])
+
+
+def _slow_dealer(url, id):
+    time.sleep(0.3)
+    return CarDealer(**DEALER)
+
+
+def _slow_reviews(url, id):
+    time.sleep(0.3)
+    return [DealerReview(**REVIEW)]
+
+
+class DealerDetailsViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch("djangoapp.views.get_dealer_reviews_from_cf", _slow_reviews)
+    @mock.patch("djangoapp.views.get_dealer_by_id_from_cf", _slow_dealer)
+    def test_dealer_and_reviews_are_fetched_concurrently(self):
+        started = time.monotonic()
+        response = self.client.get(reverse("djangoapp:dealer_details", args=[1]))
+        self.assertLess(time.monotonic() - started, 0.55)
+        self.assertContains(response, DEALER["full_name"])
+        self.assertContains(response, REVIEW["review"])
+
+    @mock.patch("djangoapp.views.get_dealer_by_id_from_cf", _slow_dealer)
+    def test_reviews_past_the_deadline_are_dropped(self):
+        def stuck_reviews(url, id):
+            time.sleep(1)
+            return [DealerReview(**REVIEW)]
+
+        with mock.patch("djangoapp.views.get_dealer_reviews_from_cf", stuck_reviews):
+            with self.settings(DEALER_DETAILS_DEADLINE=0.5):
+                response = self.client.get(
+                    reverse("djangoapp:dealer_details", args=[1])
+                )
+        self.assertContains(response, DEALER["full_name"])
+        self.assertNotContains(response, REVIEW["review"])
+
+
+class AsyncClientTests(SimpleTestCase):
+    def setUp(self):
+        restapis.invalidate_dealers()
+        cache.clear()
+
+    def test_async_fetches_share_the_dealer_cache(self):
+        scored = dict(REVIEW, sentiment="SENT_POSITIVE")
+        routes = {"/dealerships/get": [DEALER], "/api/get_reviews": [scored]}
+
+        async def fetch(url):
+            return await restapis.async_fetch_concurrently(
+                restapis.async_get_dealer_by_id_from_cf(url + "/dealerships/get", 1),
+                restapis.async_get_dealer_reviews_from_cf(url + "/api/get_reviews", 1),
+            )
+
+        with StubUpstream(routes) as upstream:
+            dealer, reviews = asyncio.run(fetch(upstream.url))
+            cached = restapis.get_dealer_by_id_from_cf(
+                upstream.url + "/dealerships/get", id=1
+            )
+        self.assertEqual(dealer.full_name, DEALER["full_name"])
+        self.assertIs(cached, dealer)
+        self.assertEqual(reviews[0].sentiment, "SENT_POSITIVE")
+
+    def test_async_dealer_details_view(self):
+        async def dealer(url, id):
+            await asyncio.sleep(0.3)
+            return CarDealer(**DEALER)
+
+        async def reviews(url, id):
+            await asyncio.sleep(0.3)
+            return [DealerReview(**REVIEW)]
+
+        request = AsyncRequestFactory().get("/djangoapp/dealer/1/")
+        with mock.patch.object(
+            views, "async_get_dealer_by_id_from_cf", dealer
+        ), mock.patch.object(views, "async_get_dealer_reviews_from_cf", reviews):
+            started = time.monotonic()
+            response = asyncio.run(views.get_dealer_details_async(request, 1))
+        self.assertLess(time.monotonic() - started, 0.55)
+        self.assertContains(response, REVIEW["review"])
+
+
+class DealerPaginationTests(SimpleTestCase):
+    def setUp(self):
+        restapis.invalidate_dealers()
+        cache.clear()
+
+    def test_full_page_returns_next_bookmark(self):
+        page = {"docs": [DEALER, dict(DEALER, id=2)], "bookmark": "g1AAAA"}
+        with mock.patch.object(restapis, "get_request", return_value=page) as get:
+            dealers, bookmark = restapis.get_dealers_page_from_cf(
+                "http://dealers", state="Texas", limit=2
+            )
+        get.assert_called_once_with(
+            "http://dealers", params={"limit": 2, "state": "Texas"}
+        )
+        self.assertEqual([dealer.id for dealer in dealers], [1, 2])
+        self.assertEqual(bookmark, "g1AAAA")
+
+    def test_short_page_is_the_last_one(self):
+        page = {"docs": [DEALER], "bookmark": "g1AAAA"}
+        with mock.patch.object(restapis, "get_request", return_value=page):
+            dealers, bookmark = restapis.get_dealers_page_from_cf(
+                "http://dealers", limit=2, bookmark="g1AAAA"
+            )
+        self.assertEqual(len(dealers), 1)
+        self.assertIsNone(bookmark)
+
+    def test_page_size_is_bounded(self):
+        with mock.patch.object(restapis, "get_request", return_value=None) as get:
+            restapis.get_dealers_page_from_cf("http://dealers", limit=10 ** 6)
+        self.assertEqual(get.call_args[1]["params"]["limit"], 200)
+
+    @mock.patch(
+        "djangoapp.views.get_dealer_stats_from_cf",
+        return_value={1: DealerStats(1, 4, 3, {"positive": 2, "negative": 1})},
+    )
+    @mock.patch(
+        "djangoapp.views.get_dealers_page_from_cf",
+        return_value=([CarDealer(**DEALER)], "g1AAAA"),
+    )
+    def test_index_links_to_the_next_page(self, get_page, get_stats):
+        response = self.client.get(reverse("djangoapp:index"), {"state": "Texas"})
+        get_page.assert_called_once_with(
+            mock.ANY, state="Texas", bookmark=None
+        )
+        get_stats.assert_called_once_with(mock.ANY, [1])
+        self.assertContains(response, DEALER["full_name"])
+        self.assertContains(response, "75%")
+        self.assertContains(response, "2 / 0 / 1")
+        self.assertContains(response, "?bookmark=g1AAAA&amp;state=Texas")
+        self.assertNotContains(response, ">First<")
+
+
+class GeoIndexTests(SimpleTestCase):
+    def setUp(self):
+        restapis.invalidate_dealers()
+
+    def test_index_matches_a_linear_scan(self):
+        rng = random.Random(0)
+        dealers = [
+            CarDealer(**dict(DEALER, id=id, lat=rng.uniform(-60, 70), long=long))
+            for id, long in enumerate(rng.uniform(-180, 180) for _ in range(500))
+        ]
+        index = geo.GeoIndex(dealers, cell_degrees=2)
+        for lat, long in [(32.7, -96.8), (-33.9, 151.2), (0, 179.9), (89, 0)]:
+            distances = sorted(
+                (geo.haversine_km(lat, long, d.lat, d.long), d.id) for d in dealers
+            )
+            nearest = index.nearest(lat, long, k=5)
+            self.assertEqual(
+                [dealer.id for _, dealer in nearest], [id for _, id in distances[:5]]
+            )
+            within = index.within(lat, long, 2000)
+            self.assertEqual(
+                [dealer.id for _, dealer in within],
+                [id for distance, id in distances if distance <= 2000],
+            )
+
+    def test_view_returns_the_nearest_dealers(self):
+        store = LocalStore.from_sample_data()
+        with LocalServices(store) as services, self.settings(**services.urls()):
+            url = reverse("djangoapp:dealers_near")
+            response = self.client.get(url, {"lat": 32.7, "long": -96.8, "k": 3})
+            self.assertEqual(self.client.get(url, {"lat": "x"}).status_code, 400)
+        dealers = response.json()["dealers"]
+        self.assertEqual(len(dealers), 3)
+        distances = [dealer["distance_km"] for dealer in dealers]
+        self.assertEqual(distances, sorted(distances))
+        nearest = min(
+            store.dealers,
+            key=lambda d: geo.haversine_km(32.7, -96.8, d["lat"], d["long"]),
+        )
+        self.assertEqual(dealers[0]["id"], nearest["id"])
+
+
+class ReviewSearchTests(SimpleTestCase):
+    def setUp(self):
+        self.index = search.ReviewIndex()
+        reviews = [
+            ("a", "Great service, great price", "Audi", True),
+            ("b", "Great car", "Audi", False),
+            ("c", "Slow service", "BMW", True),
+            ("d", "Rude staff and a broken car", "BMW", False),
+        ]
+        for key, text, make, purchase in reviews:
+            self.index.add(
+                key, dict(REVIEW, review=text, car_make=make, purchase=purchase)
+            )
+
+    def tearDown(self):
+        search._index = None
+        search._index_mtime = None
+
+    def test_search_ranks_and_counts_facets(self):
+        result = self.index.search("great service")
+        texts = [doc["review"] for _, doc in result["hits"]]
+        self.assertEqual(result["total"], 3)
+        self.assertEqual(texts[0], "Great service, great price")
+        self.assertEqual(dict(result["facets"]["car_make"]), {"Audi": 2, "BMW": 1})
+
+        result = self.index.search("service", {"car_make": "bmw"})
+        self.assertEqual([doc["review"] for _, doc in result["hits"]], ["Slow service"])
+        result = self.index.search("", {"purchase": True}, offset=1, limit=1)
+        self.assertEqual(result["total"], 2)
+        self.assertEqual(
+            [doc["review"] for _, doc in result["hits"]],
+            ["Great service, great price"],
+        )
+
+    def test_changes_replace_and_remove_reviews(self):
+        self.index.search("great")
+        self.index.apply_changes(
+            [
+                {"id": "b", "doc": dict(REVIEW, review="Terrible car")},
+                {"id": "a", "deleted": True},
+            ]
+        )
+        self.assertEqual(self.index.search("great")["total"], 0)
+        result = self.index.search("car")
+        self.assertEqual(
+            sorted(doc["review"] for _, doc in result["hits"]),
+            ["Rude staff and a broken car", "Terrible car"],
+        )
+        self.assertEqual(len(self.index), 3)
+
+    def test_update_stops_when_the_feed_does_not_advance(self):
+        self.index.since = "4"
+        page = {"results": [], "last_seq": "4", "pending": True}
+        with mock.patch.object(
+            search, "get_review_changes_from_cf", return_value=page
+        ) as changes:
+            self.assertEqual(search.update_index(self.index, "changes-url"), 0)
+        changes.assert_called_once()
+
+    def test_view_searches_the_built_index(self):
+        store = LocalStore.from_sample_data()
+        with tempfile.TemporaryDirectory() as directory, LocalServices(
+            store
+        ) as services, self.settings(
+            **services.urls(),
+            REVIEW_SEARCH_INDEX_PATH=f"{directory}/index.pickle",
+            REVIEW_SEARCH_RELOAD_INTERVAL=0,
+        ):
+            call_command("build_review_index", stdout=io.StringIO())
+            store.add_review(dict(REVIEW, review="Zyzzyva dealership"))
+            call_command("update_review_index", stdout=io.StringIO())
+            url = reverse("djangoapp:search_reviews")
+            response = self.client.get(url, {"q": "zyzzyva"})
+            self.assertEqual(self.client.get(url).status_code, 400)
+            total = self.client.get(url, {"purchase": "true"}).json()["total"]
+        results = response.json()["results"]
+        self.assertEqual(
+            [review["review"] for review in results], ["Zyzzyva dealership"]
+        )
+        purchased = [review for review in store.review_log if review["purchase"]]
+        self.assertEqual(total, len(purchased))
+
+
+class ReviewEnrichmentTests(TestCase):
+    def setUp(self):
+        enrichment.enrichment_cache.local.clear()
+        cache.clear()
+        enrichment.reset_nlu_client()
+        self.addCleanup(enrichment.reset_nlu_client)
+
+    def test_reviews_are_enriched_once_with_a_shared_token(self):
+        texts = ["Great service at Audi, great price", "Slow service", "Slow service"]
+        with LocalServices(LocalStore([], [])) as services, self.settings(
+            **services.urls(), NLU_API_KEY="local-key"
+        ):
+            first = enrichment.enrich_reviews(texts)
+            second = enrichment.enrich_reviews(texts[:1] + ["Rude staff"])
+            enrichment.enrichment_cache.local.clear()
+            cache.clear()
+            with mock.patch.object(enrichment, "analyze_review_text") as analyze:
+                stored = enrichment.enrich_reviews(texts)
+            tokens_issued = services.server.tokens_issued
+        self.assertEqual(first[0]["keywords"][0], {"text": "great", "relevance": 0.4})
+        self.assertEqual(first[0]["entities"][0]["text"], "Audi")
+        self.assertEqual(first[0]["emotion"]["joy"], 0.5)
+        self.assertEqual(second[0], first[0])
+        self.assertEqual(stored, first)
+        analyze.assert_not_called()
+        self.assertEqual(ReviewEnrichment.objects.count(), 3)
+        self.assertEqual(tokens_issued, 1)
+
+    def test_command_enriches_every_review(self):
+        reviews = [dict(REVIEW, id=id, review=f"Review {id}") for id in range(5)]
+        store = LocalStore([], reviews)
+        store.add_review(dict(REVIEW, review=" "))
+        out = io.StringIO()
+        with LocalServices(store) as services, self.settings(**services.urls()):
+            call_command("enrich_reviews", "--batch-size", "2", stdout=out)
+        self.assertIn("Enriched 5 reviews, 1 failed", out.getvalue())
+        self.assertEqual(ReviewEnrichment.objects.count(), 5)
+
+    @mock.patch(
+        "djangoapp.views.get_dealer_reviews_from_cf",
+        return_value=[DealerReview(**REVIEW)],
+    )
+    @mock.patch(
+        "djangoapp.views.get_dealer_by_id_from_cf",
+        return_value=CarDealer(**DEALER),
+    )
+    def test_dealer_details_show_stored_enrichments(self, *_):
+        ReviewEnrichment.objects.create(
+            key=enrichment.enrichment_key(REVIEW["review"]),
+            keywords=[{"text": "service-desk", "relevance": 0.9}],
+            entities=[{"type": "Company", "text": "Audi", "relevance": 0.8}],
+            emotion={"joy": 0.7},
+        )
+        with mock.patch.object(enrichment, "analyze_review_text") as analyze:
+            response = self.client.get(reverse("djangoapp:dealer_details", args=[1]))
+        analyze.assert_not_called()
+        self.assertContains(response, ">service-desk</span>")
+        self.assertContains(response, ">Audi</span")
+        self.assertContains(response, "joy 0.70")
+
+
+class CloudantIndexesTests(SimpleTestCase):
+    def _service(self, used_index):
+        service = mock.Mock()
+        service.post_index.return_value.get_result.return_value = {"result": "created"}
+        service.get_design_document.side_effect = ApiException(404, message="Not found")
+        service.post_explain.return_value.get_result.side_effect = lambda: {
+            "index": {"name": used_index}
+        }
+        return service
+
+    def test_command_creates_and_verifies_indexes(self):
+        service = self._service("unused")
+        service.post_explain.return_value.get_result.side_effect = [
+            {"index": {"name": expected}} for _, _, _, expected in indexes.QUERIES
+        ]
+        out = io.StringIO()
+        with mock.patch.object(indexes, "get_cloudant_service", return_value=service):
+            call_command("ensure_cloudant_indexes", stdout=out)
+        self.assertEqual(service.post_index.call_count, 4)
+        service.put_design_document.assert_called_once()
+        self.assertIn("All queries use their index", out.getvalue())
+
+    def test_command_fails_when_a_query_scans(self):
+        service = self._service("_all_docs")
+        with mock.patch.object(indexes, "get_cloudant_service", return_value=service):
+            with self.assertRaises(CommandError):
+                call_command("ensure_cloudant_indexes", stdout=io.StringIO())
+
+    def test_missing_indexes_are_reported(self):
+        service = mock.Mock()
+        service.get_indexes_information.return_value.get_result.return_value = {
+            "indexes": [
+                {"name": "_all_docs", "type": "special"},
+                {"name": "id-index", "type": "json"},
+                {"name": "dealership-index", "type": "json"},
+            ]
+        }
+        service.get_design_document.side_effect = ApiException(404, message="Not found")
+        self.assertEqual(
+            indexes.missing_indexes(service),
+            [
+                ("dealerships", "state-index"),
+                ("reviews", "dealership-time-index"),
+                ("reviews", "_design/djangoapp-stats"),
+            ],
+        )
+
+    def test_queries_sort_every_field_the_same_way(self):
+        # Cloudant rejects sorts mixing directions (unsupported_mixed_sort)
+        for _, _, sort, _ in indexes.QUERIES:
+            directions = {
+                direction for field in sort or [] for direction in field.values()
+            }
+            self.assertLessEqual(len(directions), 1, sort)
+
+    def test_indexes_are_checked_by_the_web_server_only(self):
+        with self.settings(CLOUDANT_CHECK_INDEXES=True), mock.patch.object(
+            indexes, "warn_missing_indexes"
+        ) as warn:
+            apps.get_app_config("djangoapp").ready()
+            warn.assert_not_called()
+            indexes.start_index_check()
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline and not warn.called:
+                time.sleep(0.01)
+        warn.assert_called_once()
+
+    def test_check_fails_when_the_stats_view_is_outdated(self):
+        service = mock.Mock()
+        service.get_indexes_information.return_value.get_result.side_effect = [
+            {"indexes": [{"name": name, "type": "json"} for name, _ in declared]}
+            for declared in indexes.INDEXES.values()
+        ]
+        service.get_design_document.return_value.get_result.return_value = {
+            "_rev": "1-a",
+            "views": {},
+        }
+        with mock.patch.object(indexes, "get_cloudant_service", return_value=service):
+            with self.assertRaises(CommandError):
+                call_command(
+                    "ensure_cloudant_indexes", "--check", stdout=io.StringIO()
+                )
+
+
+class LocalServicesTests(SimpleTestCase):
+    def setUp(self):
+        restapis.invalidate_dealers()
+
+    def test_store_indexes_sample_data(self):
+        store = LocalStore.from_sample_data()
+        texas = store.find_dealers(state="Texas")
+        self.assertTrue(texas)
+        self.assertTrue(all(dealer["state"] == "Texas" for dealer in texas))
+        self.assertEqual(store.find_dealers(id=1)[0]["full_name"], DEALER["full_name"])
+
+    def test_generated_data_is_deterministic(self):
+        vocabulary = datagen.Vocabulary()
+        reviews = list(datagen.generate_reviews(200, 20, seed=1, vocabulary=vocabulary))
+        again = list(datagen.generate_reviews(200, 20, seed=1, vocabulary=vocabulary))
+        store = LocalStore(datagen.generate_dealers(20, vocabulary=vocabulary), reviews)
+        self.assertEqual(reviews, again)
+        self.assertEqual(len(store.dealers_by_id), 20)
+        self.assertEqual(store.review_count, 200)
+        self.assertTrue(set(store.reviews_by_dealership) <= set(store.dealers_by_id))
+        for review in reviews:
+            self.assertTrue(all(field in review for field in REQUIRED_REVIEW_FIELDS))
+
+    def test_services_follow_the_upstream_contracts(self):
+        store = LocalStore([dict(DEALER, id=id) for id in range(1, 6)], [REVIEW])
+        with LocalServices(store) as services:
+            urls = services.urls()
+            dealers, bookmark = restapis.get_dealers_page_from_cf(
+                urls["DEALERSHIPS_API_URL"], limit=3
+            )
+            rest, last = restapis.get_dealers_page_from_cf(
+                urls["DEALERSHIPS_API_URL"], limit=3, bookmark=bookmark
+            )
+            response = restapis.post_request(
+                urls["POST_REVIEW_API_URL"], {"review": dict(REVIEW, id=2)}, id=1
+            )
+            invalid = restapis.post_request(urls["POST_REVIEW_API_URL"], {"id": 3})
+            reviews = restapis.get_request(urls["REVIEWS_API_URL"], params={"id": 1})
+            bad_id = restapis.get_session().get(
+                urls["DEALERSHIPS_API_URL"], params={"id": "abc"}
+            )
+        self.assertEqual([dealer.id for dealer in dealers + rest], [1, 2, 3, 4, 5])
+        self.assertEqual(bad_id.status_code, 400)
+        self.assertIsNone(last)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(invalid.status_code, 400)
+        self.assertEqual([review["id"] for review in reviews], [1, 2])
+
+
+class MetricsViewTests(TestCase):
+    def test_metrics_exposes_pool_counters(self):
+        with StubUpstream({"/dealerships/get": [DEALER]}) as upstream:
+            restapis.get_request(upstream.url + "/dealerships/get")
+            response = self.client.get(reverse("djangoapp:metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"restapis_pool_reused_total", response.content)
+
+    def test_histograms_are_rendered_cumulatively(self):
+        histogram = metrics.Histogram("test_duration_seconds", "Test.", buckets=(1, 2))
+        for value in (0.5, 1.5, 3):
+            histogram.observe(value, upstream="test")
+        text = metrics.render()
+        self.assertEqual(text.count("# TYPE test_duration_seconds histogram"), 1)
+        self.assertIn('test_duration_seconds_bucket{le="2",upstream="test"} 2', text)
+        self.assertIn('test_duration_seconds_bucket{le="+Inf",upstream="test"} 3', text)
+        self.assertIn('test_duration_seconds_count{upstream="test"} 3', text)
+
+
+class UpstreamTimingTests(TestCase):
+    def setUp(self):
+        restapis.invalidate_dealers()
+        restapis.sentiment_cache.local.clear()
+        restapis.sentiment_breaker.reset()
+        cache.clear()
+
+    def test_dealer_details_report_time_per_upstream(self):
+        store = LocalStore([DEALER], [REVIEW])
+        with LocalServices(store) as services, self.settings(**services.urls()):
+            response = self.client.get(reverse("djangoapp:dealer_details", args=[1]))
+        header = response["Server-Timing"]
+        for upstream in ("dealerships", "reviews", "sentiment", "total"):
+            self.assertIn(f"{upstream};dur=", header)
+        self.assertIn("1 calls", header)
+        self.assertIn("upstream_request_duration_seconds_bucket", metrics.render())
+
+    def test_failed_calls_are_recorded_as_errors(self):
+        timings, token = timing.start_request()
+        try:
+            restapis.get_request("http://127.0.0.1:9/unreachable")
+        finally:
+            timing.finish_request(timings, token)
+        self.assertEqual(timings.snapshot()["127.0.0.1:9"]["statuses"], {"error": 1})
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        restapis.invalidate_dealers()
+        restapis.conditional_cache.clear()
+        cache.clear()
+
+    def test_upstream_answers_are_revalidated(self):
+        store = LocalStore([DEALER], [REVIEW])
+        with LocalServices(store) as services, self.settings(**services.urls()):
+            url = services.urls()["REVIEWS_API_URL"]
+            timings, token = timing.start_request()
+            try:
+                first = restapis.get_request(url, params={"id": 1})
+                second = restapis.get_request(url, params={"id": 1})
+                store.add_review(dict(REVIEW, name="Another reviewer"))
+                third = restapis.get_request(url, params={"id": 1})
+            finally:
+                timing.finish_request(timings, token)
+        self.assertEqual(second, first)
+        self.assertEqual(len(third), 2)
+        statuses = timings.snapshot()["reviews"]["statuses"]
+        self.assertEqual(statuses, {"200": 2, "304": 1})
+
+    @mock.patch(
+        "djangoapp.views.get_dealer_stats_from_cf",
+        return_value={1: DealerStats(dealership=1)},
+    )
+    @mock.patch("djangoapp.views.get_dealers_page_from_cf")
+    def test_unchanged_pages_are_not_modified(self, get_page, _):
+        get_page.return_value = ([CarDealer(**DEALER)], None)
+        url = reverse("djangoapp:index")
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertIn("private", response["Cache-Control"])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # The page shows who is logged in
+        user = User.objects.create_user("jdoe", password="secret", first_name="J")
+        self.client.force_login(user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        get_page.return_value = ([CarDealer(**dict(DEALER, city="Austin"))], None)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertContains(response, "Austin")
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        make = CarMake.objects.create(name="Audi", description="German")
+        self.car = CarModel.objects.create(
+            car_make=make, name="A6", dealer_id=1, type="Sedan"
+        )
+        self.client.force_login(User.objects.create_user("berkly", password="x"))
+
+    @mock.patch("djangoapp.views.get_dealer_reviews_from_cf")
+    @mock.patch(
+        "djangoapp.views.get_dealer_by_id_from_cf",
+        return_value=CarDealer(**DEALER),
+    )
+    def test_repeat_views_are_served_from_the_fragment_cache(self, _, get_reviews):
+        get_reviews.return_value = [DealerReview(**REVIEW)]
+        url = reverse("djangoapp:dealer_details", args=[1])
+        first = self.client.get(url)
+        second = self.client.get(url)
+        self.assertEqual(get_reviews.call_count, 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+        # A submitted review replaces the cached reviews
+        get_reviews.return_value.append(
+            DealerReview(**dict(REVIEW, id=2, review="Another review"))
+        )
+        with mock.patch.object(restapis, "get_session"):
+            self.client.post(
+                reverse("djangoapp:add_review", args=[1]),
+                {
+                    "car": self.car.pk,
+                    "content": "Another review",
+                    "purchasedate": REVIEW["purchase_date"],
+                },
+            )
+        third = self.client.get(url)
+        self.assertEqual(get_reviews.call_count, 2)
+        self.assertContains(third, "Another review")
+        self.assertNotEqual(third["ETag"], first["ETag"])
+
+    @mock.patch(
+        "djangoapp.views.get_dealer_reviews_from_cf",
+        return_value=[DealerReview(**dict(REVIEW, sentiment="unknown"))],
+    )
+    @mock.patch(
+        "djangoapp.views.get_dealer_by_id_from_cf",
+        return_value=CarDealer(**DEALER),
+    )
+    def test_reviews_missing_a_sentiment_are_not_cached(self, _, get_reviews):
+        url = reverse("djangoapp:dealer_details", args=[1])
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(get_reviews.call_count, 2)
+        self.assertNotIn("ETag", response)
+
+    @mock.patch(
+        "djangoapp.views.get_dealer_stats_from_cf",
+        return_value={1: DealerStats(1, 4, 3, {"positive": 2, "negative": 1})},
+    )
+    @mock.patch(
+        "djangoapp.views.get_dealers_page_from_cf",
+        return_value=([CarDealer(**DEALER)], None),
+    )
+    def test_cached_dealer_rows_need_no_stats(self, _, get_stats):
+        for _ in range(2):
+            response = self.client.get(reverse("djangoapp:index"))
+            self.assertContains(response, "2 / 0 / 1")
+        get_stats.assert_called_once_with(mock.ANY, [1])
+
+    @mock.patch(
+        "djangoapp.views.get_dealer_reviews_from_cf",
+        return_value=[DealerReview(**REVIEW)],
+    )
+    @mock.patch(
+        "djangoapp.views.get_dealer_by_id_from_cf",
+        return_value=CarDealer(**DEALER),
+    )
+    def test_uncached_pages_are_revalidated(self, _, get_reviews):
+        url = reverse("djangoapp:dealer_details", args=[1])
+        with self.settings(DEALER_FRAGMENT_CACHE_TTL=0):
+            etag = self.client.get(url)["ETag"]
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+            get_reviews.return_value = [
+                DealerReview(**REVIEW),
+                DealerReview(**dict(REVIEW, id=2, review="Another review")),
+            ]
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, "Another review")
+
+    @mock.patch(
+        "djangoapp.views.get_dealer_stats_from_cf",
+        return_value={1: DealerStats(1, 4, 3, {"positive": 2, "negative": 1})},
+    )
+    @mock.patch(
+        "djangoapp.views.get_dealers_page_from_cf",
+        return_value=([CarDealer(**DEALER)], None),
+    )
+    def test_process_local_fragments_keep_no_versions(self, *_):
+        local = {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "fragments-test",
+        }
+        with self.settings(CACHES=dict(settings.CACHES, template_fragments=local)):
+            fragment_cache().clear()
+            self.assertFalse(versions_are_shared())
+            url = reverse("djangoapp:index")
+            etag = self.client.get(url)["ETag"]
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertIsNone(fragment_cache().get(VERSION_KEY % 1))
+
+
+class ReviewOutboxTests(TestCase):
+    def setUp(self):
+        make = CarMake.objects.create(name="Audi", description="German")
+        self.car = CarModel.objects.create(
+            car_make=make, name="A6", dealer_id=1, type="Sedan"
+        )
+        self.user = User.objects.create_user("berkly", password="secret")
+        self.client.force_login(self.user)
+
+    def _submit(self, token):
+        return self.client.post(
+            reverse("djangoapp:add_review", args=[1]),
+            {
+                "car": self.car.pk,
+                "content": REVIEW["review"],
+                "purchasedate": REVIEW["purchase_date"],
+                "idempotency_token": token,
+            },
+        )
+
+    def test_submissions_are_queued_once_per_form(self):
+        with mock.patch.object(restapis, "get_session") as get_session:
+            self.assertEqual(self._submit("form-1").status_code, 302)
+            self._submit("form-1")
+            self._submit("form-2")
+        get_session.assert_not_called()
+        self.assertEqual(ReviewOutbox.objects.count(), 2)
+
+    def test_dealer_stats_count_posted_reviews(self):
+        restapis.invalidate_dealer_stats()
+        store = LocalStore([DEALER], [dict(REVIEW, dealership=1, purchase=True)])
+        with LocalServices(store) as services, self.settings(**services.urls()):
+            url = services.urls()["DEALER_STATS_API_URL"]
+            stats = restapis.get_dealer_stats_from_cf(url, [1, 2])
+            self.assertEqual(stats[1].review_count, 1)
+            self.assertEqual(stats[2].review_count, 0)
+            self._submit("form-1")
+            outbox.drain_all()
+            stats = restapis.get_dealer_stats_from_cf(url, [1, 2])
+        self.assertEqual(stats[1].review_count, 2)
+        self.assertEqual(stats[1].purchase_ratio, 0.5)
+        self.assertIsNotNone(stats[1].latest_review_time)
+
+    def test_drain_posts_each_review_once(self):
+        self._submit("form-1")
+        store = LocalStore([DEALER])
+        with LocalServices(store) as services, self.settings(**services.urls()):
+            self.assertEqual(outbox.drain_all()["sent"], 1)
+            # A retry after a lost answer is accepted but not stored again
+            ReviewOutbox.objects.update(
+                status=ReviewOutbox.PENDING, next_attempt_at=timezone.now()
+            )
+            self.assertEqual(outbox.drain_all()["sent"], 1)
+        entry = ReviewOutbox.objects.get()
+        self.assertEqual(entry.status, ReviewOutbox.SENT)
+        self.assertEqual(entry.attempts, 2)
+        self.assertEqual(store.review_count, 1)
+        self.assertEqual(store.find_reviews(1)[0]["name"], "berkly")
+
+    def test_failed_posts_are_retried_with_backoff(self):
+        self._submit("form-1")
+        self._submit("form-2")
+        unavailable = mock.Mock(status_code=503, content=b"", text="")
+        with mock.patch.object(
+            outbox, "post_request", return_value=unavailable
+        ) as post, self.settings(POST_REVIEWS_BULK_API_URL=""):
+            self.assertEqual(outbox.drain_all(), {"sent": 0, "retry": 1, "failed": 0})
+            self.assertEqual(outbox.drain_all()["retry"], 0)
+        # The second review was postponed without being tried
+        self.assertEqual(post.call_count, 1)
+        entries = ReviewOutbox.objects.order_by("id")
+        self.assertEqual([entry.attempts for entry in entries], [1, 0])
+        self.assertTrue(all(e.status == ReviewOutbox.PENDING for e in entries))
+        self.assertTrue(all(e.next_attempt_at > timezone.now() for e in entries))
+
+        ReviewOutbox.objects.update(next_attempt_at=timezone.now())
+        created = mock.Mock(status_code=201)
+        with mock.patch.object(outbox, "post_request", return_value=created):
+            with self.settings(POST_REVIEWS_BULK_API_URL=""):
+                call_command("drain_review_outbox", stdout=io.StringIO())
+        self.assertEqual(
+            ReviewOutbox.objects.filter(status=ReviewOutbox.SENT).count(), 2
+        )
+
+    def test_batches_are_posted_in_one_request(self):
+        for token in ("form-1", "form-2", "form-3"):
+            self._submit(token)
+        invalid = ReviewOutbox.objects.order_by("id")[1]
+        invalid.payload = dict(invalid.payload)
+        del invalid.payload["car_year"]
+        invalid.save()
+        store = LocalStore([DEALER])
+        with LocalServices(store) as services, self.settings(**services.urls()):
+            with mock.patch.object(
+                outbox, "post_request", wraps=restapis.post_request
+            ) as post:
+                counts = outbox.drain_all()
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(counts, {"sent": 2, "retry": 0, "failed": 1})
+        self.assertEqual(store.review_count, 2)
+        self.assertIn(
+            "Missing required field: car_year",
+            ReviewOutbox.objects.get(pk=invalid.pk).last_error,
+        )
+
+    def test_rejected_reviews_are_not_retried(self):
+        self._submit("form-1")
+        rejected = mock.Mock(status_code=400, text="Missing required field: id")
+        with mock.patch.object(outbox, "post_request", return_value=rejected):
+            self.assertEqual(outbox.drain_all()["failed"], 1)
+        self.assertEqual(ReviewOutbox.objects.get().status, ReviewOutbox.FAILED)
+
+
+class ReviewOutboxStartupTests(TransactionTestCase):
+    def test_reviews_left_pending_are_drained_on_startup(self):
+        with self.settings(OUTBOX_DRAIN_IN_PROCESS=False):
+            outbox.enqueue_review(dict(REVIEW), "left-by-an-earlier-run")
+        store = LocalStore([DEALER])
+        with LocalServices(store) as services, self.settings(
+            OUTBOX_DRAIN_IN_PROCESS=True, **services.urls()
+        ):
+            # As djangobackend.wsgi and djangobackend.asgi do
+            outbox.wake_drainer()
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline and store.review_count < 1:
+                time.sleep(0.05)
+        self.assertEqual(store.review_count, 1)
+        entry = ReviewOutbox.objects.get()
+        self.assertEqual(entry.status, ReviewOutbox.SENT)
+
+
+    def test_app_startup_does_not_start_the_drainer(self):
+        with self.settings(OUTBOX_DRAIN_IN_PROCESS=True), mock.patch.object(
+            outbox, "get_drainer_wakeup"
+        ) as wakeup:
+            apps.get_app_config("djangoapp").ready()
+        wakeup.assert_not_called()
+
+
+class _FlakyTarget:
+    """Fails every write of a document with id fail_id."""
+
+    def __init__(self, fail_id=None):
+        self.fail_id = fail_id
+        self.written = []
+
+    def write(self, docs):
+        if any(doc["id"] == self.fail_id for doc in docs):
+            raise loader.LoadError("unavailable")
+        self.written.extend(doc["id"] for doc in docs)
+        return {"created": len(docs), "exists": 0, "errors": []}
+
+
+class LoaderTests(SimpleTestCase):
+    def test_documents_are_streamed_across_chunks(self):
+        docs = [dict(REVIEW, id=id, review="x" * id) for id in range(1, 40)]
+        wrapped = io.StringIO(json.dumps({"meta": {"reviews": 1}, "reviews": docs}))
+        bare = io.StringIO(json.dumps(docs, indent=2))
+        for f, key in ((wrapped, "reviews"), (bare, None)):
+            parsed = list(loader.iter_json_documents(f, key=key, chunk_size=16))
+            self.assertEqual(parsed, docs)
+
+    def test_failed_load_resumes_from_checkpoint(self):
+        docs = [{"id": id} for id in range(1, 101)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/checkpoint.json"
+            target = _FlakyTarget(fail_id=55)
+            with self.assertRaises(loader.LoadError):
+                loader.load(
+                    docs,
+                    target,
+                    batch_size=10,
+                    workers=1,
+                    checkpoint=loader.Checkpoint(path, "reviews"),
+                    retries=0,
+                )
+            checkpoint = loader.Checkpoint(path, "reviews")
+            self.assertEqual(checkpoint.done, 50)
+            target.fail_id = None
+            stats = loader.load(
+                docs, target, batch_size=10, workers=4, checkpoint=checkpoint
+            )
+        self.assertEqual(stats.skipped, 50)
+        self.assertEqual(stats.created, 50)
+        self.assertEqual(sorted(set(target.written)), list(range(1, 101)))
+
+    def test_command_loads_reviews_into_the_review_service(self):
+        store = LocalStore()
+        with LocalServices(store) as services, self.settings(**services.urls()):
+            for _ in range(2):
+                call_command(
+                    "load_data",
+                    "reviews",
+                    "--target",
+                    "http",
+                    "--batch-size",
+                    "7",
+                    stdout=io.StringIO(),
+                )
+        reviews = load_json_data("reviews-full.json", "reviews")
+        self.assertEqual(store.review_count, len(reviews))
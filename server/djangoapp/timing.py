@@ -0,0 +1,211 @@
+"""
+Timing of the upstream calls made while serving a request.
+
+Every call to an upstream service goes through `upstream_call`, which
+records its latency, response size and status in the metrics histograms
+and, while a request is being served, in the `RequestTimings` of that
+request. `djangoapp.middleware.upstream_timing_middleware` starts the
+request timings and reports them in a ``Server-Timing`` header.
+
+Request timings live in a context variable. Work submitted to a thread
+pool on behalf of a request must run in a copy of the request context,
+see `submit_in_context`.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from . import metrics
+
+# Upstream names, by the setting holding the URL of the upstream
+UPSTREAM_URL_SETTINGS = (
+    ("dealerships", "DEALERSHIPS_API_URL"),
+    ("reviews", "REVIEWS_API_URL"),
+    ("reviews", "POST_REVIEW_API_URL"),
+    ("reviews", "POST_REVIEWS_BULK_API_URL"),
+    ("reviews", "DEALER_STATS_API_URL"),
+    ("reviews", "REVIEW_CHANGES_API_URL"),
+    ("sentiment", "SENTIMENT_API_URL"),
+)
+
+# Response sizes, in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+upstream_duration = metrics.Histogram(
+    "upstream_request_duration_seconds",
+    "Latency of upstream calls, by upstream and status.",
+)
+upstream_response_size = metrics.Histogram(
+    "upstream_response_size_bytes",
+    "Size of upstream responses, by upstream.",
+    buckets=SIZE_BUCKETS,
+)
+request_upstream_time = metrics.Histogram(
+    "request_upstream_seconds",
+    "Time spent in upstream calls per request served, by upstream.",
+)
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def upstream_name(url):
+    """
+    Return the name of the upstream serving url.
+
+    URLs of the configured upstream services are named after the service,
+    other URLs after their host.
+    """
+    for name, setting in UPSTREAM_URL_SETTINGS:
+        base = getattr(settings, setting, None)
+        if base and url.startswith(base):
+            return name
+    return urlsplit(url).netloc or url
+
+
+class RequestTimings:
+    """
+    The upstream calls of one request, aggregated by upstream.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.upstreams = {}
+        self._lock = threading.Lock()
+
+    def add(self, upstream, duration, status, size):
+        with self._lock:
+            entry = self.upstreams.get(upstream)
+            if entry is None:
+                entry = self.upstreams[upstream] = {
+                    "count": 0,
+                    "duration": 0.0,
+                    "bytes": 0,
+                    "statuses": {},
+                }
+            entry["count"] += 1
+            entry["duration"] += duration
+            entry["bytes"] += size
+            entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+
+    def snapshot(self):
+        """
+        Returns:
+        - dict: A copy of the aggregates, by upstream.
+        """
+        with self._lock:
+            return {
+                upstream: dict(entry, statuses=dict(entry["statuses"]))
+                for upstream, entry in self.upstreams.items()
+            }
+
+    def server_timing(self):
+        """
+        Returns:
+        - str: The Server-Timing header value, one metric per upstream
+          and the total time of the request.
+        """
+        parts = []
+        for upstream, entry in sorted(self.snapshot().items()):
+            statuses = ",".join(
+                f"{status}x{count}"
+                for status, count in sorted(entry["statuses"].items())
+            )
+            description = (
+                f"{entry['count']} calls, {entry['bytes']} bytes, status {statuses}"
+            )
+            duration = entry["duration"] * 1000
+            parts.append(f'{upstream};dur={duration:.1f};desc="{description}"')
+        total = time.perf_counter() - self.started
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def start_request():
+    """
+    Start collecting the upstream calls of the current request.
+
+    Returns:
+    - tuple: The `RequestTimings` and the token to pass to `finish_request`.
+    """
+    timings = RequestTimings()
+    return timings, _request_timings.set(timings)
+
+
+def finish_request(timings, token):
+    """
+    Stop collecting and record the time spent per upstream.
+    """
+    _request_timings.reset(token)
+    for upstream, entry in timings.snapshot().items():
+        request_upstream_time.observe(entry["duration"], upstream=upstream)
+
+
+def current_timings():
+    """
+    Returns:
+    - RequestTimings: The timings of the current request, None outside of
+      a request.
+    """
+    return _request_timings.get()
+
+
+def record(upstream, duration, status, size):
+    """
+    Record one upstream call in the metrics and the current request.
+    """
+    status = str(status)
+    upstream_duration.observe(duration, upstream=upstream, status=status)
+    upstream_response_size.observe(size, upstream=upstream)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add(upstream, duration, status, size)
+
+
+class UpstreamCall:
+    """
+    An upstream call being timed, see `upstream_call`.
+    """
+
+    def __init__(self, url):
+        self.upstream = upstream_name(url)
+        self.response = None
+
+
+@contextmanager
+def upstream_call(url):
+    """
+    Time the upstream call made in the block.
+
+    The block sets the ``response`` attribute of the yielded
+    `UpstreamCall` to its requests or httpx response. A block raising or
+    leaving no response is recorded with the "error" status.
+
+    Args:
+    - url (str): The URL called.
+    """
+    call = UpstreamCall(url)
+    started = time.perf_counter()
+    try:
+        yield call
+    finally:
+        duration = time.perf_counter() - started
+        response = call.response
+        if response is None:
+            record(call.upstream, duration, "error", 0)
+        else:
+            size = len(response.content)
+            record(call.upstream, duration, response.status_code, size)
+
+
+def submit_in_context(executor, fn, *args):
+    """
+    Submit fn to executor, to run in a copy of the current context.
+
+    Returns:
+    - Future: The future of the call.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args)
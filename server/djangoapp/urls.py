@@ -3,12 +3,25 @@ from django.conf.urls.static import static
 from django.conf import settings
 from . import views
 
+# Serve the async versions of the views waiting on upstream services when
+# running under ASGI
+if settings.ASYNC_VIEWS:
+    get_dealerships = views.get_dealerships_async
+    get_dealer_details = views.get_dealer_details_async
+    get_dealers_near = views.get_dealers_near_async
+    add_review = views.add_review_async
+else:
+    get_dealerships = views.get_dealerships
+    get_dealer_details = views.get_dealer_details
+    get_dealers_near = views.get_dealers_near
+    add_review = views.add_review
+
 app_name = "djangoapp"
 urlpatterns = [
     # route is a string contains a URL pattern
     # view refers to the view function
     # name the URL
-    path(route="", view=views.get_dealerships, name="index"),
+    path(route="", view=get_dealerships, name="index"),
     # path for about view
     path(route="about", view=views.about, name="about"),
     # path for contact us view
@@ -22,9 +35,15 @@ urlpatterns = [
     # path for dealer reviews view
     path(
         route="dealer/<int:id>/",
-        view=views.get_dealer_details,
+        view=get_dealer_details,
         name="dealer_details",
     ),
+    # path for dealers near a location, as JSON
+    path(route="dealers/near", view=get_dealers_near, name="dealers_near"),
+    # path for review search, as JSON
+    path(route="reviews/search", view=views.search_reviews, name="search_reviews"),
     # path for add a review view
-    path(route="add_review/<int:id>/", view=views.add_review, name="add_review"),
+    path(route="add_review/<int:id>/", view=add_review, name="add_review"),
+    # path for metrics scraping
+    path(route="metrics", view=views.metrics_view, name="metrics"),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
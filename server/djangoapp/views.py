@@ -1,22 +1,55 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, JsonResponse
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404, render, redirect
+from django.template.loader import get_template
+from django.utils.cache import get_conditional_response, patch_cache_control
 
 # from .models import related models
 from .models import CarModel, CarMake, CarDealer, DealerReview
 
+from . import metrics, search
+
 # from .restapis import related methods
 from .restapis import (
     get_request,
-    post_request,
-    get_dealers_from_cf,
+    get_dealers_page_from_cf,
     get_dealer_reviews_from_cf,
     get_dealer_by_id_from_cf,
+    get_dealer_stats_from_cf,
+    get_dealers_near_from_cf,
+    fetch_concurrently,
+    async_get_dealers_page_from_cf,
+    async_get_dealer_by_id_from_cf,
+    async_get_dealer_stats_from_cf,
+    async_get_dealers_near_from_cf,
+    async_get_dealer_reviews_from_cf,
+    async_fetch_concurrently,
+    SENTIMENT_UNKNOWN,
+)
+from .fragments import (
+    DEALER_REVIEWS,
+    DEALER_ROW,
+    Deferred,
+    all_cached,
+    bump_review_set_version,
+    drop_fragments,
+    review_set_version,
+    review_set_versions,
+    versions_are_shared,
 )
+from .enrichment import attach_enrichments
+from .outbox import enqueue_review, review_idempotency_key
 from django.contrib.auth import login, logout, authenticate
 from django.contrib import messages
 from datetime import datetime
+from functools import lru_cache, partial
+from urllib.parse import urlencode
+import hashlib
+import os
+import uuid
 import logging
 import json
 
@@ -64,6 +97,22 @@ def logout_request(request):
     return redirect("djangoapp:index")
 
 
+# Create a `metrics` view to expose process metrics for scraping
+def metrics_view(request):
+    """
+    Expose the process metrics in the Prometheus text format.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        HttpResponse: The plain-text metrics.
+    """
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 # Create a `registration_request` view to handle sign up request
 def registration_request(request):
     """
@@ -109,6 +158,174 @@ def registration_request(request):
             return render(request, "djangoapp/registration.html", context)
 
 
+@lru_cache(maxsize=None)
+def _template_version(template_name):
+    # Pages rendered by an older template do not match after a deploy
+    return os.stat(get_template(template_name).origin.name).st_mtime_ns
+
+
+def _record_state(value):
+    # Dealers, reviews and stats are slotted records
+    return [getattr(value, field, None) for field in value.__slots__]
+
+
+def page_etag(request, template_name, *parts):
+    """
+    Return the ETag of a page rendered from parts for the requesting user.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        template_name (str): The template of the page.
+        *parts: The data the page is rendered from, records or JSON
+            serializable values.
+
+    Returns:
+        str: The quoted ETag.
+    """
+    user = getattr(request, "user", None)
+    identity = None
+    if user is not None and user.is_authenticated:
+        identity = [user.pk, user.get_username(), user.first_name]
+    state = json.dumps(
+        [template_name, _template_version(template_name), identity, parts],
+        default=_record_state,
+        sort_keys=True,
+    )
+    return '"%s"' % hashlib.sha256(state.encode()).hexdigest()[:32]
+
+
+def conditional_render(request, template_name, context, *parts, complete=None):
+    """
+    Render a page, or answer 304 Not Modified when the client already has
+    the page rendered from the same parts for the same user.
+
+    Pages are marked private and revalidated on every view.
+
+    Args:
+        complete (callable, optional): Called once the page is rendered,
+            returns whether it was rendered from complete upstream data.
+            Incomplete pages get no ETag, so they are not revalidated.
+
+    Returns:
+        HttpResponse: The rendered page or the 304 answer.
+    """
+    etag = page_etag(request, template_name, *parts)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = render(request, template_name, context)
+        if complete is None or complete():
+            response["ETag"] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def dealer_listing_params(request):
+    """
+    Return the (state, bookmark) requested on the dealership listing.
+    """
+    state = request.GET.get("state", "").strip() or None
+    bookmark = request.GET.get("bookmark") or None
+    return state, bookmark
+
+
+def _row_stats(stats, id):
+    return (stats.get() or {}).get(id)
+
+
+def _row_version(dealer, version):
+    # A row is rendered again when its dealer changed too
+    state = json.dumps([version, _record_state(dealer)], sort_keys=True)
+    return hashlib.sha256(state.encode()).hexdigest()[:32]
+
+
+def _data_version(*records):
+    # The review set version of a dealer when versions are not shared
+    state = json.dumps(records, default=_record_state, sort_keys=True)
+    return hashlib.sha256(state.encode()).hexdigest()[:32]
+
+
+def listing_versions(ids, stats):
+    """
+    Return the review set version of the dealers of a listing page, derived
+    from their stats when versions are not shared, see
+    `djangoapp.fragments.versions_are_shared`.
+    """
+    if versions_are_shared():
+        return review_set_versions(ids)
+    return {id: _data_version(_row_stats(stats, id)) for id in ids}
+
+
+def details_version(id, details):
+    """
+    Return the review set version of a dealer details page, derived from
+    the dealer and its reviews when versions are not shared.
+    """
+    if versions_are_shared():
+        return review_set_version(id)
+    return _data_version(*details.get())
+
+
+def dealer_listing_context(
+    state, bookmark, dealerships, next_bookmark, stats=None, versions=None
+):
+    """
+    Build the context of the dealership listing page.
+
+    Args:
+        stats (dict or Deferred, optional): The DealerStats of the dealers
+            by ID. Deferred stats are only fetched when a row is missing
+            from the fragment cache.
+        versions (dict, optional): The review set version of the dealers
+            by ID, see `djangoapp.fragments`.
+
+    Returns:
+        dict: The dealers of the page, with their review stats if known
+        and the version of their cached row, the state filter and the
+        query strings of the first and next pages, if any.
+    """
+    if not isinstance(stats, Deferred):
+        known = stats or {}
+        stats = Deferred(lambda: known)
+    versions = versions or {}
+    first_query = urlencode({"state": state}) if state else ""
+    next_query = None
+    if next_bookmark:
+        next_params = {"bookmark": next_bookmark}
+        if state:
+            next_params["state"] = state
+        next_query = urlencode(next_params)
+    return {
+        "dealerships": dealerships,
+        "dealer_rows": [
+            (
+                dealer,
+                partial(_row_stats, stats, dealer.id),
+                _row_version(dealer, versions.get(dealer.id)),
+            )
+            for dealer in dealerships
+        ],
+        "fragment_ttl": settings.DEALER_FRAGMENT_CACHE_TTL,
+        "state": state or "",
+        "is_first_page": bookmark is None,
+        "first_page_query": first_query,
+        "next_page_query": next_query,
+    }
+
+
+def dealer_listing_complete(context, stats):
+    """
+    Return whether the listing was rendered with the stats of its dealers,
+    else drop the row fragments it cached without them.
+    """
+    if not stats.computed or stats.value or not settings.DEALER_STATS_API_URL:
+        return True
+    drop_fragments(
+        DEALER_ROW,
+        *[(dealer.id, row_version) for dealer, _, row_version in context["dealer_rows"]]
+    )
+    return False
+
+
 # Update the `get_dealerships` view to render the index page with a list of dealerships
 # def get_dealerships(request):
 #     context = {}
@@ -118,9 +335,17 @@ def registration_request(request):
 
 def get_dealerships(request):
     """
-    This function retrieves a list of dealerships from a remote server
+    This function retrieves a page of dealerships from a remote server
     and renders the result in a Django template.
 
+    The optional `state` query parameter filters dealers by state and the
+    `bookmark` parameter selects the page, see `dealer_listing_context`.
+    Dealer rows are served from the fragment cache until a review of the
+    dealer is submitted, see `djangoapp.fragments`. The review stats of the
+    dealers of the page are fetched in one request, only when a row is not
+    cached. A client holding the same page gets a 304, see
+    `conditional_render`.
+
     Args:
         request (HttpRequest): The HTTP request object.
 
@@ -128,10 +353,190 @@ def get_dealerships(request):
         HttpResponse: The HTTP response object containing the rendered template.
     """
     if request.method == "GET":
-        url = "https://congwang5h-3000.theiadocker-2-labs-prod-theiak8s-4-tor01.proxy.cognitiveclass.ai/dealerships/get"
-        dealerships = get_dealers_from_cf(url)
-        context = {"dealerships": dealerships}
-        return render(request, "djangoapp/index.html", context)
+        url = settings.DEALERSHIPS_API_URL
+        state, bookmark = dealer_listing_params(request)
+        dealerships, next_bookmark = get_dealers_page_from_cf(
+            url, state=state, bookmark=bookmark
+        )
+        ids = [dealer.id for dealer in dealerships]
+        stats = Deferred(
+            lambda: get_dealer_stats_from_cf(settings.DEALER_STATS_API_URL, ids)
+        )
+        versions = listing_versions(ids, stats)
+        context = dealer_listing_context(
+            state, bookmark, dealerships, next_bookmark, stats, versions
+        )
+        return conditional_render(
+            request,
+            "djangoapp/index.html",
+            context,
+            state,
+            bookmark,
+            dealerships,
+            next_bookmark,
+            versions,
+            complete=lambda: dealer_listing_complete(context, stats),
+        )
+
+
+def dealers_near_params(request):
+    """
+    Return the (lat, long, k, radius_km) of a dealers near search.
+
+    Raises:
+        ValueError: If a parameter is missing or invalid.
+    """
+    try:
+        lat = float(request.GET["lat"])
+        long = float(request.GET["long"])
+    except (KeyError, ValueError):
+        raise ValueError("'lat' and 'long' must be numbers")
+    if not (-90 <= lat <= 90 and -180 <= long <= 180):
+        raise ValueError("'lat' or 'long' is out of range")
+    k = request.GET.get("k")
+    radius = request.GET.get("radius")
+    try:
+        k = int(k) if k else None
+        radius = float(radius) if radius else None
+    except ValueError:
+        raise ValueError("'k' must be an integer and 'radius' a number")
+    if (k is not None and k <= 0) or (radius is not None and radius <= 0):
+        raise ValueError("'k' and 'radius' must be positive")
+    return lat, long, k, radius
+
+
+def dealers_near_response(dealers):
+    return JsonResponse(
+        {
+            "dealers": [
+                dict(dealer.to_dict(), distance_km=round(distance, 3))
+                for distance, dealer in dealers
+            ]
+        }
+    )
+
+
+# Create a `get_dealers_near` view to search dealers by location
+def get_dealers_near(request):
+    """
+    Return the dealers near a point as JSON.
+
+    Query parameters are `lat` and `long`, and either `k` for the k nearest
+    dealers (10 by default), `radius` for the dealers within that many
+    kilometers, or both. Dealers are searched in an in-memory spatial
+    index, see `djangoapp.geo`.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        JsonResponse: The dealers with their distance in km, nearest first.
+    """
+    try:
+        lat, long, k, radius = dealers_near_params(request)
+    except ValueError as err:
+        return JsonResponse({"error": str(err)}, status=400)
+    dealers = get_dealers_near_from_cf(
+        settings.DEALERSHIPS_API_URL, lat, long, k=k, radius_km=radius
+    )
+    return dealers_near_response(dealers)
+
+
+# Create a `search_reviews` view to search the review texts
+def search_reviews(request):
+    """
+    Search reviews as JSON.
+
+    Query parameters are `q`, the words to search, the facet filters
+    `car_make`, `car_model`, `car_year` and `purchase`, and `page` and
+    `page_size`. At least `q` or a filter is required. Reviews are searched
+    in the review index, see `djangoapp.search`.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        JsonResponse: The total number of matches, the page of reviews
+        ranked by relevance and the facet counts of the matches.
+    """
+    query = request.GET.get("q", "")
+    filters = {field: request.GET.get(field) for field in search.FACETS}
+    filters = {field: value for field, value in filters.items() if value}
+    if not query.strip() and not filters:
+        return JsonResponse({"error": "Pass 'q' or a facet filter"}, status=400)
+    try:
+        page = max(1, int(request.GET.get("page", 1)))
+        page_size = int(request.GET.get("page_size", settings.REVIEW_SEARCH_PAGE_SIZE))
+    except ValueError:
+        error = "'page' and 'page_size' must be integers"
+        return JsonResponse({"error": error}, status=400)
+    page_size = max(1, min(page_size, settings.REVIEW_SEARCH_MAX_PAGE_SIZE))
+    result = search.get_review_index().search(
+        query, filters, offset=(page - 1) * page_size, limit=page_size
+    )
+    return JsonResponse(
+        {
+            "total": result["total"],
+            "page": page,
+            "page_size": page_size,
+            "results": [
+                dict(review, score=round(score, 4)) for score, review in result["hits"]
+            ],
+            "facets": {
+                field: dict(counts) for field, counts in result["facets"].items()
+            },
+        }
+    )
+
+
+def with_enrichments(details):
+    """
+    Add the stored keywords, entities and emotion to the reviews of the
+    (dealer, reviews) of a dealer details page, see `djangoapp.enrichment`.
+    """
+    _, reviews = details
+    if reviews:
+        attach_enrichments(reviews)
+    return details
+
+
+def dealer_details_context(id, version, details):
+    """
+    Build the context of the dealer details page.
+
+    Args:
+        id (int): The ID of the dealer.
+        version (str): The review set version of the dealer.
+        details (Deferred): The dealer and its reviews, only fetched when
+            the reviews fragment is not cached.
+
+    Returns:
+        dict: The dealer and its reviews, fetched on first use, and the key
+        of the reviews fragment.
+    """
+    return {
+        "dealer_id": id,
+        "review_version": version,
+        "fragment_ttl": settings.DEALER_FRAGMENT_CACHE_TTL,
+        "dealer": lambda: details.get()[0],
+        "reviews": lambda: details.get()[1] or [],
+    }
+
+
+def dealer_details_complete(id, version, details):
+    """
+    Return whether the details page was rendered from the dealer and all
+    its reviews with their sentiment, else drop the reviews fragment it
+    cached.
+    """
+    if not details.computed:
+        return True
+    dealer, reviews = details.value
+    if dealer is not None and reviews is not None:
+        if all(review.sentiment != SENTIMENT_UNKNOWN for review in reviews):
+            return True
+    drop_fragments(DEALER_REVIEWS, (id, version))
+    return False
 
 
 # Create a `get_dealer_details` view to render the reviews of a dealer
@@ -139,31 +544,116 @@ def get_dealer_details(request, id):
     """
     Retrieves the details of a dealer and their reviews.
 
+    The reviews are served from the fragment cache until a review of the
+    dealer is submitted, see `djangoapp.fragments`, and only fetched when
+    they are not cached.
+
     Args:
         request: The HTTP request object.
         id: The ID of the dealer.
 
     Returns:
-        The rendered HTML template with the dealer details and reviews.
+        The rendered HTML template with the dealer details and reviews, or
+        a 304 when the client has the same page.
     """
-    dealer_url = "https://congwang5h-3000.theiadocker-2-labs-prod-theiak8s-4-tor01.proxy.cognitiveclass.ai/dealerships/get"
-    review_url = "https://congwang5h-5000.theiadocker-2-labs-prod-theiak8s-4-tor01.proxy.cognitiveclass.ai/api/get_reviews"
+    dealer_url = settings.DEALERSHIPS_API_URL
+    review_url = settings.REVIEWS_API_URL
+
+    # The dealer and its reviews come from different services, fetch them
+    # concurrently under one deadline
+    details = Deferred(
+        lambda: with_enrichments(
+            fetch_concurrently(
+                lambda: get_dealer_by_id_from_cf(dealer_url, id=id),
+                lambda: get_dealer_reviews_from_cf(review_url, id=id),
+                deadline=settings.DEALER_DETAILS_DEADLINE,
+            )
+        )
+    )
+    version = details_version(id, details)
+    context = dealer_details_context(id, version, details)
+
+    return conditional_render(
+        request,
+        "djangoapp/dealer_details.html",
+        context,
+        id,
+        version,
+        complete=lambda: dealer_details_complete(id, version, details),
+    )
+
+
+def build_review_payload(request, id):
+    """
+    Build the review submitted by the user in an add review form.
 
-    dealer = get_dealer_by_id_from_cf(dealer_url, id=id)
-    reviews = get_dealer_reviews_from_cf(review_url, id=id)
+    Args:
+        request (HttpRequest): The POST request of the add review form.
+        id (int): The ID of the dealership.
 
-    context = {"dealer": dealer, "reviews": reviews}
+    Returns:
+        dict: The review payload, None if the user is not authenticated.
 
-    return render(request, "djangoapp/dealer_details.html", context)
+    Raises:
+        ValueError: If the car ID is invalid.
+    """
+    # Check if the user is authenticated
+    if not request.user.is_authenticated:
+        return None
+
+    # Create the payload for the review
+    payload = {}
+    car_id = request.POST["car"]
+    try:
+        car = CarModel.objects.select_related("car_make").get(pk=car_id)
+    except CarModel.DoesNotExist:
+        raise ValueError("Invalid car ID")
+
+    payload["time"] = datetime.utcnow().isoformat()
+    payload["name"] = request.user.username
+    payload["dealership"] = id
+    payload["id"] = id
+    payload["review"] = request.POST["content"]
+    payload["purchase"] = request.POST.get("purchasecheck") == "on"
+    payload["purchase_date"] = request.POST["purchasedate"]
+    payload["car_make"] = car.car_make.name
+    payload["car_model"] = car.name
+    payload["car_year"] = int(car.year.strftime("%Y"))
+    return payload
 
 
 # Create a `add_review` view to submit a review
 
 
+def submit_review(request, id):
+    """
+    Queue the review submitted in an add review form for posting.
+
+    The form carries a token rendered with it, so submitting the same form
+    twice queues the review once.
+
+    Args:
+        request (HttpRequest): The POST request of the add review form.
+        id (int): The ID of the dealership.
+
+    Raises:
+        ValueError: If the car ID is invalid.
+    """
+    payload = build_review_payload(request, id)
+    if payload is not None:
+        token = request.POST.get("idempotency_token") or uuid.uuid4().hex
+        key = review_idempotency_key(request.user.username, token)
+        enqueue_review(payload, key)
+        bump_review_set_version(id)
+
+
 def add_review(request, id):
     """
     Add a review for a specific dealership.
 
+    The review is stored in the review outbox and posted to the review
+    service in the background, see `djangoapp.outbox`.
+
     Args:
         request (HttpRequest): The HTTP request object.
         id (int): The ID of the dealership.
@@ -178,49 +668,148 @@ def add_review(request, id):
     # Initialize the context dictionary
     context = {}
 
-    # Get the dealer information
-    dealer_url = "https://congwang5h-3000.theiadocker-2-labs-prod-theiak8s-4-tor01.proxy.cognitiveclass.ai/dealerships/get"
-    dealer = get_dealer_by_id_from_cf(dealer_url, id=id)
-    context["dealer"] = dealer
-
     # Handle GET request
     if request.method == "GET":
+        # Get the dealer information
+        dealer_url = settings.DEALERSHIPS_API_URL
+        dealer = get_dealer_by_id_from_cf(dealer_url, id=id)
+        context["dealer"] = dealer
+
         # Get all car models
         cars = CarModel.objects.all()
         context["cars"] = cars
+        context["idempotency_token"] = uuid.uuid4().hex
         return render(request, "djangoapp/add_review.html", context)
 
     # Handle POST request
     elif request.method == "POST":
-        # Check if the user is authenticated
-        if request.user.is_authenticated:
-            # Get the username
-            username = request.user.username
-
-            # Create the payload for the review
-            payload = {}
-            car_id = request.POST["car"]
-            try:
-                car = CarModel.objects.get(pk=car_id)
-            except CarModel.DoesNotExist:
-                raise ValueError("Invalid car ID")
-
-            payload["time"] = datetime.utcnow().isoformat()
-            payload["name"] = username
-            payload["dealership"] = id
-            payload["id"] = id
-            payload["review"] = request.POST["content"]
-            payload["purchase"] = request.POST.get("purchasecheck") == "on"
-            payload["purchase_date"] = request.POST["purchasedate"]
-            payload["car_make"] = car.car_make.name
-            payload["car_model"] = car.name
-            payload["car_year"] = int(car.year.strftime("%Y"))
-
-            new_payload = {"review": payload}
-            review_post_url = "https://congwang5h-5000.theiadocker-2-labs-prod-theiak8s-4-tor01.proxy.cognitiveclass.ai/api/post_review"
-
-            # Send the review payload to the API
-            post_request(review_post_url, new_payload, id=id)
+        submit_review(request, id)
 
         # Redirect to the dealer details page
         return redirect("djangoapp:dealer_details", id=id)
+
+
+# Async versions of the views above that wait on upstream services. They
+# are routed instead of the sync ones when settings.ASYNC_VIEWS is set, so
+# one ASGI worker can keep many upstream calls in flight. Rendering and
+# ORM access still run in a thread through sync_to_async.
+
+
+async def get_dealerships_async(request):
+    """
+    Async version of get_dealerships.
+    """
+    if request.method == "GET":
+        state, bookmark = dealer_listing_params(request)
+        dealerships, next_bookmark = await async_get_dealers_page_from_cf(
+            settings.DEALERSHIPS_API_URL, state=state, bookmark=bookmark
+        )
+        ids = [dealer.id for dealer in dealerships]
+        # Fetched in the rendering thread if a row expires in the meantime
+        stats = Deferred(
+            lambda: get_dealer_stats_from_cf(settings.DEALER_STATS_API_URL, ids)
+        )
+        shared = versions_are_shared()
+        if shared:
+            versions = await sync_to_async(review_set_versions)(ids)
+            rows = [
+                (dealer.id, _row_version(dealer, versions[dealer.id]))
+                for dealer in dealerships
+            ]
+        if not shared or not await sync_to_async(all_cached)(DEALER_ROW, *rows):
+            stats.set(
+                await async_get_dealer_stats_from_cf(
+                    settings.DEALER_STATS_API_URL, ids
+                )
+            )
+        if not shared:
+            versions = listing_versions(ids, stats)
+        context = dealer_listing_context(
+            state, bookmark, dealerships, next_bookmark, stats, versions
+        )
+        return await sync_to_async(conditional_render)(
+            request,
+            "djangoapp/index.html",
+            context,
+            state,
+            bookmark,
+            dealerships,
+            next_bookmark,
+            versions,
+            complete=lambda: dealer_listing_complete(context, stats),
+        )
+
+
+async def get_dealers_near_async(request):
+    """
+    Async version of get_dealers_near.
+    """
+    try:
+        lat, long, k, radius = dealers_near_params(request)
+    except ValueError as err:
+        return JsonResponse({"error": str(err)}, status=400)
+    dealers = await async_get_dealers_near_from_cf(
+        settings.DEALERSHIPS_API_URL, lat, long, k=k, radius_km=radius
+    )
+    return dealers_near_response(dealers)
+
+
+async def get_dealer_details_async(request, id):
+    """
+    Async version of get_dealer_details.
+    """
+    # Fetched in the rendering thread if the fragment expires in the meantime
+    details = Deferred(
+        lambda: with_enrichments(
+            fetch_concurrently(
+                lambda: get_dealer_by_id_from_cf(settings.DEALERSHIPS_API_URL, id=id),
+                lambda: get_dealer_reviews_from_cf(settings.REVIEWS_API_URL, id=id),
+                deadline=settings.DEALER_DETAILS_DEADLINE,
+            )
+        )
+    )
+    shared = versions_are_shared()
+    if shared:
+        version = await sync_to_async(review_set_version)(id)
+    if not shared or not await sync_to_async(all_cached)(
+        DEALER_REVIEWS, (id, version)
+    ):
+        fetched = await async_fetch_concurrently(
+            async_get_dealer_by_id_from_cf(settings.DEALERSHIPS_API_URL, id=id),
+            async_get_dealer_reviews_from_cf(settings.REVIEWS_API_URL, id=id),
+            deadline=settings.DEALER_DETAILS_DEADLINE,
+        )
+        details.set(await sync_to_async(with_enrichments)(fetched))
+    if not shared:
+        version = details_version(id, details)
+    context = dealer_details_context(id, version, details)
+
+    return await sync_to_async(conditional_render)(
+        request,
+        "djangoapp/dealer_details.html",
+        context,
+        id,
+        version,
+        complete=lambda: dealer_details_complete(id, version, details),
+    )
+
+
+async def add_review_async(request, id):
+    """
+    Async version of add_review.
+    """
+    context = {}
+
+    if request.method == "GET":
+        context["dealer"] = await async_get_dealer_by_id_from_cf(
+            settings.DEALERSHIPS_API_URL, id=id
+        )
+        context["cars"] = await sync_to_async(list)(CarModel.objects.all())
+        context["idempotency_token"] = uuid.uuid4().hex
+        return await sync_to_async(render)(
+            request, "djangoapp/add_review.html", context
+        )
+
+    elif request.method == "POST":
+        await sync_to_async(submit_review)(request, id)
+        return redirect("djangoapp:dealer_details", id=id)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'djangoapp.middleware.upstream_timing_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -125,3 +127,287 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_ROOT = os.path.join(STATIC_ROOT, 'media')
 MEDIA_URL = '/media/'
+
+
+# Upstream services
+# UPSTREAM=local points them at the local stand-ins served by
+# `python manage.py runlocalservices` instead of the deployed services.
+
+UPSTREAM = os.environ.get('UPSTREAM', 'remote')
+
+if UPSTREAM == 'local':
+    _UPSTREAM_URLS = {
+        'DEALERSHIPS_API_URL': 'http://127.0.0.1:3000/dealerships/get',
+        'REVIEWS_API_URL': 'http://127.0.0.1:5000/api/get_reviews',
+        'POST_REVIEW_API_URL': 'http://127.0.0.1:5000/api/post_review',
+        'POST_REVIEWS_BULK_API_URL': 'http://127.0.0.1:5000/api/post_reviews',
+        'DEALER_STATS_API_URL': 'http://127.0.0.1:5000/api/get_dealer_stats',
+        'REVIEW_CHANGES_API_URL': 'http://127.0.0.1:5000/api/reviews/changes',
+        'SENTIMENT_API_URL': 'http://127.0.0.1:5000/sentiment',
+        'NLU_API_URL': 'http://127.0.0.1:5000/nlu',
+    }
+else:
+    _UPSTREAM_URLS = {
+        'DEALERSHIPS_API_URL': 'https://congwang5h-3000.theiadocker-2-labs-prod-theiak8s-4-tor01.proxy.cognitiveclass.ai/dealerships/get',
+        'REVIEWS_API_URL': 'https://congwang5h-5000.theiadocker-2-labs-prod-theiak8s-4-tor01.proxy.cognitiveclass.ai/api/get_reviews',
+        'POST_REVIEW_API_URL': 'https://congwang5h-5000.theiadocker-2-labs-prod-theiak8s-4-tor01.proxy.cognitiveclass.ai/api/post_review',
+        'POST_REVIEWS_BULK_API_URL': 'https://congwang5h-5000.theiadocker-2-labs-prod-theiak8s-4-tor01.proxy.cognitiveclass.ai/api/post_reviews',
+        'DEALER_STATS_API_URL': 'https://congwang5h-5000.theiadocker-2-labs-prod-theiak8s-4-tor01.proxy.cognitiveclass.ai/api/get_dealer_stats',
+        'REVIEW_CHANGES_API_URL': 'https://congwang5h-5000.theiadocker-2-labs-prod-theiak8s-4-tor01.proxy.cognitiveclass.ai/api/reviews/changes',
+        'SENTIMENT_API_URL': 'https://sn-watson-sentiment-bert.labs.skills.network/v1/watson.runtime.nlp.v1/NlpService/SentimentPredict',
+        # The URL of your Natural Language Understanding instance
+        'NLU_API_URL': '',
+    }
+
+DEALERSHIPS_API_URL = os.environ.get(
+    'DEALERSHIPS_API_URL', _UPSTREAM_URLS['DEALERSHIPS_API_URL']
+)
+REVIEWS_API_URL = os.environ.get('REVIEWS_API_URL', _UPSTREAM_URLS['REVIEWS_API_URL'])
+POST_REVIEW_API_URL = os.environ.get(
+    'POST_REVIEW_API_URL', _UPSTREAM_URLS['POST_REVIEW_API_URL']
+)
+# Set to an empty value when the review service has no bulk endpoint
+POST_REVIEWS_BULK_API_URL = os.environ.get(
+    'POST_REVIEWS_BULK_API_URL', _UPSTREAM_URLS['POST_REVIEWS_BULK_API_URL']
+)
+SENTIMENT_API_URL = os.environ.get(
+    'SENTIMENT_API_URL', _UPSTREAM_URLS['SENTIMENT_API_URL']
+)
+# Set to an empty value to list dealers without their review stats
+DEALER_STATS_API_URL = os.environ.get(
+    'DEALER_STATS_API_URL', _UPSTREAM_URLS['DEALER_STATS_API_URL']
+)
+REVIEW_CHANGES_API_URL = os.environ.get(
+    'REVIEW_CHANGES_API_URL', _UPSTREAM_URLS['REVIEW_CHANGES_API_URL']
+)
+
+# Cloudant account holding the dealerships and reviews databases, used to
+# provision their indexes (python manage.py ensure_cloudant_indexes). With
+# CLOUDANT_CHECK_INDEXES set, missing indexes are logged when the web server
+# starts.
+
+CLOUDANT_URL = os.environ.get('IBM_URL')
+CLOUDANT_API_KEY = os.environ.get('IBM_API_KEY')
+CLOUDANT_CHECK_INDEXES = os.environ.get('CLOUDANT_CHECK_INDEXES', '0') == '1'
+
+# Watson Natural Language Understanding, extracting the keywords, entities
+# and emotion of reviews (djangoapp.enrichment). An empty NLU_API_URL
+# disables enrichment. With NLU_API_KEY set, calls are authenticated with
+# IAM tokens from NLU_IAM_URL, the IBM Cloud IAM service if empty. At most
+# NLU_MAX_WORKERS calls run at once per process, a single call gives up
+# after NLU_CALL_TIMEOUT seconds and a batch after NLU_BATCH_DEADLINE.
+
+NLU_API_URL = os.environ.get('NLU_API_URL', _UPSTREAM_URLS['NLU_API_URL'])
+NLU_API_KEY = os.environ.get('NLU_API_KEY', '')
+NLU_IAM_URL = os.environ.get('NLU_IAM_URL', '')
+NLU_VERSION = os.environ.get('NLU_VERSION', '2022-04-07')
+NLU_KEYWORDS_LIMIT = int(os.environ.get('NLU_KEYWORDS_LIMIT', 5))
+NLU_ENTITIES_LIMIT = int(os.environ.get('NLU_ENTITIES_LIMIT', 5))
+NLU_MAX_WORKERS = int(os.environ.get('NLU_MAX_WORKERS', 8))
+NLU_CALL_TIMEOUT = float(os.environ.get('NLU_CALL_TIMEOUT', 10))
+NLU_BATCH_DEADLINE = float(os.environ.get('NLU_BATCH_DEADLINE', 30))
+
+# Server mode: 'wsgi' serves the synchronous views under gunicorn sync
+# workers, 'asgi' serves their async versions under uvicorn workers.
+
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi')
+ASYNC_VIEWS = SERVER_MODE == 'asgi'
+
+# Upstream HTTP client (djangoapp.restapis)
+# One pooled keep-alive session is shared per process. POOL_CONNECTIONS is
+# the number of upstream hosts kept pooled, POOL_MAXSIZE the number of
+# connections kept open per host. Timeouts are in seconds.
+
+RESTAPIS_POOL_CONNECTIONS = int(os.environ.get('RESTAPIS_POOL_CONNECTIONS', 10))
+RESTAPIS_POOL_MAXSIZE = int(os.environ.get('RESTAPIS_POOL_MAXSIZE', 10))
+RESTAPIS_CONNECT_TIMEOUT = float(os.environ.get('RESTAPIS_CONNECT_TIMEOUT', 3.05))
+RESTAPIS_READ_TIMEOUT = float(os.environ.get('RESTAPIS_READ_TIMEOUT', 10))
+
+# The async client used under ASGI opens at most
+# RESTAPIS_ASYNC_MAX_CONNECTIONS connections in total, all kept alive.
+
+RESTAPIS_ASYNC_MAX_CONNECTIONS = int(
+    os.environ.get('RESTAPIS_ASYNC_MAX_CONNECTIONS', 200)
+)
+
+# Upstream answers carrying an ETag or Last-Modified header are kept with
+# their validators, CONDITIONAL_FETCH_MAXSIZE of them per process, and
+# revalidated with conditional requests. 0 disables conditional requests.
+
+CONDITIONAL_FETCH_MAXSIZE = int(os.environ.get('CONDITIONAL_FETCH_MAXSIZE', 1000))
+
+# Sentiment analysis of dealer reviews
+# SENTIMENT_BACKEND is the dotted path of the sentiment backend class: the
+# remote Watson service, or djangoapp.sentiment.LexiconSentimentBackend to
+# score reviews in process with the lexicon file at SENTIMENT_LEXICON_PATH
+# (word<TAB>valence lines), a built-in lexicon if empty.
+
+SENTIMENT_BACKEND = os.environ.get(
+    'SENTIMENT_BACKEND', 'djangoapp.restapis.RemoteSentimentBackend'
+)
+SENTIMENT_LEXICON_PATH = os.environ.get('SENTIMENT_LEXICON_PATH', '')
+
+# Reviews of a dealer are analyzed concurrently by at most
+# SENTIMENT_MAX_WORKERS threads per process. A single call gives up after
+# SENTIMENT_CALL_TIMEOUT seconds and a whole page waits at most
+# SENTIMENT_BATCH_DEADLINE seconds before showing unknown sentiments.
+
+SENTIMENT_MAX_WORKERS = int(os.environ.get('SENTIMENT_MAX_WORKERS', 16))
+SENTIMENT_CALL_TIMEOUT = float(os.environ.get('SENTIMENT_CALL_TIMEOUT', 3))
+SENTIMENT_BATCH_DEADLINE = float(os.environ.get('SENTIMENT_BATCH_DEADLINE', 4))
+
+# The sentiment circuit breaker opens when at least
+# SENTIMENT_BREAKER_FAILURE_RATE of the last SENTIMENT_BREAKER_WINDOW calls
+# failed, once SENTIMENT_BREAKER_MIN_CALLS were made. Calls slower than
+# SENTIMENT_BREAKER_SLOW_CALL seconds count as failures. While it is open
+# reviews are shown without sentiment. After SENTIMENT_BREAKER_RESET_TIMEOUT
+# seconds SENTIMENT_BREAKER_HALF_OPEN_CALLS probe calls are let through, and
+# it closes if they all succeed.
+
+SENTIMENT_BREAKER_FAILURE_RATE = float(
+    os.environ.get('SENTIMENT_BREAKER_FAILURE_RATE', 0.5)
+)
+SENTIMENT_BREAKER_WINDOW = int(os.environ.get('SENTIMENT_BREAKER_WINDOW', 20))
+SENTIMENT_BREAKER_MIN_CALLS = int(os.environ.get('SENTIMENT_BREAKER_MIN_CALLS', 10))
+SENTIMENT_BREAKER_SLOW_CALL = float(os.environ.get('SENTIMENT_BREAKER_SLOW_CALL', 2))
+SENTIMENT_BREAKER_RESET_TIMEOUT = float(
+    os.environ.get('SENTIMENT_BREAKER_RESET_TIMEOUT', 30)
+)
+SENTIMENT_BREAKER_HALF_OPEN_CALLS = int(
+    os.environ.get('SENTIMENT_BREAKER_HALF_OPEN_CALLS', 3)
+)
+
+# Caches
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+#
+# The default cache holds the sentiment labels, review enrichments and
+# rendered page fragments. It must be shared by the worker processes, so a
+# review scored or a page invalidated by one worker is seen by the others.
+# It is file-based in CACHE_LOCATION by default, which the processes of one
+# host share. Set CACHE_BACKEND to
+# 'django.core.cache.backends.memcached.MemcachedCache' and CACHE_LOCATION
+# to the memcached servers to share it across hosts.
+
+CACHE_BACKEND = os.environ.get(
+    'CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'
+)
+CACHE_LOCATION = os.environ.get(
+    'CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'djangoapp-cache')
+)
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': CACHE_LOCATION,
+    },
+}
+if 'memcached' not in CACHE_BACKEND:
+    CACHES['default']['OPTIONS'] = {
+        'MAX_ENTRIES': 50000,
+    }
+
+# Sentiment labels are cached by a hash of the review text and model id.
+# The in-process LRU tier holds SENTIMENT_CACHE_MAXSIZE labels in front of
+# the SENTIMENT_CACHE_ALIAS Django cache. TTL is in seconds.
+
+SENTIMENT_CACHE_ALIAS = 'default'
+SENTIMENT_CACHE_MAXSIZE = int(os.environ.get('SENTIMENT_CACHE_MAXSIZE', 10000))
+SENTIMENT_CACHE_TTL = int(os.environ.get('SENTIMENT_CACHE_TTL', 7 * 24 * 3600))
+
+# Review enrichments are stored in the database, and cached the same way by a
+# hash of the review text.
+
+ENRICHMENT_CACHE_ALIAS = 'default'
+ENRICHMENT_CACHE_MAXSIZE = int(os.environ.get('ENRICHMENT_CACHE_MAXSIZE', 10000))
+ENRICHMENT_CACHE_TTL = int(os.environ.get('ENRICHMENT_CACHE_TTL', 7 * 24 * 3600))
+
+# Dealers change rarely and are cached in process memory. A cached dealer
+# is fresh for DEALER_CACHE_TTL seconds (DEALER_LIST_CACHE_TTL for the
+# full list), then served stale for up to DEALER_CACHE_STALE_TTL seconds
+# while it is refreshed in the background.
+
+DEALER_CACHE_MAXSIZE = int(os.environ.get('DEALER_CACHE_MAXSIZE', 1024))
+DEALER_CACHE_TTL = float(os.environ.get('DEALER_CACHE_TTL', 600))
+DEALER_LIST_CACHE_TTL = float(os.environ.get('DEALER_LIST_CACHE_TTL', 120))
+DEALER_CACHE_STALE_TTL = float(os.environ.get('DEALER_CACHE_STALE_TTL', 3600))
+
+# The review stats of the dealers of a listing page are cached for
+# DEALER_STATS_CACHE_TTL seconds, then served stale for up to
+# DEALER_STATS_CACHE_STALE_TTL seconds while they are refreshed. The stats
+# of a dealer are dropped from the cache once a review of it is posted.
+
+DEALER_STATS_CACHE_TTL = float(os.environ.get('DEALER_STATS_CACHE_TTL', 60))
+DEALER_STATS_CACHE_STALE_TTL = float(
+    os.environ.get('DEALER_STATS_CACHE_STALE_TTL', 600)
+)
+
+# The rendered dealer rows of the listing and reviews of the dealer details
+# page are cached for DEALER_FRAGMENT_CACHE_TTL seconds, keyed on the review
+# set version of the dealer, which a submitted review replaces (see
+# djangoapp.fragments). 0 disables the fragment cache.
+
+DEALER_FRAGMENT_CACHE_TTL = int(os.environ.get('DEALER_FRAGMENT_CACHE_TTL', 60))
+
+# The dealership listing is paginated by the dealerships service
+
+DEALERS_PAGE_SIZE = 25
+DEALERS_MAX_PAGE_SIZE = 200
+
+# Dealers near a point are searched in an in-memory grid index of every
+# dealer (djangoapp.geo) with cells of GEO_CELL_DEGREES degrees. The index
+# is rebuilt in the background every DEALER_GEO_INDEX_TTL seconds, and when
+# the dealers are invalidated. A search returns at most GEO_MAX_RESULTS
+# dealers.
+
+GEO_CELL_DEGREES = float(os.environ.get('GEO_CELL_DEGREES', 0.5))
+DEALER_GEO_INDEX_TTL = float(os.environ.get('DEALER_GEO_INDEX_TTL', 600))
+GEO_MAX_RESULTS = int(os.environ.get('GEO_MAX_RESULTS', 100))
+
+# Review search (djangoapp.search) uses an inverted index of the reviews,
+# built and kept up to date from the changes feed of the review service by
+# `python manage.py build_review_index` and `update_review_index`, and saved
+# to REVIEW_SEARCH_INDEX_PATH. Web processes reload the file when it
+# changed, checking every REVIEW_SEARCH_RELOAD_INTERVAL seconds.
+
+REVIEW_SEARCH_INDEX_PATH = os.environ.get(
+    'REVIEW_SEARCH_INDEX_PATH', str(BASE_DIR / 'review-index.pickle')
+)
+REVIEW_SEARCH_RELOAD_INTERVAL = float(
+    os.environ.get('REVIEW_SEARCH_RELOAD_INTERVAL', 10)
+)
+REVIEW_SEARCH_PAGE_SIZE = 20
+REVIEW_SEARCH_MAX_PAGE_SIZE = 100
+
+# Reviews are fetched from the review service in pages of this size
+
+REVIEWS_PAGE_SIZE = 100
+
+# Independent upstream fetches of one page run concurrently on at most
+# RESTAPIS_FETCH_WORKERS threads per process. The dealer details page waits
+# at most DEALER_DETAILS_DEADLINE seconds for the dealer and its reviews.
+
+RESTAPIS_FETCH_WORKERS = int(os.environ.get('RESTAPIS_FETCH_WORKERS', 16))
+DEALER_DETAILS_DEADLINE = float(os.environ.get('DEALER_DETAILS_DEADLINE', 8))
+
+# Upstream calls are timed per request and per upstream service
+# (djangoapp.timing). With SERVER_TIMING_HEADER set, responses report the
+# timings in a Server-Timing header, which exposes the upstream names to
+# clients.
+
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', '1') == '1'
+
+# Reviews submitted by users are stored in an outbox table and posted to
+# the review service in the background (djangoapp.outbox), OUTBOX_BATCH_SIZE
+# at a time. A failed post is retried after OUTBOX_RETRY_BASE seconds,
+# doubling with every attempt up to OUTBOX_RETRY_MAX, and given up after
+# OUTBOX_MAX_ATTEMPTS. A drainer leases the rows it posts for OUTBOX_LEASE
+# seconds. Each web process drains the outbox in a thread, polling every
+# OUTBOX_POLL_INTERVAL seconds, unless OUTBOX_DRAIN_IN_PROCESS is off and
+# `python manage.py drain_review_outbox --loop` runs instead.
+
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 50))
+OUTBOX_RETRY_BASE = float(os.environ.get('OUTBOX_RETRY_BASE', 2))
+OUTBOX_RETRY_MAX = float(os.environ.get('OUTBOX_RETRY_MAX', 600))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 12))
+OUTBOX_LEASE = float(os.environ.get('OUTBOX_LEASE', 60))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 5))
+OUTBOX_DRAIN_IN_PROCESS = os.environ.get('OUTBOX_DRAIN_IN_PROCESS', '1') == '1'
@@ -14,3 +14,13 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangobackend.settings')
 
 application = get_wsgi_application()
+
+# Only the web server loads this module (runserver included), not other
+# commands or scripts. Deliver the reviews left pending or awaiting a retry
+# by an earlier run, rather than once the next review is submitted, and
+# warn about missing Cloudant indexes.
+from djangoapp.indexes import start_index_check  # noqa: E402
+from djangoapp.outbox import wake_drainer  # noqa: E402
+
+wake_drainer()
+start_index_check()
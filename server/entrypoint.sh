@@ -10,8 +10,13 @@
         echo "PostgreSQL started"
     fi
 
-    # Make migrations and migrate the database.
-    echo "Making migrations and migrating the database. "
-    python manage.py makemigrations main --noinput
+    # Migrate the database, the migrations are part of the repository.
+    echo "Migrating the database. "
     python manage.py migrate --noinput
+
+    # Create the Cloudant indexes the services query with
+    if [ -n "$IBM_URL" ] && [ -n "$IBM_API_KEY" ]; then
+        echo "Ensuring Cloudant indexes"
+        python manage.py ensure_cloudant_indexes || echo "Unable to ensure Cloudant indexes"
+    fi
     exec "$@"
\ No newline at end of file